@@ -108,8 +108,74 @@ else:
         }
     }
 
-# Use the default authentication backend only
+# Hot shared data (users, document metadata, listings). With Redis, each
+# worker keeps a small short-lived LRU in front of it; writes invalidate
+# the other workers' copies over pub/sub.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "documents.utils.tiered_cache.TieredCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+            "KEY_PREFIX": "shared",
+            "OPTIONS": {
+                "L1_MAX_ENTRIES": int(os.environ.get("L1_CACHE_MAX_ENTRIES", "1000")),
+                "L1_TIMEOUT": float(os.environ.get("L1_CACHE_TIMEOUT", "5")),
+            },
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Answers to repeated questions; shared between workers when Redis is available.
+# LocMemCache culls least recently used entries beyond MAX_ENTRIES; Redis should
+# be configured with `maxmemory-policy allkeys-lru`.
+if os.getenv("REDIS_URL"):
+    CACHES["answers"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL"),
+        "KEY_PREFIX": "answers",
+    }
+else:
+    CACHES["answers"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "answers",
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))},
+    }
+
+ANSWER_CACHE_ALIAS = "answers"
+ANSWER_CACHE_TIMEOUT = int(os.environ.get("ANSWER_CACHE_TIMEOUT", str(24 * 60 * 60)))
+
+# Short-lived locks and shared state that every worker must agree on
+if os.getenv("REDIS_URL"):
+    CACHES["coordination"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL"),
+        "KEY_PREFIX": "coord",
+    }
+else:
+    CACHES["coordination"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "coordination",
+    }
+
+COORDINATION_CACHE_ALIAS = "coordination"
+
+# Concurrent preparation of the same document waits for the first caller
+SINGLE_FLIGHT = {
+    # Lock lifetime; a crashed worker's lock expires after this many seconds
+    "lock_timeout": int(os.environ.get("SINGLE_FLIGHT_LOCK_TIMEOUT", "120")),
+    # Give up waiting on another worker and do the work after this long
+    "wait_timeout": int(os.environ.get("SINGLE_FLIGHT_WAIT_TIMEOUT", "90")),
+}
+
+# ModelBackend with cached user lookups. The plain ModelBackend stays listed
+# so sessions created before the switch remain valid.
 AUTHENTICATION_BACKENDS = [
+    'accounts.auth_backend.CachedModelBackend',
     'django.contrib.auth.backends.ModelBackend',
 ]
 
@@ -215,6 +281,15 @@ if RESEND_API_KEY:
 else:
     print("⚠️ WARNING: RESEND_API_KEY is not set!")
 
+# OTP emails are sent by a fixed pool of threads from a bounded queue
+EMAIL_DISPATCH = {
+    "workers": int(os.environ.get("EMAIL_WORKERS", "2")),
+    "max_queue": int(os.environ.get("EMAIL_MAX_QUEUE", "100")),
+    "max_retries": int(os.environ.get("EMAIL_MAX_RETRIES", "3")),
+    "retry_base": float(os.environ.get("EMAIL_RETRY_BASE", "1")),
+    "retry_max": float(os.environ.get("EMAIL_RETRY_MAX", "10")),
+}
+
 # EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 # EMAIL_HOST = "smtp.gmail.com" 
 # EMAIL_PORT = 587
@@ -266,6 +341,36 @@ if all([CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET]):
     }
     DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.RawMediaCloudinaryStorage"
 
+# Uploads can be staged on local disk and copied to remote storage by a
+# background job; the staging dir must be shared with the job workers
+WRITE_BEHIND_STORAGE = {
+    # Opt-in: the staging directory must be shared by the web and worker
+    # processes and survive restarts (not a per-dyno ephemeral disk)
+    "enabled": bool(os.environ.get("WRITE_BEHIND_DIR"))
+    and os.environ.get("WRITE_BEHIND_ENABLED", "True").lower() == "true",
+    "dir": os.environ.get("WRITE_BEHIND_DIR", ""),
+    "remote": "cloudinary_storage.storage.RawMediaCloudinaryStorage",
+    "max_attempts": int(os.environ.get("WRITE_BEHIND_MAX_ATTEMPTS", "10")),
+    # Keep the staged copy this long after replication for open readers
+    "retain_after_replication": int(os.environ.get("WRITE_BEHIND_RETAIN", "3600")),
+}
+
+# Fingerprint uploads while they stream in (see Document.content_hash)
+FILE_UPLOAD_HANDLERS = [
+    "documents.upload_handlers.HashingMemoryFileUploadHandler",
+    "documents.upload_handlers.HashingTemporaryFileUploadHandler",
+]
+
+# Resumable chunked uploads, staged on local disk (empty dir = system temp).
+# The staging dir must be shared by every worker serving upload requests.
+CHUNKED_UPLOAD = {
+    "dir": os.environ.get("CHUNKED_UPLOAD_DIR", ""),
+    "chunk_size": int(os.environ.get("CHUNKED_UPLOAD_CHUNK_SIZE", str(2 * 1024 * 1024))),
+    "max_chunk_size": int(os.environ.get("CHUNKED_UPLOAD_MAX_CHUNK_SIZE", str(8 * 1024 * 1024))),
+    # Uploads with no new chunk for this long are discarded
+    "expire_after": int(os.environ.get("CHUNKED_UPLOAD_EXPIRE_AFTER", str(24 * 60 * 60))),
+}
+
 # Allow internal previews (iframes) for uploaded documents
 X_FRAME_OPTIONS = 'SAMEORIGIN'
 
@@ -276,11 +381,145 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_API_KEY= os.environ.get('GOOGLE_API_KEY')
 
+# Re-upload cached Gemini file handles this many seconds before they expire
+GEMINI_FILE_EXPIRY_MARGIN = int(os.environ.get("GEMINI_FILE_EXPIRY_MARGIN", "600"))
+
+# Shared on-disk LRU of downloaded document files (empty dir = system temp)
+BLOB_CACHE = {
+    "dir": os.environ.get("BLOB_CACHE_DIR", ""),
+    "max_bytes": int(os.environ.get("BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    # Serve without revalidating for this many seconds after the last check
+    "revalidate_after": int(os.environ.get("BLOB_CACHE_REVALIDATE_AFTER", "300")),
+    # Never evict blobs used more recently than this (they may still be open)
+    "eviction_grace": int(os.environ.get("BLOB_CACHE_EVICTION_GRACE", "120")),
+    "pool_size": int(os.environ.get("BLOB_CACHE_POOL_SIZE", "10")),
+}
+
+# Page images rendered for the document preview
+PAGE_IMAGES = {
+    "dir": os.environ.get("PAGE_IMAGES_DIR", ""),
+    "max_bytes": int(os.environ.get("PAGE_IMAGES_MAX_BYTES", str(256 * 1024 * 1024))),
+    # Resolutions a client may ask for; other values snap to the nearest
+    "dpis": [int(dpi) for dpi in os.environ.get("PAGE_IMAGES_DPIS", "72,110,150").split(",")],
+    "default_dpi": int(os.environ.get("PAGE_IMAGES_DEFAULT_DPI", "110")),
+    "thumbnail_width": int(os.environ.get("PAGE_IMAGES_THUMBNAIL_WIDTH", "240")),
+    "jpeg_quality": int(os.environ.get("PAGE_IMAGES_JPEG_QUALITY", "80")),
+    # Renders never change, so browsers may keep them this long
+    "max_age": int(os.environ.get("PAGE_IMAGES_MAX_AGE", str(365 * 24 * 60 * 60))),
+}
+
+# Gemini file uploads: retry backoff, processing-state polling and its timeout
+GEMINI_UPLOAD = {
+    "workers": int(os.environ.get("GEMINI_UPLOAD_WORKERS", "4")),
+    "timeout": int(os.environ.get("GEMINI_UPLOAD_TIMEOUT", "30")),
+    # Longest a caller waits for an upload, retries included
+    "wait_timeout": float(os.environ.get("GEMINI_UPLOAD_WAIT_TIMEOUT", "150")),
+    "poll_initial": float(os.environ.get("GEMINI_UPLOAD_POLL_INITIAL", "0.5")),
+    "poll_max": float(os.environ.get("GEMINI_UPLOAD_POLL_MAX", "8")),
+    "retry_base": float(os.environ.get("GEMINI_UPLOAD_RETRY_BASE", "1")),
+    "retry_max": float(os.environ.get("GEMINI_UPLOAD_RETRY_MAX", "16")),
+}
+
+# Background jobs run by `manage.py run_worker`
+JOB_QUEUE = {
+    "concurrency": int(os.environ.get("JOB_WORKER_CONCURRENCY", "2")),
+    "poll_interval": float(os.environ.get("JOB_POLL_INTERVAL", "1")),
+    # A job whose worker stops renewing its lease for this long is retried elsewhere
+    "visibility_timeout": int(os.environ.get("JOB_VISIBILITY_TIMEOUT", "300")),
+    "max_attempts": int(os.environ.get("JOB_MAX_ATTEMPTS", "3")),
+    "retry_base": float(os.environ.get("JOB_RETRY_BASE", "5")),
+    "retry_max": float(os.environ.get("JOB_RETRY_MAX", "300")),
+    # Succeeded jobs are deleted after this many seconds
+    "keep_finished": int(os.environ.get("JOB_KEEP_FINISHED", str(7 * 24 * 60 * 60))),
+}
+
+# Per-process limits for blocking Gemini calls (0 = unbounded queue)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "64"))
+
+# Per-process limits for building chat context that has to download, ingest or
+# upload the document; seconds a chat waits for it before giving up
+CONTEXT_MAX_CONCURRENCY = int(os.environ.get("CONTEXT_MAX_CONCURRENCY", "8"))
+CONTEXT_MAX_QUEUE = int(os.environ.get("CONTEXT_MAX_QUEUE", "64"))
+CONTEXT_TIMEOUT = float(os.environ.get("CONTEXT_TIMEOUT", "180"))
+
+# Adaptive concurrency limit and circuit breaker shared by all workers
+LLM_GUARD = {
+    "initial_limit": int(os.environ.get("LLM_GUARD_INITIAL_LIMIT", "8")),
+    "min_limit": int(os.environ.get("LLM_GUARD_MIN_LIMIT", "1")),
+    "max_limit": int(os.environ.get("LLM_GUARD_MAX_LIMIT", "32")),
+    # Calls slower than this (seconds to first token) shrink the limit
+    "target_latency": float(os.environ.get("LLM_GUARD_TARGET_LATENCY", "8")),
+    "decrease_factor": float(os.environ.get("LLM_GUARD_DECREASE_FACTOR", "0.7")),
+    "decrease_interval": int(os.environ.get("LLM_GUARD_DECREASE_INTERVAL", "5")),
+    # Open the breaker when this share of recent calls failed
+    "error_threshold": float(os.environ.get("LLM_GUARD_ERROR_THRESHOLD", "0.5")),
+    "min_calls": int(os.environ.get("LLM_GUARD_MIN_CALLS", "10")),
+    "window_seconds": int(os.environ.get("LLM_GUARD_WINDOW", "60")),
+    "open_seconds": int(os.environ.get("LLM_GUARD_OPEN_SECONDS", "15")),
+    "max_open_seconds": int(os.environ.get("LLM_GUARD_MAX_OPEN_SECONDS", "120")),
+}
+
+# "retrieval" sends only the best matching passages; "whole_file" sends the document
+DOCUMENT_CONTEXT_MODE = os.environ.get("DOCUMENT_CONTEXT_MODE", "retrieval")
+
+# Whole-file questions about a PDF attach only the pages they concern
+PAGE_SLICES = {
+    "enabled": os.environ.get("PAGE_SLICES_ENABLED", "True").lower() == "true",
+    "max_pages": int(os.environ.get("PAGE_SLICES_MAX_PAGES", "8")),
+    # Pages either side of the viewed or best matching page
+    "neighbour_pages": int(os.environ.get("PAGE_SLICES_NEIGHBOUR_PAGES", "1")),
+    "matched_pages": int(os.environ.get("PAGE_SLICES_MATCHED_PAGES", "3")),
+    # Beyond this share of the document the whole file is sent instead
+    "max_fraction": float(os.environ.get("PAGE_SLICES_MAX_FRACTION", "0.5")),
+}
+
+RETRIEVAL = {
+    "chunk_tokens": int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", "300")),
+    "overlap_tokens": int(os.environ.get("RETRIEVAL_OVERLAP_TOKENS", "50")),
+    "top_k": int(os.environ.get("RETRIEVAL_TOP_K", "6")),
+    "token_budget": int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", "2000")),
+    # Below this much text per page the document is treated as scanned
+    "min_chars_per_page": int(os.environ.get("RETRIEVAL_MIN_CHARS_PER_PAGE", "100")),
+    "index_cache_size": int(os.environ.get("RETRIEVAL_INDEX_CACHE_SIZE", "32")),
+}
+
+# Older turns beyond the token budget are folded into ChatSession.summary
+CHAT_HISTORY = {
+    "token_budget": int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", "1500")),
+    "summary_words": int(os.environ.get("CHAT_SUMMARY_WORDS", "200")),
+    # Messages rendered with the chat page and loaded per scroll-back request
+    "page_size": int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", "30")),
+    "max_page_size": int(os.environ.get("CHAT_HISTORY_MAX_PAGE_SIZE", "100")),
+}
+
+# Sidebar document listings; the first page is cached per user
+DOCUMENT_LIST = {
+    "page_size": int(os.environ.get("DOCUMENT_LIST_PAGE_SIZE", "20")),
+    "max_page_size": int(os.environ.get("DOCUMENT_LIST_MAX_PAGE_SIZE", "100")),
+    "cache_timeout": int(os.environ.get("DOCUMENT_LIST_CACHE_TIMEOUT", str(10 * 60))),
+}
+
+# Per-object entries in the default cache, dropped by signals on change
+METADATA_CACHE = {
+    "user_timeout": int(os.environ.get("USER_CACHE_TIMEOUT", str(15 * 60))),
+    "document_timeout": int(os.environ.get("DOCUMENT_CACHE_TIMEOUT", str(15 * 60))),
+}
+
 RATE_LIMITS = {
     "upload": {
         "limit": int(os.environ.get("UPLOAD_RATE_LIMIT", "5")),
         "window": int(os.environ.get("UPLOAD_RATE_WINDOW", "60")),
     },
+    # Chat messages per user across all documents, and per document
+    "chat_user": {
+        "limit": int(os.environ.get("CHAT_USER_RATE_LIMIT", "30")),
+        "window": int(os.environ.get("CHAT_USER_RATE_WINDOW", "60")),
+    },
+    "chat_document": {
+        "limit": int(os.environ.get("CHAT_DOCUMENT_RATE_LIMIT", "15")),
+        "window": int(os.environ.get("CHAT_DOCUMENT_RATE_WINDOW", "60")),
+    },
 }
 
 SECURE_BROWSER_XSS_FILTER = True
@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 
 class EmailBackend(ModelBackend):
@@ -36,3 +38,60 @@ class EmailBackend(ModelBackend):
             return None
 
 
+def user_cache_key(user_id):
+    return f"user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose per-request user lookup is served from the cache.
+
+    The cache holds the user's field values without the password hash, plus
+    the session auth hash (an HMAC of the password) that the session check
+    compares. The password stays a deferred field on the returned user and is
+    only loaded if something reads it.
+
+    Entries are dropped by signals whenever the user is saved or deleted.
+    ``QuerySet.update()`` sends no signals, so a bulk change (such as
+    deactivating users) is only seen once the entry expires after
+    ``METADATA_CACHE["user_timeout"]`` seconds.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        key = user_cache_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                user = UserModel._default_manager.get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            entry = {
+                "fields": {
+                    field.attname: getattr(user, field.attname)
+                    for field in UserModel._meta.concrete_fields
+                    if field.attname != "password"
+                },
+                "session_hash": user.get_session_auth_hash(),
+            }
+            cache.set(key, entry, timeout=getattr(settings, "METADATA_CACHE", {}).get("user_timeout", 15 * 60))
+        else:
+            fields = entry["fields"]
+            user = UserModel.from_db(
+                UserModel._default_manager.db, list(fields), list(fields.values())
+            )
+            user.get_session_auth_hash = _cached_session_hash(user, entry["session_hash"])
+
+        return user if self.user_can_authenticate(user) else None
+
+
+def _cached_session_hash(user, session_hash):
+    """Serve the cached HMAC until the password is loaded or changed."""
+    compute = user.get_session_auth_hash
+
+    def get_session_auth_hash():
+        if "password" in user.get_deferred_fields():
+            return session_hash
+        return compute()
+
+    return get_session_auth_hash
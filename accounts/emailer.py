@@ -1,18 +1,148 @@
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+"""Outgoing email, sent by a small fixed pool of background threads.
+
+Views call ``queue_otp_email``, which returns at once. Messages wait in a
+bounded queue. When the queue is full, the message is refused instead of
+starting another thread, and the caller asks the user to try again.
+Workers retry transient Resend failures (rate limiting, 5xx, network
+errors) with exponential backoff.
+"""
+
+import logging
+import queue
+import random
+import threading
+import time
+from functools import lru_cache
+
+import requests
 import resend
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.html import strip_tags
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {"queued": 0, "rejected": 0, "sent": 0, "retried": 0, "failed": 0}
+
+
+def email_setting(name, default):
+    return getattr(settings, "EMAIL_DISPATCH", {}).get(name, default)
+
+
+def _record(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+@lru_cache(maxsize=None)
+def _otp_template():
+    # Compiled once per process instead of on every message
+    return get_template('emails/otp_email.html')
+
+
+def is_transient(e):
+    """Worth retrying: rate limiting, server errors and network failures."""
+    if isinstance(e, resend.exceptions.ResendError):
+        try:
+            code = int(e.code)
+        except (TypeError, ValueError):
+            return False
+        return code == 429 or code >= 500
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError, TimeoutError))
+
 
 def sendOTPToEmail(email, subject, otp):
-    try:
-        html_content = render_to_string('emails/otp_email.html', {'otp': otp})
-        text_content = strip_tags(html_content)
-
-        resend.Emails.send({
-            "from": "noreply@insightdocs.in",
-            "to": email,
-            "subject": subject,
-            "html": html_content,
-            "text": text_content,
-        })
-    except Exception as e:
-        print("Resend email failed:", str(e))
+    """Send one OTP email now, retrying transient failures. Returns True if it was sent."""
+    html_content = _otp_template().render({'otp': otp})
+    text_content = strip_tags(html_content)
+
+    max_retries = email_setting("max_retries", 3)
+    for attempt in range(max_retries + 1):
+        try:
+            resend.Emails.send({
+                "from": "noreply@insightdocs.in",
+                "to": email,
+                "subject": subject,
+                "html": html_content,
+                "text": text_content,
+            })
+            _record("sent")
+            return True
+        except Exception as e:
+            if attempt >= max_retries or not is_transient(e):
+                _record("failed")
+                logger.error(f"Resend email to {email} failed: {str(e)}")
+                return False
+
+            base = email_setting("retry_base", 1.0)
+            delay = random.uniform(base, min(email_setting("retry_max", 10.0), base * 2 ** attempt))
+            _record("retried")
+            logger.warning(f"Resend email to {email} failed ({str(e)}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class EmailDispatcher:
+    """Bounded queue drained by a fixed number of sender threads."""
+
+    def __init__(self, workers, max_queue):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"email-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, email, subject, otp):
+        """Queue a message; False if the queue is full."""
+        try:
+            self._queue.put_nowait((email, subject, otp))
+        except queue.Full:
+            _record("rejected")
+            logger.warning(f"Email queue full; refused message to {email}")
+            return False
+        _record("queued")
+        return True
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            email, subject, otp = self._queue.get()
+            try:
+                sendOTPToEmail(email, subject, otp)
+            except Exception as e:
+                _record("failed")
+                logger.error(f"Email to {email} could not be rendered or sent: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_email_dispatcher():
+    """Process-wide dispatcher, started on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EmailDispatcher(
+                workers=email_setting("workers", 2),
+                max_queue=email_setting("max_queue", 100),
+            )
+        return _dispatcher
+
+
+def queue_otp_email(email, subject, otp):
+    """Send an OTP email in the background. Returns False if the queue is full."""
+    return get_email_dispatcher().submit(email, subject, otp)
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = _dispatcher.depth() if _dispatcher else 0
+    return stats
@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth_backend import user_cache_key
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def drop_cached_user(sender, instance, **kwargs):
+    """Password, activation and login changes must not be served stale."""
+    cache.delete(user_cache_key(instance.pk))
@@ -1,3 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from .auth_backend import CachedModelBackend, user_cache_key
+
+BACKEND = "accounts.auth_backend.CachedModelBackend"
+
+
+class CachedModelBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+
+    def test_cache_holds_no_password_hash(self):
+        CachedModelBackend().get_user(self.user.pk)
+
+        entry = cache.get(user_cache_key(self.user.pk))
+        self.assertNotIn("password", entry["fields"])
+        self.assertNotIn(self.user.password, repr(entry))
+
+    def test_cached_user_keeps_the_session(self):
+        self.client.force_login(self.user, backend=BACKEND)
+        self.assertEqual(self.client.get("/documents/").status_code, 200)
+
+        cached = CachedModelBackend().get_user(self.user.pk)
+        self.assertEqual(cached.get_deferred_fields(), {"password"})
+        self.assertEqual(cached.email, "reader@example.com")
+        # Served from the cache: the session check does not load the user
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get("/documents/").status_code, 200)
+        user_table = get_user_model()._meta.db_table
+        self.assertFalse([q for q in queries.captured_queries if user_table in q["sql"]])
+
+    def test_password_change_ends_other_sessions(self):
+        self.client.force_login(self.user, backend=BACKEND)
+        self.client.get("/documents/")
+
+        self.user.set_password("changed")
+        self.user.save()
+
+        self.assertEqual(self.client.get("/documents/").status_code, 302)
+
+    def test_password_set_on_cached_user_uses_the_new_hash(self):
+        CachedModelBackend().get_user(self.user.pk)
+        cached = CachedModelBackend().get_user(self.user.pk)
+        old_hash = cached.get_session_auth_hash()
+
+        cached.set_password("changed")
+        self.assertNotEqual(cached.get_session_auth_hash(), old_hash)
@@ -7,12 +7,11 @@ from django.shortcuts import redirect, render
 import random
 import logging
 
-from .emailer import sendOTPToEmail
+from .emailer import queue_otp_email
 from .forms import ProfileUpdateForm
 from .models import User
 
-from documents.models import Document
-from threading import Thread
+from documents.utils import document_list
 
 logger = logging.getLogger(__name__)
 
@@ -53,15 +52,13 @@ def register_view(request):
         request.session['registration_otp'] = otp
         subject = "Verify your InsightDocs AI Account"
         
-        try:
-            # Use threading to avoid blocking, and add error handling
-            Thread(target=sendOTPToEmail, args=(email, subject, otp)).start()
+        # Sent in the background by the bounded email dispatcher
+        if queue_otp_email(email, subject, otp):
             messages.success(request, "We have sent a 6-digit OTP to your email.")
             return redirect('verify_otp')
-        except Exception as e:
-            logger.error(f"Failed to send OTP to {email}: {str(e)}")
-            messages.error(request, "Failed to send OTP. Please try again.")
-            return render(request, 'signup.html')
+
+        messages.error(request, "Failed to send OTP. Please try again in a minute.")
+        return render(request, 'signup.html')
 
     # GET request → show signup form
     return render(request, 'signup.html')
@@ -75,7 +72,7 @@ def login_view(request):
         try:
             user = User.objects.get(email=email)
             if user.check_password(password):
-                login(request, user)
+                login(request, user, backend="accounts.auth_backend.CachedModelBackend")
                 return redirect('upload')
             else:
                 messages.error(request, "Invalid password")
@@ -108,9 +105,13 @@ def profile_view(request):
     else:
         form = ProfileUpdateForm(instance=request.user)
         
-    documents = Document.objects.filter(owner=request.user).order_by('-uploaded_at')
+    page = document_list.first_page(request.user.id)
 
-    return render(request, 'profile.html', {'form': form, 'recent_documents': documents})
+    return render(request, 'profile.html', {
+        'form': form,
+        'recent_documents': page['documents'],
+        'documents_cursor': page['next_cursor'],
+    })
 
 
 # ----------------- OTP Verification (registration) -----------------
@@ -190,7 +191,9 @@ def password_reset_request(request):
             'otp': otp,
         }
         subject = "Reset your Password"
-        Thread(target=sendOTPToEmail, args=(email, subject, otp)).start()
+        if not queue_otp_email(email, subject, otp):
+            messages.error(request, "Failed to send verification code. Please try again in a minute.")
+            return redirect('password_reset')
         messages.success(request, "We sent a 6-digit verification code to your email.")
 
         return redirect('verify_reset_otp')
@@ -252,12 +255,9 @@ def resend_reset_otp(request):
     request.session['reset_password_data'] = reset_data
     subject = "New Password Reset Code"
     
-    try:
-        Thread(target=sendOTPToEmail, args=(email, subject, otp)).start()
+    if queue_otp_email(email, subject, otp):
         return JsonResponse({'message': 'A new verification code has been sent to your email.'})
-    except Exception as e:
-        logger.error(f"Failed to resend OTP to {email}: {str(e)}")
-        return JsonResponse({'error': 'Failed to send verification code. Please try again.'}, status=500)
+    return JsonResponse({'error': 'Failed to send verification code. Please try again in a minute.'}, status=503)
 
 
 def reset_password(request):
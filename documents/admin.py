@@ -1,13 +1,30 @@
 from django.contrib import admin
+from django.utils import timezone
 
-from .models import ChatMessage, ChatSession, Document
+from .models import ChatMessage, ChatSession, Document, FileReplica, GeminiFile, Job
+from .utils import answer_cache
 
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ("title", "owner", "uploaded_at")
-    search_fields = ("title", "owner__username", "original_name")
-    list_filter = ("uploaded_at",)
+    list_display = ("title", "owner", "ingestion_status", "uploaded_at")
+    search_fields = ("title", "owner__username", "original_name", "content_hash")
+    list_filter = ("ingestion_status", "uploaded_at")
+    actions = ("clear_cached_answers",)
+
+    @admin.action(description="Clear cached answers")
+    def clear_cached_answers(self, request, queryset):
+        hashes = set(queryset.exclude(content_hash="").values_list("content_hash", flat=True))
+        for content_hash in hashes:
+            answer_cache.invalidate_document(content_hash)
+        self.message_user(request, f"Cleared cached answers for {len(hashes)} document(s).")
+
+
+@admin.register(GeminiFile)
+class GeminiFileAdmin(admin.ModelAdmin):
+    list_display = ("name", "state", "expires_at", "updated_at")
+    search_fields = ("name", "content_hash")
+    list_filter = ("state",)
 
 
 class ChatMessageInline(admin.TabularInline):
@@ -21,3 +38,25 @@ class ChatSessionAdmin(admin.ModelAdmin):
     list_display = ("document", "user", "updated_at")
     search_fields = ("document__title", "user__username")
     inlines = (ChatMessageInline,)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "priority", "attempts", "progress", "run_after", "created_at")
+    search_fields = ("name", "locked_by", "last_error")
+    list_filter = ("status", "name")
+    actions = ("retry_now",)
+
+    @admin.action(description="Retry now")
+    def retry_now(self, request, queryset):
+        count = queryset.exclude(status="running").update(
+            status="queued", attempts=0, run_after=timezone.now(), last_error="", finished_at=None
+        )
+        self.message_user(request, f"Queued {count} job(s) again.")
+
+
+@admin.register(FileReplica)
+class FileReplicaAdmin(admin.ModelAdmin):
+    list_display = ("name", "state", "remote_name", "attempts", "created_at", "replicated_at")
+    search_fields = ("name", "remote_name")
+    list_filter = ("state",)
@@ -1,16 +1,36 @@
 
 import asyncio
+import contextvars
 import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Document, ChatSession, ChatMessage
-from .utils.gemini_chat import get_gemini_response
-from .utils.storage import prepare_local_document
+from django.conf import settings
+from .models import ChatSession, ChatMessage
+from .utils import answer_cache, document_cache
+from .utils.async_stream import iterate_in_thread
+from .utils.gemini_chat import GeminiResponseError, stream_gemini_response
+from .utils.history import history_window, message_page, needs_summary, serialize_message, update_summary
+from .utils.keyset import decode_cursor
+from .utils.context import build_context, stored_passage_context
+from .utils.file_poller import cancel_owner, upload_owner
+from .utils.llm_executor import LLMQueueFullError, get_context_executor, get_llm_executor
+from .utils.llm_guard import LLMUnavailableError
+from .utils.notify import chat_group_name
+from .utils.rate_limit import check_chat_rate_limit
 
 logger = logging.getLogger(__name__)
 
 
+def viewing_page(data):
+    """Page of the document the client says the user is viewing, if any"""
+    try:
+        page = int(data.get('page') or 0)
+    except (TypeError, ValueError):
+        return None
+    return page if page > 0 else None
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Handle WebSocket connection"""
@@ -20,15 +40,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        self.room_group_name = f"chat_{self.document_id}_{self.user.id}"
+        self.room_group_name = chat_group_name(self.document_id, self.user.id)
+        self.reply_lock = asyncio.Lock()
+        self.reply_tasks = set()
 
         # Check if user has permission to access document
-        has_permission = await self.check_document_permission()
+        document = await self.get_document()
         
-        if not has_permission:
+        if not document:
             await self.close()
             return
 
+        # Conversation state is loaded once and then kept up to date in memory
+        self.document = document
+        self.session, self.history = await self.load_conversation(document)
+        self.conversation_stale = False
+
         # Join room group (if channel_layer is configured)
         if self.channel_layer is not None:
             try:
@@ -42,8 +69,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
         logger.info(f"WebSocket connected: {self.user.username} - Doc {self.document_id}")
 
+        # Let the page know whether upload-time ingestion has finished
+        await self.send(text_data=json.dumps({
+            'type': 'ingestion_status',
+            'status': document.ingestion_status,
+            'progress': 100 if document.ingestion_status == 'ready' else None,
+            'message': document.ingestion_error,
+        }))
+
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        # Stop answering, and stop waiting on uploads, for a client that left
+        for task in getattr(self, "reply_tasks", ()):
+            task.cancel()
+        cancel_owner(self.channel_name)
+
         # Leave room group (if channel_layer is configured)
         if self.channel_layer is not None:
             try:
@@ -62,9 +102,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message_type = data.get('type')
             
             if message_type == 'chat_message':
-                await self.handle_chat_message(data)
+                limit_result = await asyncio.to_thread(
+                    check_chat_rate_limit, self.user.id, self.document_id
+                )
+                if limit_result.limited:
+                    await self.send_error(
+                        f"You're sending messages too quickly. "
+                        f"Please wait {limit_result.retry_after} seconds and try again.",
+                        retry_after=limit_result.retry_after
+                    )
+                    return
+                self.start_reply(data)
             elif message_type == 'typing':
                 await self.handle_typing(data)
+            elif message_type == 'history_page':
+                await self.handle_history_page(data)
             else:
                 await self.send_error("Unknown message type")
                 
@@ -74,6 +126,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error in receive: {str(e)}", exc_info=True)
             await self.send_error(f"Server error: {str(e)}")
 
+    def start_reply(self, data):
+        """Answer in a task so that a disconnect can cancel it"""
+        task = asyncio.create_task(self.run_reply(data))
+        self.reply_tasks.add(task)
+        task.add_done_callback(self.reply_tasks.discard)
+
+    async def run_reply(self, data):
+        """Answer messages one at a time, in the order they arrived"""
+        async with self.reply_lock:
+            # Uploads started for this reply are cancelled if the socket closes
+            upload_owner.set(self.channel_name)
+            try:
+                await self.handle_chat_message(data)
+            except Exception as e:
+                logger.error(f"Error handling chat message: {str(e)}", exc_info=True)
+                await self.send_error(f"Server error: {str(e)}")
+
     async def handle_chat_message(self, data):
         """Handle incoming chat message"""
         content = data.get('content', '').strip()
@@ -82,16 +151,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Message cannot be empty")
             return
 
-        # Get document and session
-        document = await self.get_document()
-        if not document:
-            await self.send_error("Document not found")
-            return
+        # Reload only if another tab or a summary update changed the conversation
+        if self.conversation_stale:
+            self.session, self.history = await self.load_conversation(self.document)
+            self.conversation_stale = False
 
-        session = await self.get_or_create_session(document)
+        document, session = self.document, self.session
+        chat_history = list(self.history)
 
         # Save user message
         user_msg = await self.save_user_message(session, content)
+        self.remember(user_msg)
 
         # Send acknowledgment to client
         await self.send(text_data=json.dumps({
@@ -101,11 +171,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'timestamp': user_msg.created_at.isoformat()
         }))
 
-        # Get chat history
-        chat_history = await self.get_chat_history(session)
-
         # Process with Gemini (offload to thread pool)
-        await self.process_ai_response(document, session, content, chat_history)
+        await self.process_ai_response(document, session, content, chat_history, viewing_page(data))
+
+    async def handle_history_page(self, data):
+        """Send a page of messages older than the given cursor"""
+        before = data.get('before')
+        if before is not None and (not isinstance(before, str) or decode_cursor(before) is None):
+            await self.send_error("Invalid history cursor")
+            return
+
+        page = await self.get_history_page(before, data.get('limit'))
+        await self.send(text_data=json.dumps({
+            'type': 'history_page',
+            'messages': page['messages'],
+            'next_cursor': page['next_cursor'],
+        }))
 
     async def handle_typing(self, data):
         """Broadcast typing indicator"""
@@ -121,48 +202,151 @@ class ChatConsumer(AsyncWebsocketConsumer):
             except Exception as e:
                 logger.error(f"Error sending typing indicator: {str(e)}")
 
-    async def process_ai_response(self, document, session, user_message, chat_history):
+    async def process_ai_response(self, document, session, user_message, chat_history, page=None):
         """Process message through Gemini AI"""
         try:
-            # Notify client that AI is processing
-            await self.send(text_data=json.dumps({
-                'type': 'ai_thinking',
-                'status': 'processing'
-            }))
-
-            # Ensure we have a local copy of the document for Gemini ingestion
-            local_path, cleanup = await asyncio.to_thread(prepare_local_document, document)
-
-            try:
-                ai_response = await self.get_gemini_response_async(
-                    user_message,
-                    local_path,
-                    chat_history
-                )
-            finally:
-                await asyncio.to_thread(cleanup)
-
-            # Save AI message
+            window = history_window(chat_history)
+            # The answer may depend on the page the user is looking at
+            cache_question = f"{user_message} [viewing page {page}]" if page else user_message
+
+            # Repeated question on the same content: answer straight from the cache
+            ai_response = await asyncio.to_thread(
+                answer_cache.get_answer,
+                document.content_hash,
+                cache_question,
+                window,
+                session.summary
+            )
+            cached = ai_response is not None
+
+            if not cached:
+                # Notify client that AI is processing
+                await self.send(text_data=json.dumps({
+                    'type': 'ai_thinking',
+                    'status': 'processing'
+                }))
+
+                # Retrieved passages from the stored index, or else the whole
+                # remote file (or pages of it), ingesting inline if needed
+                context = await asyncio.to_thread(stored_passage_context, document, user_message)
+                if context is None:
+                    context = await self.prepare_context(document, user_message, page)
+
+                try:
+                    ai_response = await self.stream_ai_response(
+                        user_message,
+                        context,
+                        window,
+                        session.summary
+                    )
+                    await asyncio.to_thread(
+                        answer_cache.store_answer,
+                        document.content_hash,
+                        cache_question,
+                        window,
+                        session.summary,
+                        ai_response
+                    )
+                except GeminiResponseError as e:
+                    ai_response = str(e)
+
+            # Save AI message once the full answer is known
             ai_msg = await self.save_ai_message(session, ai_response)
+            self.remember(ai_msg)
+            await self.announce_conversation_change()
 
-            # Send AI response to client
+            # Final frame carries the persisted message id
             await self.send(text_data=json.dumps({
                 'type': 'ai_message',
                 'id': ai_msg.id,
                 'content': ai_response,
-                'timestamp': ai_msg.created_at.isoformat()
+                'timestamp': ai_msg.created_at.isoformat(),
+                'streamed': not cached,
+                'cached': cached
             }))
 
+            # Fold turns that no longer fit the history budget into the summary
+            if needs_summary(self.history):
+                try:
+                    get_llm_executor().submit(update_summary, session.id)
+                except LLMQueueFullError:
+                    logger.info(f"Deferring summary update for session {session.id}")
+
+        except LLMQueueFullError as e:
+            logger.warning(f"LLM queue full, rejecting message from {self.user.username}")
+            await self.send_error(str(e))
+        except TimeoutError:
+            logger.warning(f"Context for document {document.id} not ready in time for {self.user.username}")
+            await self.send_error("Preparing the document is taking longer than expected. Please try again shortly.")
+        except LLMUnavailableError as e:
+            logger.warning(f"AI service unavailable, rejecting message from {self.user.username}")
+            await self.send_error(str(e), retry_after=e.retry_after)
         except Exception as e:
             logger.error(f"Error processing AI response: {str(e)}", exc_info=True)
             await self.send_error(f"AI Error: {str(e)}")
 
-    async def send_error(self, message):
+    async def prepare_context(self, document, user_message, page):
+        """build_context on the bounded context executor, waiting at most CONTEXT_TIMEOUT"""
+        # Copy the context so upload_owner reaches the thread and cancel_owner works
+        future = get_context_executor().submit(
+            contextvars.copy_context().run, build_context, document, user_message, page
+        )
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future), timeout=getattr(settings, "CONTEXT_TIMEOUT", 180)
+        )
+
+    async def stream_ai_response(self, user_message, context, chat_history, summary):
+        """Relay Gemini output as ai_chunk frames; returns the full response text"""
+        parts = []
+        async for chunk in iterate_in_thread(
+            stream_gemini_response,
+            user_message,
+            context,
+            chat_history,
+            summary,
+            executor=get_llm_executor()
+        ):
+            parts.append(chunk)
+            await self.send(text_data=json.dumps({
+                'type': 'ai_chunk',
+                'content': chunk
+            }))
+        return "".join(parts)
+
+    async def send_error(self, message, retry_after=None):
         """Send error message to client"""
-        await self.send(text_data=json.dumps({
+        payload = {
             'type': 'error',
             'message': message
-        }))
+        }
+        if retry_after is not None:
+            payload['retry_after'] = retry_after
+        await self.send(text_data=json.dumps(payload))
+
+    def remember(self, message):
+        """Append a saved message to the in-memory history"""
+        self.history.append({"id": message.id, "role": message.role, "content": message.content})
+
+    async def announce_conversation_change(self):
+        """Tell this user's other tabs on the document that their history is stale"""
+        if self.channel_layer is None:
+            return
+        try:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'conversation_changed',
+                    'origin': self.channel_name
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error announcing conversation change: {str(e)}")
+
+    # Conversation change handler
+    async def conversation_changed(self, event):
+        """Reload history before the next message (other tab or summary update)"""
+        if event.get('origin') != self.channel_name:
+            self.conversation_stale = True
 
     # Typing indicator handler
     async def typing_indicator(self, event):
@@ -174,32 +358,51 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'user': event['user']
             }))
 
-    # Database operations
-    @database_sync_to_async
-    def check_document_permission(self):
-        """Check if user has permission to access document"""
-        try:
-            Document.objects.get(id=self.document_id, owner=self.user)
-            return True
-        except Document.DoesNotExist:
-            return False
+    # Ingestion progress handler
+    async def ingestion_progress(self, event):
+        """Forward upload-time ingestion progress to WebSocket"""
+        if event['status'] in ('ready', 'failed'):
+            self.document = await self.get_document() or self.document
+        await self.send(text_data=json.dumps({
+            'type': 'ingestion_status',
+            'status': event['status'],
+            'progress': event.get('progress'),
+            'message': event.get('message', ''),
+        }))
 
+    # Database operations
     @database_sync_to_async
     def get_document(self):
         """Get document from database"""
-        try:
-            return Document.objects.get(id=self.document_id, owner=self.user)
-        except Document.DoesNotExist:
-            return None
+        return document_cache.get_document(self.document_id, owner_id=self.user.id)
 
     @database_sync_to_async
-    def get_or_create_session(self, document):
-        """Get or create chat session"""
+    def load_conversation(self, document):
+        """Get or create the chat session and its messages not yet folded into the summary"""
         session, _ = ChatSession.objects.get_or_create(
             document=document,
             user=self.user
         )
-        return session
+        messages = ChatMessage.objects.filter(
+            session=session,
+            id__gt=session.summarized_through
+        ).order_by('created_at', 'id')
+        history = [
+            {"id": msg.id, "role": msg.role, "content": msg.content}
+            for msg in messages
+        ]
+        return session, history
+
+    @database_sync_to_async
+    def get_history_page(self, before, limit):
+        """Keyset page of stored messages for scrolling back"""
+        try:
+            limit = int(limit) if limit else None
+        except (TypeError, ValueError):
+            limit = None
+        page = message_page(self.session, before=before, limit=limit)
+        page['messages'] = [serialize_message(msg) for msg in page['messages']]
+        return page
 
     @database_sync_to_async
     def save_user_message(self, session, content):
@@ -218,17 +421,3 @@ class ChatConsumer(AsyncWebsocketConsumer):
             role="assistant",
             content=content
         )
-
-    @database_sync_to_async
-    def get_chat_history(self, session):
-        """Get chat history for context"""
-        messages = ChatMessage.objects.filter(session=session).order_by('created_at')
-        return [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
-        ]
-
-    @database_sync_to_async
-    def get_gemini_response_async(self, user_message, file_path, chat_history):
-        """Async wrapper for Gemini response"""
-        return get_gemini_response(user_message, file_path, chat_history)
\ No newline at end of file
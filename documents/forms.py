@@ -7,6 +7,28 @@ from django.core.exceptions import ValidationError
 from .models import Document
 from .models import ChatMessage
 
+
+def validate_upload(name, size):
+    """Size and file type checks shared by form and chunked uploads."""
+    max_size = getattr(settings, "MAX_UPLOAD_SIZE", 15 * 1024 * 1024)
+    if size > max_size:
+        raise ValidationError(
+            f"File is too large. Maximum allowed size is {max_size // (1024 * 1024)} MB."
+        )
+
+    allowed_extensions = {
+        ext.lower().lstrip(".")
+        for ext in getattr(settings, "ALLOWED_UPLOAD_EXTENSIONS", [])
+    }
+    _, ext = os.path.splitext(name)
+    normalized_ext = ext.lower().lstrip(".")
+
+    if allowed_extensions and normalized_ext not in allowed_extensions:
+        raise ValidationError(
+            f"Unsupported file type '.{normalized_ext}'. Allowed types: {', '.join(sorted(allowed_extensions))}."
+        )
+
+
 class DocumentUploadForm(forms.ModelForm):
     title = forms.CharField(required=False, widget=forms.HiddenInput())
     file = forms.FileField(required=True)
@@ -20,24 +42,7 @@ class DocumentUploadForm(forms.ModelForm):
         if not uploaded_file:
             return uploaded_file
 
-        max_size = getattr(settings, "MAX_UPLOAD_SIZE", 15 * 1024 * 1024)
-        if uploaded_file.size > max_size:
-            raise ValidationError(
-                f"File is too large. Maximum allowed size is {max_size // (1024 * 1024)} MB."
-            )
-
-        allowed_extensions = {
-            ext.lower().lstrip(".")
-            for ext in getattr(settings, "ALLOWED_UPLOAD_EXTENSIONS", [])
-        }
-        _, ext = os.path.splitext(uploaded_file.name)
-        normalized_ext = ext.lower().lstrip(".")
-
-        if allowed_extensions and normalized_ext not in allowed_extensions:
-            raise ValidationError(
-                f"Unsupported file type '.{normalized_ext}'. Allowed types: {', '.join(sorted(allowed_extensions))}."
-            )
-
+        validate_upload(uploaded_file.name, uploaded_file.size)
         return uploaded_file
 
     def clean(self):
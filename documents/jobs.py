@@ -0,0 +1,9 @@
+"""Background job handlers, registered with the queue in utils/job_queue.py."""
+
+from .storage_backends import purge_staged_file, replicate_file
+from .utils.ingestion import ingest_document
+from .utils.job_queue import register
+
+register("ingest_document")(ingest_document)
+register("replicate_file")(replicate_file)
+register("purge_staged_file")(purge_staged_file)
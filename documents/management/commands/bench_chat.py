@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import override_settings
+from django.utils import timezone
+
+from documents.models import Document, DocumentChunk, GeminiFile
+from documents.routing import websocket_urlpatterns
+from documents.storage_backends import STAGED_PREFIX, document_storage
+from documents.utils import answer_cache, llm_guard, single_flight
+from documents.utils.fake_gemini import FakeGemini
+from documents.utils.file_poller import get_file_poller
+from documents.utils.ingestion import run_ingestion
+from documents.utils.llm_executor import get_context_executor, get_llm_executor
+
+STAGES = ("connect", "ack", "ttfb", "total")
+
+# Vocabulary of the generated documents; questions pick from it so retrieval finds passages
+WORDS = (
+    "revenue margin forecast quarter supplier contract invoice warranty audit compliance "
+    "reactor enzyme catalyst membrane protein sequence genome theorem lemma integral "
+    "matrix vector gradient network latency throughput cache replica partition schema "
+    "migration tenant invoice ledger pension premium policy clause liability tribunal"
+).split()
+
+
+def percentiles(seconds):
+    """Latency summary in milliseconds."""
+    values = np.array(seconds) * 1000
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "mean": round(float(values.mean()), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the chat pipeline: drive concurrent ChatConsumer sessions against "
+        "a simulated Gemini backend and report throughput and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=20, help="Concurrent WebSocket sessions.")
+        parser.add_argument("--messages", type=int, default=5, help="Questions sent by each session, one at a time.")
+        parser.add_argument(
+            "--documents", type=int, default=0,
+            help="Documents shared round-robin by the sessions (default: one per session).",
+        )
+        parser.add_argument("--pages", type=int, default=10, help="Pages per generated document.")
+        parser.add_argument(
+            "--warm", action="store_true",
+            help="Ingest the documents before measuring; otherwise the first question ingests inline.",
+        )
+        parser.add_argument(
+            "--question-pool", type=int, default=0,
+            help=(
+                "Draw questions from this many per document, so first questions repeat across "
+                "sessions and hit the answer cache (default: all unique)."
+            ),
+        )
+        parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which session starts are spread.")
+        parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for any one frame.")
+        parser.add_argument(
+            "--keep-rate-limits", action="store_true",
+            help="Apply the configured chat rate limits instead of lifting them for the run.",
+        )
+
+        parser.add_argument("--upload-delay", type=float, default=0.2, help="Simulated upload time (s).")
+        parser.add_argument("--processing-delay", type=float, default=2.0, help="Simulated PROCESSING time (s).")
+        parser.add_argument("--first-token-delay", type=float, default=0.8, help="Simulated time to first token (s).")
+        parser.add_argument("--chunks", type=int, default=20, help="Streamed chunks per answer.")
+        parser.add_argument("--chunk-interval", type=float, default=0.03, help="Seconds between streamed chunks.")
+        parser.add_argument("--jitter", type=float, default=0.2, help="Relative spread of simulated latencies.")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for generated content and latencies.")
+
+        parser.add_argument("--output", default="", help="Results file (default: bench_chat-<commit>-<time>.json).")
+        parser.add_argument("--baseline", default="", help="Earlier results file to compare against.")
+        parser.add_argument("--keep", action="store_true", help="Keep the benchmark user and documents afterwards.")
+
+    def handle(self, *args, **options):
+        if options["sessions"] < 1 or options["messages"] < 1:
+            raise CommandError("--sessions and --messages must be at least 1.")
+
+        if options["verbosity"] < 2:
+            # Per-message INFO logging would drown the report (and slow the run)
+            logging.disable(logging.INFO)
+
+        rng = random.Random(options["seed"])
+        backend = FakeGemini(
+            upload_delay=options["upload_delay"],
+            processing_delay=options["processing_delay"],
+            first_token_delay=options["first_token_delay"],
+            chunks=options["chunks"],
+            chunk_interval=options["chunk_interval"],
+            jitter=options["jitter"],
+            seed=options["seed"],
+        )
+
+        run_id = uuid.uuid4().hex[:8]
+        user = get_user_model().objects.create_user(
+            username=f"bench-{run_id}",
+            email=f"bench-{run_id}@bench.invalid",
+            password=uuid.uuid4().hex,
+        )
+        documents = []
+        try:
+            count = options["documents"] or options["sessions"]
+            documents = [self.create_document(user, run_id, i, options["pages"], rng) for i in range(count)]
+            self.stdout.write(f"Created {len(documents)} documents of {options['pages']} pages for {user.username}")
+
+            with backend.install(), self.rate_limits(options):
+                if options["warm"]:
+                    for document in documents:
+                        run_ingestion(document)
+                    self.stdout.write("Documents ingested")
+
+                started = time.perf_counter()
+                samples, errors, chunks = asyncio.run(self.drive(user, documents, options, rng))
+                wall = time.perf_counter() - started
+            close_old_connections()
+
+            results = self.report(options, samples, errors, chunks, wall, backend)
+        finally:
+            if not options["keep"]:
+                self.clean_up(user, documents)
+
+        self.print_summary(results)
+        if options["baseline"]:
+            self.compare(results, options["baseline"])
+
+        output = options["output"] or (
+            f"bench_chat-{results['environment']['commit'] or 'local'}-{timezone.now():%Y%m%d-%H%M%S}.json"
+        )
+        with open(output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    # Setup
+
+    def create_document(self, user, run_id, number, pages, rng):
+        """A text PDF with unique content, staged locally so ingestion reads it from disk."""
+        import fitz
+
+        pdf = fitz.open()
+        for page_number in range(pages):
+            text = f"Benchmark {run_id} document {number} page {page_number + 1}.\n" + " ".join(
+                rng.choice(WORDS) for _ in range(350)
+            )
+            pdf.new_page().insert_textbox(fitz.Rect(56, 56, 540, 790), text, fontsize=10)
+        data = pdf.tobytes()
+        pdf.close()
+
+        name = f"bench/{run_id}-{number}.pdf"
+        local = document_storage().staging.save(name, ContentFile(data))
+        return Document.objects.create(
+            owner=user,
+            title=f"Benchmark {number}",
+            file=STAGED_PREFIX + local,
+            original_name=name,
+            content_hash=hashlib.sha256(data).hexdigest(),
+        )
+
+    def rate_limits(self, options):
+        if options["keep_rate_limits"]:
+            return override_settings()
+        unlimited = {"limit": 10 ** 9, "window": 60}
+        return override_settings(RATE_LIMITS={
+            **getattr(settings, "RATE_LIMITS", {}),
+            "chat_user": unlimited,
+            "chat_document": unlimited,
+        })
+
+    def clean_up(self, user, documents):
+        hashes = [document.content_hash for document in documents]
+        staging = document_storage().staging
+        for document in documents:
+            staging.delete(document.file.name[len(STAGED_PREFIX):])
+        # Sessions and messages go with the user and documents
+        user.delete()
+        DocumentChunk.objects.filter(document_hash__in=hashes).delete()
+        GeminiFile.objects.filter(content_hash__in=hashes).delete()
+
+    # Load
+
+    async def drive(self, user, documents, options, rng):
+        app = URLRouter(websocket_urlpatterns)
+        samples = defaultdict(lambda: defaultdict(list))
+        errors = Counter()
+        chunks = Counter()
+        questions = [self.questions(rng, options) for _ in documents]
+
+        async def session(index):
+            if options["ramp"]:
+                await asyncio.sleep(options["ramp"] * index / options["sessions"])
+            slot = index % len(documents)
+            await self.run_session(
+                app, user, documents[slot], questions[slot], index, options, samples, errors, chunks
+            )
+
+        await asyncio.gather(*(session(i) for i in range(options["sessions"])))
+        return samples, errors, chunks
+
+    def questions(self, rng, options):
+        """Questions for one document; None means a fresh one per turn."""
+        if not options["question_pool"]:
+            return None
+        return [self.question(rng, f"pool {i}") for i in range(options["question_pool"])]
+
+    def question(self, rng, tag):
+        first, second = rng.sample(WORDS, 2)
+        return f"What does the document say about the {first} and the {second}? ({tag})"
+
+    async def run_session(self, app, user, document, pool, index, options, samples, errors, chunks):
+        timeout = options["timeout"]
+        rng = random.Random(f"{options['seed']}:{index}")
+        communicator = WebsocketCommunicator(app, f"/ws/chat/{document.id}/")
+        communicator.scope["user"] = user
+
+        started = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=timeout)
+        if not connected:
+            errors["connect refused"] += 1
+            return
+        samples["session"]["connect"].append(time.perf_counter() - started)
+
+        try:
+            for turn in range(options["messages"]):
+                content = pool[(index + turn) % len(pool)] if pool else self.question(rng, f"{index}.{turn}")
+                sent = time.perf_counter()
+                await communicator.send_json_to({"type": "chat_message", "content": content})
+
+                ack = first = None
+                while True:
+                    frame = await communicator.receive_json_from(timeout=timeout)
+                    now = time.perf_counter()
+                    kind = frame.get("type")
+                    if kind == "user_message" and ack is None:
+                        ack = now
+                    elif kind == "ai_chunk":
+                        chunks[index] += 1
+                        first = first or now
+                    elif kind == "ai_message":
+                        if frame.get("cached"):
+                            label = "cached"
+                        elif turn == 0 and not options["warm"]:
+                            label = "cold"
+                        else:
+                            label = "warm"
+                        stages = samples[label]
+                        stages["ack"].append((ack or now) - sent)
+                        stages["ttfb"].append((first or now) - sent)
+                        stages["total"].append(now - sent)
+                        break
+                    elif kind == "error":
+                        errors[frame.get("message", "error")] += 1
+                        break
+        except Exception as e:
+            errors[f"{type(e).__name__}: {str(e)}" if str(e) else type(e).__name__] += 1
+        finally:
+            await communicator.disconnect()
+
+    # Results
+
+    def report(self, options, samples, errors, chunks, wall, backend):
+        answered = sum(len(stages["total"]) for label, stages in samples.items() if label != "session")
+        latency = {
+            label: {stage: percentiles(stages[stage]) for stage in STAGES if stages.get(stage)}
+            for label, stages in samples.items()
+        }
+        combined = defaultdict(list)
+        for label, stages in samples.items():
+            if label != "session":
+                for stage, values in stages.items():
+                    combined[stage].extend(values)
+        if combined:
+            latency["all"] = {stage: percentiles(combined[stage]) for stage in STAGES if combined.get(stage)}
+
+        config = {
+            key: options[key]
+            for key in (
+                "sessions", "messages", "documents", "pages", "warm", "question_pool", "ramp",
+                "keep_rate_limits", "upload_delay", "processing_delay", "first_token_delay",
+                "chunks", "chunk_interval", "jitter", "seed",
+            )
+        }
+        return {
+            "environment": {
+                "commit": git_commit(),
+                "timestamp": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "database": connection.vendor,
+                "cache": settings.CACHES["default"]["BACKEND"],
+                "channel_layer": settings.CHANNEL_LAYERS["default"]["BACKEND"],
+            },
+            "config": config,
+            "wall_seconds": round(wall, 3),
+            "throughput": {
+                "answers": answered,
+                "errors": sum(errors.values()),
+                "answers_per_second": round(answered / wall, 2) if wall else 0.0,
+                "chunks_per_second": round(sum(chunks.values()) / wall, 1) if wall else 0.0,
+            },
+            "latency_ms": latency,
+            "errors": dict(errors),
+            "server": {
+                "llm_executor": get_llm_executor().metrics(),
+                "context_executor": get_context_executor().metrics(),
+                "llm_guard": llm_guard.get_stats(),
+                "file_uploads": get_file_poller().metrics(),
+                "single_flight": single_flight.get_stats(),
+                "answer_cache": answer_cache.get_cache_stats(),
+                "fake_gemini_calls": dict(backend.calls),
+            },
+        }
+
+    def print_summary(self, results):
+        throughput = results["throughput"]
+        self.stdout.write(
+            f"\n{throughput['answers']} answers in {results['wall_seconds']}s "
+            f"({throughput['answers_per_second']}/s, {throughput['chunks_per_second']} chunks/s), "
+            f"{throughput['errors']} errors"
+        )
+        self.stdout.write(f"{'':10}{'stage':8}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+        for label, stages in results["latency_ms"].items():
+            for stage, summary in stages.items():
+                self.stdout.write(
+                    f"{label:10}{stage:8}{summary['count']:>7}{summary['p50']:>10}"
+                    f"{summary['p95']:>10}{summary['p99']:>10}{summary['max']:>10}"
+                )
+        for message, count in results["errors"].items():
+            self.stdout.write(self.style.WARNING(f"{count} x {message}"))
+
+    def compare(self, results, path):
+        try:
+            with open(path, encoding="utf-8") as fh:
+                baseline = json.load(fh)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read baseline {path}: {str(e)}")
+
+        self.stdout.write(f"\nCompared with {path} ({baseline['environment'].get('commit') or 'unknown commit'}):")
+        old_rate = baseline["throughput"]["answers_per_second"]
+        new_rate = results["throughput"]["answers_per_second"]
+        self.stdout.write(f"{'throughput':18}{old_rate:>10} -> {new_rate:<10}{self.change(old_rate, new_rate)}")
+        for label, stages in results["latency_ms"].items():
+            for stage, summary in stages.items():
+                before = baseline["latency_ms"].get(label, {}).get(stage)
+                if not before:
+                    continue
+                for point in ("p50", "p95"):
+                    self.stdout.write(
+                        f"{label + ' ' + stage + ' ' + point:18}{before[point]:>10} -> {summary[point]:<10}"
+                        f"{self.change(before[point], summary[point])}"
+                    )
+
+    def change(self, before, after):
+        return f"{(after - before) * 100 / before:+.1f}%" if before else ""
@@ -0,0 +1,38 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from documents.utils.job_queue import Worker, queue_setting
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (document ingestion) from the job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=queue_setting("concurrency", 2),
+            help="Jobs run at the same time by this process.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=queue_setting("poll_interval", 1.0),
+            help="Seconds between queue checks while idle.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no due jobs are left instead of waiting for more.",
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(options["concurrency"], poll_interval=options["poll_interval"])
+
+        # Finish running jobs on shutdown; unfinished leases are retried elsewhere
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: worker.stop())
+
+        self.stdout.write(f"Worker {worker.worker_id} processing jobs")
+        worker.run(once=options["once"])
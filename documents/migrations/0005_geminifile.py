@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_alter_document_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('uri', models.URLField(max_length=500)),
+                ('mime_type', models.CharField(max_length=100)),
+                ('state', models.CharField(choices=[('PROCESSING', 'Processing'), ('ACTIVE', 'Active'), ('FAILED', 'Failed')], max_length=16)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('-updated_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_document_ingestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_hash', models.CharField(max_length=64)),
+                ('page_number', models.PositiveIntegerField()),
+                ('chunk_index', models.PositiveIntegerField()),
+                ('start_offset', models.PositiveIntegerField(default=0)),
+                ('end_offset', models.PositiveIntegerField(default=0)),
+                ('text', models.TextField(blank=True)),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+            ],
+            options={
+                'ordering': ('document_hash', 'page_number', 'chunk_index'),
+                'constraints': [models.UniqueConstraint(fields=('document_hash', 'page_number', 'chunk_index'), name='unique_document_chunk')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:17
+
+import documents.storage_backends
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(storage=documents.storage_backends.WriteBehindStorage(), upload_to='documents/'),
+        ),
+        migrations.CreateModel(
+            name='FileReplica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('remote_name', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('replicated', 'Replicated')], default='pending', max_length=16)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('replicated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ('-created_at',),
+                'indexes': [models.Index(fields=['state', 'created_at'], name='file_replica_state')],
+            },
+        ),
+    ]
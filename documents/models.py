@@ -2,25 +2,47 @@ import os
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 import uuid
-from cloudinary_storage.storage import RawMediaCloudinaryStorage
+
+from .storage_backends import WriteBehindStorage
 
 
 class Document(models.Model):
+    INGESTION_STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    )
+
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name="documents",
     )
     title = models.CharField(max_length=255)
-    file = models.FileField(upload_to="documents/", storage=RawMediaCloudinaryStorage())
+    file = models.FileField(upload_to="documents/", storage=WriteBehindStorage())
     original_name = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    
+
+    # Artifacts produced by the upload-time ingestion stage
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    ingestion_status = models.CharField(
+        max_length=16,
+        choices=INGESTION_STATUS_CHOICES,
+        default="pending",
+    )
+    ingestion_error = models.TextField(blank=True)
+    ingested_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ("-uploaded_at",)
+        indexes = [
+            # Per-user listings page through this index, newest first
+            models.Index(fields=["owner", "uploaded_at", "id"], name="document_owner_recent"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.title} ({self.owner})"
@@ -35,6 +57,64 @@ class Document(models.Model):
         return self.extension == "pdf"
 
 
+class GeminiFile(models.Model):
+    """Remote Gemini file handle, shared by every upload with the same content."""
+
+    STATE_CHOICES = (
+        ("PROCESSING", "Processing"),
+        ("ACTIVE", "Active"),
+        ("FAILED", "Failed"),
+    )
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    uri = models.URLField(max_length=500)
+    mime_type = models.CharField(max_length=100)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("-updated_at",)
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.state})"
+
+
+class DocumentChunk(models.Model):
+    """
+    Persisted retrieval index entry: one chunk of one page's extracted text.
+
+    Rows are keyed by the document's content hash so identical uploads share
+    one index. Every page has at least one row (with empty text for pages
+    without extractable text) so its hash can be compared on re-index.
+    Content without any pages keeps a single row for page 0.
+    """
+
+    document_hash = models.CharField(max_length=64)
+    page_number = models.PositiveIntegerField()
+    chunk_index = models.PositiveIntegerField()
+    start_offset = models.PositiveIntegerField(default=0)
+    end_offset = models.PositiveIntegerField(default=0)
+    text = models.TextField(blank=True)
+    token_count = models.PositiveIntegerField(default=0)
+    # SHA-256 of the whole page's text, used for incremental re-indexing
+    content_hash = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        ordering = ("document_hash", "page_number", "chunk_index")
+        constraints = [
+            models.UniqueConstraint(
+                fields=("document_hash", "page_number", "chunk_index"),
+                name="unique_document_chunk",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Chunk<{self.document_hash[:12]} p{self.page_number}#{self.chunk_index}>"
+
+
 class ChatSession(models.Model):
     document = models.ForeignKey(
         Document,
@@ -49,6 +129,10 @@ class ChatSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Rolling summary of every message up to and including `summarized_through` (a message id)
+    summary = models.TextField(blank=True)
+    summarized_through = models.PositiveBigIntegerField(default=0)
+
     class Meta:
         unique_together = ("document", "user")
         ordering = ("-updated_at",)
@@ -74,6 +158,128 @@ class ChatMessage(models.Model):
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [
+            # Keyset pagination of a session's history walks this index
+            models.Index(fields=["session", "created_at", "id"], name="chat_message_keyset"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.role}: {self.content[:40]}..."
+
+
+class Job(models.Model):
+    """
+    Durable background job, claimed and run by ``manage.py run_worker``.
+
+    A claimed job is invisible to other workers until ``locked_until``. The
+    running worker keeps extending that lease, so a job whose worker died is
+    picked up again once the lease lapses.
+    """
+
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    progress = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+        indexes = [
+            # Workers look for due jobs in priority order
+            models.Index(fields=["status", "priority", "run_after"], name="job_claim"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Job<{self.name} #{self.pk} {self.status}>"
+
+
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload. Bytes are staged on local disk until every
+    chunk has arrived, then the upload becomes a Document.
+    """
+
+    STATUS_CHOICES = (
+        ("uploading", "Uploading"),
+        ("complete", "Complete"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+    )
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, blank=True)
+    size = models.PositiveBigIntegerField()
+    # Bytes acknowledged so far; the next chunk must start here
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="uploading")
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("-updated_at",)
+        indexes = [
+            # Abandoned uploads are purged by age
+            models.Index(fields=["status", "updated_at"], name="upload_session_stale"),
+        ]
+
+    def __str__(self) -> str:
+        return f"UploadSession<{self.filename} {self.received}/{self.size}>"
+
+
+class FileReplica(models.Model):
+    """
+    Replication state of a file staged locally by WriteBehindStorage.
+
+    ``name`` is the staged name handed to Document.file. Once the copy in
+    remote storage exists, documents are repointed at ``remote_name``.
+    """
+
+    STATE_CHOICES = (
+        ("pending", "Pending"),
+        ("replicated", "Replicated"),
+    )
+
+    name = models.CharField(max_length=255, unique=True)
+    remote_name = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default="pending")
+    size = models.PositiveBigIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    replicated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["state", "created_at"], name="file_replica_state"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.state})"
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Document
+from .utils import chunk_index, document_cache, document_list
+
+
+@receiver(post_delete, sender=Document)
+def drop_unused_chunk_index(sender, instance, **kwargs):
+    """Remove the shared chunk index once no document uses the content."""
+    if not instance.content_hash:
+        return
+    if not Document.objects.filter(content_hash=instance.content_hash).exists():
+        chunk_index.delete_index(instance.content_hash)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def drop_cached_document_list(sender, instance, update_fields=None, **kwargs):
+    """Saves that only touch fields the list does not show (ingestion status) keep it."""
+    if update_fields is not None:
+        touched = {sender._meta.get_field(name).attname for name in update_fields}
+        if touched.isdisjoint(document_list.LIST_FIELDS):
+            return
+    document_list.invalidate(instance.owner_id)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def drop_cached_document(sender, instance, **kwargs):
+    document_cache.invalidate(instance.pk)
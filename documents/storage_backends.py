@@ -0,0 +1,259 @@
+"""Write-behind storage for uploaded documents.
+
+``WriteBehindStorage`` saves an upload to a local staging directory and
+returns at once. A background job then copies the file to remote storage
+(Cloudinary), retrying with backoff.
+
+Until the copy is done, reads use the staged file. ``path()`` points at
+it, so ingestion does not download the file, and ``url()`` points at a
+login-protected view.
+
+Once the remote copy exists, every Document using the staged name is
+repointed at the remote name. The staged copy is removed after a grace
+period, because readers may still have it open.
+
+Staged names start with ``staged/``. Any other name belongs to the remote
+storage and is passed straight through. The staging directory must be
+shared by the web and worker processes, so write-behind is only enabled
+when ``WRITE_BEHIND_DIR`` points at such storage. Platforms that give
+each process its own ephemeral disk must leave it unset.
+
+Saves must happen inside a transaction that also stores the Document;
+replication is queued when it commits.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+STAGED_PREFIX = "staged/"
+
+_stats_lock = threading.Lock()
+_stats = {"staged": 0, "replicated": 0, "failed_attempts": 0, "purged": 0}
+
+
+def storage_setting(name, default):
+    return getattr(settings, "WRITE_BEHIND_STORAGE", {}).get(name, default)
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def is_staged(name: str) -> bool:
+    return bool(name) and name.startswith(STAGED_PREFIX)
+
+
+@deconstructible
+class WriteBehindStorage(Storage):
+    """Local staging in front of the remote storage, replicated in the background."""
+
+    def __init__(self):
+        self._remote = None
+        self._staging = None
+
+    @property
+    def remote(self) -> Storage:
+        if self._remote is None:
+            backend = storage_setting("remote", "cloudinary_storage.storage.RawMediaCloudinaryStorage")
+            self._remote = import_string(backend)()
+        return self._remote
+
+    @property
+    def staging(self) -> FileSystemStorage:
+        if self._staging is None:
+            location = storage_setting("dir", "") or os.path.join(settings.MEDIA_ROOT, "staging")
+            self._staging = FileSystemStorage(location=location)
+        return self._staging
+
+    def _local(self, name: str) -> str:
+        return name[len(STAGED_PREFIX):]
+
+    def _resolve(self, name: str):
+        """(storage, name) that currently holds the file."""
+        if not is_staged(name):
+            return self.remote, name
+        if self.staging.exists(self._local(name)):
+            return self.staging, self._local(name)
+
+        from .models import FileReplica
+        remote_name = (
+            FileReplica.objects.filter(name=name, state="replicated")
+            .values_list("remote_name", flat=True)
+            .first()
+        )
+        return self.remote, remote_name or name
+
+    # Writes
+
+    def get_available_name(self, name, max_length=None):
+        if not storage_setting("enabled", True):
+            return self.remote.get_available_name(name, max_length=max_length)
+        if max_length is not None:
+            max_length -= len(STAGED_PREFIX)
+        return STAGED_PREFIX + self.staging.get_available_name(name, max_length=max_length)
+
+    def _save(self, name, content):
+        if not is_staged(name):
+            return self.remote.save(name, content)
+
+        from .models import FileReplica
+        from .utils import job_queue
+
+        local = self.staging.save(self._local(name), content)
+        staged = STAGED_PREFIX + local
+        FileReplica.objects.create(name=staged, size=self.staging.size(local))
+        # Only once the Document row pointing at the staged name is committed;
+        # otherwise the worker could replicate before there is anything to repoint
+        transaction.on_commit(lambda: job_queue.enqueue(
+            "replicate_file",
+            {"name": staged},
+            max_attempts=storage_setting("max_attempts", 10),
+        ))
+        _record("staged")
+        return staged
+
+    def delete(self, name):
+        if not is_staged(name):
+            return self.remote.delete(name)
+
+        from .models import FileReplica
+        replica = FileReplica.objects.filter(name=name).first()
+        self.staging.delete(self._local(name))
+        if replica is not None:
+            if replica.remote_name:
+                self.remote.delete(replica.remote_name)
+            replica.delete()
+
+    # Reads
+
+    def _open(self, name, mode="rb"):
+        storage, resolved = self._resolve(name)
+        return storage.open(resolved, mode)
+
+    def path(self, name):
+        storage, resolved = self._resolve(name)
+        if storage is self.staging:
+            return storage.path(resolved)
+        raise NotImplementedError("Remote files have no local path.")
+
+    def url(self, name):
+        storage, resolved = self._resolve(name)
+        if storage is self.staging:
+            return reverse("staged_file", args=[resolved])
+        return storage.url(resolved)
+
+    def exists(self, name):
+        storage, resolved = self._resolve(name)
+        return storage.exists(resolved)
+
+    def size(self, name):
+        storage, resolved = self._resolve(name)
+        return storage.size(resolved)
+
+
+def document_storage() -> WriteBehindStorage:
+    from .models import Document
+    return Document._meta.get_field("file").storage
+
+
+def replicate_file(name: str) -> None:
+    """Job handler: copy a staged file to remote storage and repoint its documents."""
+    from .models import Document, FileReplica
+    from .utils import document_cache, document_list, job_queue
+
+    replica = FileReplica.objects.filter(name=name).first()
+    if replica is None or replica.state == "replicated":
+        return
+
+    storage = document_storage()
+    local = name[len(STAGED_PREFIX):]
+    try:
+        with storage.staging.open(local) as staged:
+            remote_name = storage.remote.save(local, staged)
+    except Exception as e:
+        FileReplica.objects.filter(pk=replica.pk).update(attempts=F("attempts") + 1, last_error=str(e))
+        _record("failed_attempts")
+        raise
+
+    now = timezone.now()
+    with transaction.atomic():
+        FileReplica.objects.filter(pk=replica.pk).update(
+            state="replicated",
+            remote_name=remote_name,
+            replicated_at=now,
+            attempts=F("attempts") + 1,
+            last_error="",
+        )
+        documents = list(Document.objects.filter(file=name).values_list("id", "owner_id"))
+        Document.objects.filter(file=name).update(file=remote_name)
+
+    # Bulk updates send no signals
+    for document_id, owner_id in documents:
+        document_cache.invalidate(document_id)
+        document_list.invalidate(owner_id)
+
+    job_queue.enqueue(
+        "purge_staged_file",
+        {"name": name},
+        delay=storage_setting("retain_after_replication", 60 * 60),
+    )
+    _record("replicated")
+    lag = (now - replica.created_at).total_seconds()
+    logger.info(f"Replicated {name} to {remote_name} after {lag:.1f}s")
+
+
+def purge_staged_file(name: str) -> None:
+    """Job handler: drop the staged copy of a replicated file."""
+    from .models import FileReplica
+
+    if not FileReplica.objects.filter(name=name, state="replicated").exists():
+        return
+    document_storage().staging.delete(name[len(STAGED_PREFIX):])
+    _record("purged")
+
+
+def get_stats() -> dict:
+    """Replication backlog and lag from the database, plus this process's counters."""
+    from .models import FileReplica
+
+    with _stats_lock:
+        stats = dict(_stats)
+
+    now = timezone.now()
+    pending = FileReplica.objects.filter(state="pending").aggregate(count=Count("id"), bytes=Sum("size"))
+    oldest = (
+        FileReplica.objects.filter(state="pending")
+        .order_by("created_at")
+        .values_list("created_at", flat=True)
+        .first()
+    )
+    recent = list(
+        FileReplica.objects.filter(state="replicated")
+        .order_by("-replicated_at")
+        .values_list("created_at", "replicated_at")[:50]
+    )
+    stats.update({
+        "pending": pending["count"],
+        "pending_bytes": pending["bytes"] or 0,
+        "lag_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+        "recent_avg_replication_seconds": (
+            round(sum((done - created).total_seconds() for created, done in recent) / len(recent), 1)
+            if recent else 0.0
+        ),
+    })
+    return stats
@@ -1,3 +1,936 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from google.api_core import exceptions as api_exceptions
+
+from .models import ChatMessage, ChatSession, Document, DocumentChunk, Job, UploadSession
+from .routing import websocket_urlpatterns
+from .storage_backends import document_storage
+from .utils import answer_cache, chunk_index, chunked_upload, context, gemini_chat, job_queue, llm_guard, page_images, page_slices, rate_limit, retrieval, single_flight, tiered_cache
+
+
+@job_queue.register("test.noop")
+def noop():
+    pass
+
+
+@job_queue.register("test.fail")
+def fail():
+    raise RuntimeError("boom")
+
+
+class JobQueueTests(TransactionTestCase):
+    """Claiming, leases and retries; transactional so the queue's connection handling runs as in a worker."""
+
+    def test_claim_takes_highest_priority_first(self):
+        low = job_queue.enqueue("test.noop")
+        high = job_queue.enqueue("test.noop", priority=5)
+        later = job_queue.enqueue("test.noop", priority=9, delay=60)
+
+        claimed = job_queue.claim("worker-a", 1)
+
+        self.assertEqual([job.pk for job in claimed], [high.pk])
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual([job.pk for job in job_queue.claim("worker-b", 5)], [low.pk])
+        self.assertEqual(Job.objects.get(pk=later.pk).status, "queued")
+
+    def test_claim_race_has_one_winner(self):
+        job = job_queue.enqueue("test.noop")
+        update = QuerySet.update
+        raced = {}
+
+        def rival_claims_first(queryset, **kwargs):
+            # Another worker claims the job between our SELECT and our UPDATE
+            if "rival" not in raced:
+                raced["rival"] = None
+                raced["rival"] = job_queue.claim("worker-a", 1)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", autospec=True, side_effect=rival_claims_first):
+            claimed = job_queue.claim("worker-b", 1)
+
+        self.assertEqual(claimed, [])
+        self.assertEqual([j.pk for j in raced["rival"]], [job.pk])
+        job.refresh_from_db()
+        self.assertEqual((job.locked_by, job.attempts), ("worker-a", 1))
+
+    def test_expired_lease_is_reclaimed(self):
+        job = job_queue.enqueue("test.noop")
+        [first] = job_queue.claim("worker-a", 1)
+        self.assertEqual(job_queue.claim("worker-b", 1), [])
+
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        [second] = job_queue.claim("worker-b", 1)
+        self.assertEqual((second.locked_by, second.attempts), ("worker-b", 2))
+
+        # The first worker's late result is dropped; the job stays with worker-b
+        job_queue.run_job(first, "worker-a")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ("running", "worker-b"))
+
+        job_queue.run_job(second, "worker-b")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), ("succeeded", 100))
+
+    def test_lease_expired_on_every_attempt_fails(self):
+        job = job_queue.enqueue("test.noop", max_attempts=1)
+        job_queue.claim("worker-a", 1)
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        [reclaimed] = job_queue.claim("worker-b", 1)
+
+        with self.assertLogs("documents.utils.job_queue", "ERROR"):
+            job_queue.run_job(reclaimed, "worker-b")
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ("failed", "Lease expired on every attempt"))
+
+    @override_settings(JOB_QUEUE={"retry_base": 10, "retry_max": 15})
+    def test_failed_attempts_back_off_then_fail(self):
+        job = job_queue.enqueue("test.fail", max_attempts=2)
+
+        [claimed] = job_queue.claim("worker-a", 1)
+        before = timezone.now()
+        with self.assertLogs("documents.utils.job_queue", "ERROR"):
+            job_queue.run_job(claimed, "worker-a")
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.locked_by, job.last_error), ("queued", "", "RuntimeError: boom"))
+        # First retry waits between retry_base and min(retry_max, 2 * retry_base)
+        delay = (job.run_after - before).total_seconds()
+        self.assertGreaterEqual(delay, 10)
+        self.assertLessEqual(delay, 15 + 1)
+        self.assertEqual(job_queue.claim("worker-a", 1), [])
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        [claimed] = job_queue.claim("worker-a", 1)
+        with self.assertLogs("documents.utils.job_queue", "ERROR") as logs:
+            job_queue.run_job(claimed, "worker-a")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertIn("failed permanently", logs.output[-1])
+        self.assertIsNotNone(job.finished_at)
+
+    def test_is_last_attempt_follows_the_running_job(self):
+        seen = []
+
+        @job_queue.register("test.last_attempt")
+        def last_attempt():
+            seen.append(job_queue.is_last_attempt())
+            raise RuntimeError("again")
+
+        job = job_queue.enqueue("test.last_attempt", max_attempts=2)
+        for _ in range(2):
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            [claimed] = job_queue.claim("worker-a", 1)
+            with self.assertLogs("documents.utils.job_queue", "ERROR"):
+                job_queue.run_job(claimed, "worker-a")
+
+        self.assertEqual(seen, [False, True])
+        self.assertTrue(job_queue.is_last_attempt())
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.staging_dir, ignore_errors=True)
+
+        # Finished uploads are staged on local disk; replication is queued but not run
+        settings = override_settings(
+            CHUNKED_UPLOAD={"dir": self.upload_dir, "chunk_size": 4, "max_chunk_size": 8},
+            WRITE_BEHIND_STORAGE={"enabled": True, "dir": self.staging_dir},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        storage = document_storage()
+        storage._staging = None
+        self.addCleanup(setattr, storage, "_staging", None)
+
+        self.user = get_user_model().objects.create_user(username="uploader", email="up@example.com", password="pw")
+        self.client.force_login(self.user)
+        self.data = b"%PDF-chunked-upload"
+
+    def start(self):
+        response = self.client.post(
+            "/uploads/",
+            {"filename": "notes.pdf", "size": len(self.data), "title": "Notes"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return f"/uploads/{response.json()['id']}/"
+
+    def put(self, url, offset, end):
+        return self.client.put(
+            url, self.data[offset:end], content_type="application/octet-stream", HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_resume_from_acknowledged_offset(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, 8).json()["offset"], 8)
+
+        # A retried chunk at a stale offset is refused with the offset to resume from
+        conflict = self.put(url, 0, 8)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(conflict.json()["offset"], 8)
+        self.assertEqual(self.client.get(url).json()["offset"], 8)
+
+        # Another worker continues without the in-memory hash state
+        chunked_upload._hashers.clear()
+        self.assertEqual(self.put(url, 8, 16).json()["offset"], 16)
+        done = self.put(url, 16, len(self.data)).json()
+
+        self.assertEqual(done["status"], "complete")
+        document = Document.objects.get(owner=self.user)
+        self.assertEqual(document.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(done["redirect"], f"/chat/{document.pk}/")
+
+    def test_oversized_chunk_is_rejected(self):
+        url = self.start()
+        response = self.put(url, 0, 12)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.client.get(url).json()["offset"], 0)
+
+    def test_retried_final_chunk_creates_one_document(self):
+        url = self.start()
+        for offset in range(0, len(self.data), 8):
+            last = self.put(url, offset, offset + 8)
+        retried = self.put(url, 16, len(self.data))
+
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(retried.json()["redirect"], last.json()["redirect"])
+        self.assertEqual(Document.objects.filter(owner=self.user).count(), 1)
+        session = UploadSession.objects.get(owner=self.user)
+        self.assertEqual(session.status, "complete")
+        self.assertFalse(os.path.exists(chunked_upload.staging_path(session)))
+
+
+class LocalSlidingWindowTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(rate_limit.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.window = rate_limit.LocalSlidingWindow()
+
+    def test_window_slides(self):
+        rules = [("caller", 2, 10)]
+        self.assertEqual(self.window.hit(rules), 0)
+        self.now += 4
+        self.assertEqual(self.window.hit(rules), 0)
+        self.now += 1
+        # Full until the first hit leaves the window
+        self.assertEqual(self.window.hit(rules), 5)
+        self.now += 5
+        self.assertEqual(self.window.hit(rules), 0)
+        self.assertEqual(self.window.hit(rules), 4)
+
+    def test_rejected_hit_records_nothing(self):
+        self.assertEqual(self.window.hit([("user", 1, 60)]), 0)
+        self.assertEqual(self.window.hit([("document", 5, 60), ("user", 1, 60)]), 60)
+        self.assertEqual(len(self.window._hits["document"][1]), 0)
+
+
+@skipUnless(os.environ.get("REDIS_URL"), "the sliding-window script needs Redis (set REDIS_URL)")
+class RedisSlidingWindowTests(TestCase):
+    def setUp(self):
+        from django.core.cache.backends.redis import RedisCache
+
+        self.cache = RedisCache(os.environ["REDIS_URL"], {"KEY_PREFIX": f"test-{uuid.uuid4().hex[:8]}"})
+        self.window = rate_limit.RedisSlidingWindow(self.cache)
+        self.addCleanup(self.cache.clear)
+
+    def test_limit_and_retry_after(self):
+        rules = [("caller", 2, 30)]
+        self.assertEqual(self.window.hit(rules), 0)
+        self.assertEqual(self.window.hit(rules), 0)
+        retry = self.window.hit(rules)
+        self.assertGreater(retry, 29)
+        self.assertLessEqual(retry, 30)
+
+    def test_rejected_hit_records_nothing(self):
+        self.assertEqual(self.window.hit([("user", 1, 30)]), 0)
+        self.assertGreater(self.window.hit([("document", 1, 30), ("user", 1, 30)]), 0)
+        self.assertEqual(self.window.hit([("document", 1, 30)]), 0)
+
+    def test_expired_hits_leave_the_window(self):
+        rules = [("caller", 1, 0.2)]
+        self.assertEqual(self.window.hit(rules), 0)
+        self.assertGreater(self.window.hit(rules), 0)
+        time.sleep(0.25)
+        self.assertEqual(self.window.hit(rules), 0)
+
+
+class AnswerCacheKeyTests(TestCase):
+    def setUp(self):
+        answer_cache._cache().clear()
+        self.history = [
+            {"role": "user", "content": "Who wrote it?"},
+            {"role": "assistant", "content": "Ada."},
+        ]
+
+    def test_first_questions_share_a_key(self):
+        self.assertEqual(
+            answer_cache.cache_key("hash", "What is  the Scope?", []),
+            answer_cache.cache_key("hash", "what is the scope", [], ""),
+        )
+
+    def test_any_history_or_summary_is_part_of_the_key(self):
+        first = answer_cache.cache_key("hash", "Why?", [])
+        with_history = answer_cache.cache_key("hash", "Why?", self.history)
+        with_summary = answer_cache.cache_key("hash", "Why?", [], "Talked about the author.")
+        other_history = answer_cache.cache_key("hash", "Why?", self.history[:1])
+
+        self.assertEqual(len({first, with_history, with_summary, other_history}), 4)
+        self.assertEqual(with_history, answer_cache.cache_key("hash", "why", list(self.history)))
+
+    def test_keys_differ_per_content_and_after_invalidation(self):
+        key = answer_cache.cache_key("hash", "Why?", [])
+        self.assertNotEqual(key, answer_cache.cache_key("other", "Why?", []))
+
+        answer_cache.store_answer("hash", "Why?", [], "", "Because.")
+        self.assertEqual(answer_cache.get_answer("hash", "why", []), "Because.")
+        answer_cache.invalidate_document("hash")
+        self.assertNotEqual(answer_cache.cache_key("hash", "Why?", []), key)
+        self.assertIsNone(answer_cache.get_answer("hash", "why", []))
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.key = f"test:{uuid.uuid4().hex}"
+
+    def joined(self):
+        return single_flight.get_stats()["joined"]
+
+    def test_concurrent_callers_share_one_run(self):
+        release = threading.Event()
+        calls, results = [], []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return "artifact"
+
+        def call():
+            results.append(single_flight.run_once(self.key, work, reload=lambda: None))
+
+        joined = self.joined()
+        leader = threading.Thread(target=call)
+        leader.start()
+        while not calls:
+            time.sleep(0.01)
+        follower = threading.Thread(target=call)
+        follower.start()
+        while self.joined() == joined:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["artifact", "artifact"])
+
+    def test_failure_reaches_the_callers_that_joined(self):
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def work():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("render failed")
+
+        def call():
+            try:
+                single_flight.run_once(self.key, work, reload=lambda: None)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        joined = self.joined()
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        started.wait(5)
+        threads.append(threading.Thread(target=call))
+        threads[1].start()
+        while self.joined() == joined:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, ["render failed", "render failed"])
+
+    def test_reloads_what_another_worker_produced(self):
+        lock_key = f"single-flight:{self.key}"
+        single_flight._cache().add(lock_key, "other-worker", timeout=60)
+        threading.Timer(0.2, single_flight._cache().delete, [lock_key]).start()
+        work = mock.Mock(return_value="here")
+
+        self.assertEqual(single_flight.run_once(self.key, work, reload=lambda: "theirs"), "theirs")
+        work.assert_not_called()
+
+    def test_does_the_work_when_the_other_worker_failed(self):
+        lock_key = f"single-flight:{self.key}"
+        single_flight._cache().add(lock_key, "other-worker", timeout=60)
+        threading.Timer(0.2, single_flight._cache().delete, [lock_key]).start()
+
+        self.assertEqual(single_flight.run_once(self.key, lambda: "here", reload=lambda: None), "here")
+        self.assertIsNone(single_flight._cache().get(lock_key))
+
+    @override_settings(SINGLE_FLIGHT={"wait_timeout": 0.2})
+    def test_stops_waiting_on_a_stuck_worker(self):
+        lock_key = f"single-flight:{self.key}"
+        single_flight._cache().add(lock_key, "other-worker", timeout=60)
+        self.addCleanup(single_flight._cache().delete, lock_key)
+
+        self.assertEqual(single_flight.run_once(self.key, lambda: "here", reload=lambda: "theirs"), "here")
+
+
+class LLMGuardTests(TestCase):
+    def setUp(self):
+        llm_guard._cache().clear()
+        self.addCleanup(llm_guard._cache().clear)
+
+    def call(self, error=None):
+        with llm_guard.guarded_call():
+            if error is not None:
+                raise error
+
+    def fail(self):
+        with self.assertRaises(api_exceptions.ServiceUnavailable):
+            self.call(api_exceptions.ServiceUnavailable("overloaded"))
+
+    @override_settings(LLM_GUARD={"initial_limit": 4, "decrease_factor": 0.5})
+    def test_limit_grows_additively_and_shrinks_once_per_incident(self):
+        self.call()
+        self.assertAlmostEqual(llm_guard.current_limit(), 4.25)
+
+        self.fail()
+        self.fail()
+        self.assertAlmostEqual(llm_guard.current_limit(), 2.125)
+
+        # Not a backend failure, so the limit stays put
+        with self.assertRaises(ValueError):
+            self.call(ValueError("blocked prompt"))
+        self.assertAlmostEqual(llm_guard.current_limit(), 2.125)
+
+    @override_settings(LLM_GUARD={"initial_limit": 1})
+    def test_calls_beyond_the_limit_are_shed(self):
+        with llm_guard.guarded_call():
+            with self.assertRaises(llm_guard.LLMUnavailableError):
+                self.call()
+        self.call()
+
+    @override_settings(LLM_GUARD={"min_calls": 4, "error_threshold": 0.5, "open_seconds": 15})
+    def test_breaker_opens_then_lets_one_probe_through(self):
+        self.call()
+        self.call()
+        self.fail()
+        self.assertEqual(llm_guard.breaker_state(), "closed")
+        self.fail()
+        self.assertEqual(llm_guard.breaker_state(), "open")
+
+        with self.assertRaises(llm_guard.LLMUnavailableError) as raised:
+            self.call()
+        self.assertGreaterEqual(raised.exception.retry_after, 14)
+
+        # The open period ends: one probe, and no one else until it reports back
+        llm_guard._cache().delete("llm-guard:open-until")
+        with llm_guard.guarded_call() as probe:
+            self.assertTrue(probe.probe)
+            with self.assertRaises(llm_guard.LLMUnavailableError):
+                self.call()
+        self.assertEqual(llm_guard.breaker_state(), "closed")
+
+    @override_settings(LLM_GUARD={"min_calls": 1, "error_threshold": 0.5, "open_seconds": 15})
+    def test_failed_probe_reopens_for_longer(self):
+        self.fail()
+        llm_guard._cache().delete("llm-guard:open-until")
+
+        self.fail()
+        self.assertEqual(llm_guard.breaker_state(), "open")
+        self.assertEqual(llm_guard._cache().get("llm-guard:tripped"), 30)
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        # A fresh location gets its own L1; a local shared tier is always "listening"
+        self.cache = tiered_cache.TieredCache(uuid.uuid4().hex, {
+            "OPTIONS": {"SHARED_BACKEND": "django.core.cache.backends.locmem.LocMemCache", "L1_TIMEOUT": 60},
+        })
+        self.tier = self.cache._tier
+
+    def test_reads_fill_l1_and_writes_invalidate_it(self):
+        self.cache.shared.set("k", "v1")
+        self.assertEqual(self.cache.get("k"), "v1")
+
+        # Served from L1 without seeing a write that bypassed the cache
+        self.cache.shared.set("k", "stale")
+        self.assertEqual(self.cache.get("k"), "v1")
+
+        self.cache.set("k", "v2")
+        self.assertEqual(self.cache.get("k"), "v2")
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["l1_hits"], stats["l2_hits"]), (1, 2))
+
+    def test_read_racing_an_invalidation_does_not_fill_l1(self):
+        self.cache.shared.set("k", "old")
+        shared_get = self.cache.shared.get
+
+        def invalidated_during_read(*args, **kwargs):
+            value = shared_get(*args, **kwargs)
+            self.tier.drop([self.cache.make_key("k")])
+            return value
+
+        with mock.patch.object(self.cache.shared, "get", side_effect=invalidated_during_read):
+            self.assertEqual(self.cache.get("k"), "old")
+
+        self.assertEqual(self.tier.size(), 0)
+
+    def test_invalidations_from_other_workers_drop_keys(self):
+        self.cache.shared.set("k", "v1")
+        self.cache.get("k")
+        key = self.cache.make_key("k")
+
+        self.tier._on_message(json.dumps({"origin": self.tier.origin, "keys": [key]}))
+        self.assertEqual(self.tier.size(), 1)
+
+        self.tier._on_message(json.dumps({"origin": "another-worker", "keys": [key]}))
+        self.assertEqual(self.tier.size(), 0)
+
+    def test_l1_is_bypassed_while_not_listening(self):
+        self.cache.shared.set("k", "v1")
+        self.tier.listening = False
+        self.cache.get("k")
+        self.cache.get("k")
+
+        self.assertEqual(self.tier.size(), 0)
+        self.assertEqual(self.cache.get_stats()["l2_hits"], 2)
+
+
+class HistoryPageFrameTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.document = Document.objects.create(
+            owner=self.user, title="Notes", file="documents/notes.pdf", content_hash="h", ingestion_status="ready"
+        )
+
+    async def history_frames(self, *requests):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f"/ws/chat/{self.document.pk}/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # ingestion status
+
+        frames = []
+        for request in requests:
+            await communicator.send_json_to({"type": "history_page", **request})
+            frames.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return frames
+
+    def test_invalid_cursor_gets_an_error_frame(self):
+        frames = async_to_sync(self.history_frames)(
+            {"before": 12}, {"before": {"at": 1}}, {"before": "not-a-cursor"}, {"before": None}
+        )
+
+        for frame in frames[:3]:
+            self.assertEqual(frame, {"type": "error", "message": "Invalid history cursor"})
+        self.assertEqual(frames[3], {"type": "history_page", "messages": [], "next_cursor": None})
+
+    def test_negative_limit_gets_a_page(self):
+        [frame] = async_to_sync(self.history_frames)({"limit": -5})
+        self.assertEqual(frame["type"], "history_page")
+
+
+class RetrievalTests(TestCase):
+    def test_chunks_overlap_and_point_into_the_page(self):
+        text = " ".join(f"word{i}" for i in range(100))
+        chunks = retrieval.chunk_page(3, text, chunk_tokens=26, overlap_tokens=13)
+
+        self.assertEqual([len(c.text.split()) for c in chunks[:2]], [20, 20])
+        self.assertEqual(chunks[1].text.split()[0], "word10")
+        self.assertEqual(chunks[-1].text.split()[-1], "word99")
+        for chunk in chunks:
+            self.assertEqual(chunk.page, 3)
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+        self.assertEqual(retrieval.chunk_page(1, "   ", 26, 13), [])
+
+    def test_bm25_prefers_matching_and_rarer_terms(self):
+        bm25 = retrieval.BM25Index([
+            "the cell membrane controls transport",
+            "mitochondria produce energy for the cell",
+            "photosynthesis happens in chloroplasts",
+        ])
+
+        scores = bm25.scores("Where is energy made in the cell?")
+        self.assertEqual(int(scores.argmax()), 1)
+        self.assertEqual(scores[2], 0)
+        self.assertGreater(bm25.scores("mitochondria")[1], bm25.scores("cell")[1])
+        self.assertFalse(bm25.scores("the of and").any())
+
+    def test_search_keeps_to_top_k_and_budget_in_reading_order(self):
+        chunks = [
+            retrieval.Chunk(1, 0, 40, "osmosis and diffusion across membranes", 10),
+            retrieval.Chunk(1, 30, 70, "membranes and osmosis in plant cells", 10),
+            retrieval.Chunk(2, 0, 40, "diffusion of gases in the lungs", 10),
+            retrieval.Chunk(3, 0, 40, "unrelated history of the microscope", 10),
+        ]
+        index = retrieval.DocumentIndex(chunks, page_count=3)
+
+        # The second chunk overlaps the first on page 1, so it is skipped
+        self.assertEqual(index.search("osmosis diffusion", top_k=5, token_budget=100), [chunks[0], chunks[2]])
+        self.assertEqual(len(index.search("osmosis diffusion", top_k=1, token_budget=100)), 1)
+        self.assertEqual(index.search("osmosis diffusion", top_k=5, token_budget=5), [])
+
+    @override_settings(RETRIEVAL={"index_cache_size": 2})
+    def test_index_cache_is_bounded(self):
+        hashes = [uuid.uuid4().hex for _ in range(3)]
+        for content_hash in hashes:
+            self.addCleanup(retrieval.evict_index, content_hash)
+            retrieval.put_index(content_hash, retrieval.DocumentIndex([], page_count=0))
+
+        self.assertIsNone(retrieval.get_index(hashes[0]))
+        self.assertIsNotNone(retrieval.get_index(hashes[2]))
+
+
+class ChunkIndexTests(TestCase):
+    def setUp(self):
+        self.hash = uuid.uuid4().hex
+        self.addCleanup(retrieval.evict_index, self.hash)
+        self.pages = [
+            "Photosynthesis converts light energy into chemical energy stored in glucose. " * 5,
+            "The mitochondria produce ATP through cellular respiration in every cell. " * 5,
+        ]
+
+    def test_only_changed_pages_are_rewritten(self):
+        self.assertEqual(chunk_index.index_pages(self.hash, self.pages), 2)
+        self.assertEqual(chunk_index.index_pages(self.hash, self.pages), 0)
+
+        edited = [self.pages[0], "Ribosomes assemble proteins from amino acids. " * 5]
+        self.assertEqual(chunk_index.index_pages(self.hash, edited), 1)
+        self.assertEqual(chunk_index.index_pages(self.hash, edited[:1]), 1)
+        self.assertEqual(set(DocumentChunk.objects.filter(document_hash=self.hash).values_list("page_number", flat=True)), {1})
+
+    def test_built_index_is_searchable(self):
+        index = chunk_index.build_index(self.hash, self.pages)
+
+        self.assertEqual(index.page_count, 2)
+        self.assertTrue(index.searchable)
+        [passage] = index.search("How is ATP produced?", top_k=1, token_budget=1000)
+        self.assertEqual(passage.page, 2)
+
+    def test_content_without_pages_is_indexed_once(self):
+        self.assertIsNone(chunk_index.load_index(self.hash))
+
+        index = chunk_index.build_index(self.hash, [])
+
+        self.assertEqual(index.page_count, 0)
+        self.assertFalse(index.searchable)
+        self.assertEqual(index.search("anything", top_k=3, token_budget=1000), [])
+        retrieval.evict_index(self.hash)
+        self.assertIsNotNone(chunk_index.load_index(self.hash))
+        self.assertEqual(chunk_index.index_pages(self.hash, []), 0)
+
+        # Text found later replaces the marker
+        self.assertEqual(chunk_index.build_index(self.hash, self.pages).page_count, 2)
+        self.assertEqual(DocumentChunk.objects.filter(document_hash=self.hash, page_number=0).count(), 0)
+
+    def test_scanned_pages_are_not_searchable(self):
+        index = chunk_index.build_index(self.hash, ["", "  ", "p. 3"])
+        self.assertEqual(index.page_count, 3)
+        self.assertFalse(index.searchable)
+
+
+class RetrievePassagesTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.hash = uuid.uuid4().hex
+        self.addCleanup(retrieval.evict_index, self.hash)
+
+    def document(self, name):
+        return Document.objects.create(
+            owner=self.user, title=name, file=f"documents/{name}", content_hash=self.hash, ingestion_status="ready"
+        )
+
+    def test_document_without_text_falls_back_to_the_whole_file(self):
+        document = self.document("photo.png")
+
+        with mock.patch.object(context, "load_pages", return_value=[]) as load_pages:
+            self.assertEqual(context.retrieve_passages(document, "What does the chart show?"), [])
+            retrieval.evict_index(self.hash)
+            self.assertEqual(context.retrieve_passages(document, "And the legend?"), [])
+
+        # The empty result is stored, so the file is not fetched again
+        load_pages.assert_called_once()
+
+    def test_matching_passages_are_returned(self):
+        document = self.document("notes.pdf")
+        pages = ["Tides are caused by the gravitational pull of the moon on the oceans. " * 6]
+
+        with mock.patch.object(context, "load_pages", return_value=pages):
+            [passage] = context.retrieve_passages(document, "What causes tides?")
+
+        self.assertEqual(passage.page, 1)
+        self.assertIn("moon", passage.text)
+
+
+class ContextPreparationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.hash = uuid.uuid4().hex
+        self.addCleanup(retrieval.evict_index, self.hash)
+
+    def test_stored_passages_need_no_file(self):
+        document = Document.objects.create(
+            owner=self.user, title="Notes", file="documents/notes.pdf", content_hash=self.hash, ingestion_status="ready"
+        )
+        self.assertIsNone(context.stored_passage_context(document, "What causes tides?"))
+
+        chunk_index.build_index(self.hash, ["Tides are caused by the gravitational pull of the moon. " * 6])
+        stored = context.stored_passage_context(document, "What causes tides?")
+
+        self.assertEqual(stored.mode, "retrieval")
+        self.assertIsNone(context.stored_passage_context(document, "zebra"))
+
+    def test_pending_document_needs_build_context(self):
+        chunk_index.build_index(self.hash, ["Tides are caused by the gravitational pull of the moon. " * 6])
+        document = Document.objects.create(
+            owner=self.user, title="Notes", file="documents/notes.pdf", content_hash=self.hash, ingestion_status="pending"
+        )
+        self.assertIsNone(context.stored_passage_context(document, "What causes tides?"))
+
+    @override_settings(GEMINI_UPLOAD={"wait_timeout": 0.05})
+    def test_upload_wait_is_bounded(self):
+        waiter = Future()
+        poller = mock.Mock(**{"submit.return_value": waiter})
+
+        with mock.patch.object(gemini_chat, "get_file_poller", return_value=poller):
+            self.assertIsNone(gemini_chat.upload_file_with_retry("/tmp/notes.pdf"))
+
+        self.assertTrue(waiter.cancelled())
+
+
+class PageSlicesTests(TestCase):
+    def index(self, pages):
+        chunks = [retrieval.Chunk(page, 0, len(text), text, 10) for page, text in pages.items()]
+        return retrieval.DocumentIndex(chunks, page_count=max(pages))
+
+    def test_page_references(self):
+        self.assertEqual(page_slices.page_references("Explain pages 3-5 and 9"), [3, 4, 5, 9])
+        self.assertEqual(page_slices.page_references("what about p. 12, or pp. 7 to 6?"), [12, 6, 7])
+        self.assertEqual(page_slices.page_references("Summarise chapter 2"), [])
+
+    def test_named_and_viewed_pages(self):
+        self.assertEqual(page_slices.select_pages("What is on page 7?", 40, viewing_page=20), [7, 19, 20, 21])
+        self.assertEqual(page_slices.select_pages("Explain this", 40, viewing_page=20), [19, 20, 21])
+        self.assertEqual(page_slices.select_pages("See page 99", 40), [])
+
+    def test_matching_pages_are_used_without_other_signal(self):
+        index = self.index({
+            1: "introduction to the course",
+            4: "the krebs cycle releases energy",
+            9: "glycolysis happens before the krebs cycle",
+            20: "references",
+        })
+
+        self.assertEqual(page_slices.select_pages("Describe the Krebs cycle", 20, index), [3, 4, 5, 8, 9, 10])
+        self.assertEqual(page_slices.select_pages("Describe photosynthesis", 20, index), [])
+
+    @override_settings(PAGE_SLICES={"max_pages": 3, "max_fraction": 0.5})
+    def test_budget_and_fraction_limits(self):
+        self.assertEqual(page_slices.select_pages("Read pages 1-10", 40), [1, 2, 3])
+        # Three of four pages is not worth a slice
+        self.assertEqual(page_slices.select_pages("Read pages 1-3", 4), [])
+
+    def test_format_ranges(self):
+        self.assertEqual(page_slices.format_ranges([1, 2, 3, 7, 9, 10]), "1-3, 7, 9-10")
+        self.assertEqual(page_slices.format_ranges([]), "")
+
+    def test_write_slice_keeps_only_the_pages(self):
+        import fitz
+
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        source, target = os.path.join(workdir, "notes.pdf"), os.path.join(workdir, "slice.pdf")
+        with fitz.open() as pdf:
+            for page in range(1, 6):
+                pdf.new_page().insert_text((72, 72), f"Page {page}")
+            pdf.save(source)
+
+        page_slices.write_slice(source, [2, 3, 5], target)
+
+        with fitz.open(target) as pdf:
+            self.assertEqual([p.get_text().strip() for p in pdf], ["Page 2", "Page 3", "Page 5"])
+
+
+class PageImagesTests(TestCase):
+    def setUp(self):
+        import fitz
+
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.source = os.path.join(self.workdir, "notes.pdf")
+        with fitz.open() as pdf:
+            for page in range(1, 4):
+                pdf.new_page(width=300, height=400).insert_text((72, 72), f"Page {page}")
+            pdf.save(self.source)
+
+        settings = override_settings(PAGE_IMAGES={"dir": os.path.join(self.workdir, "cache"), "eviction_interval": 3600})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.document = Document.objects.create(
+            owner=self.user, title="Notes", file="documents/notes.pdf", content_hash=uuid.uuid4().hex
+        )
+        patcher = mock.patch.object(page_images, "prepare_local_document", return_value=(self.source, lambda: None))
+        self.prepare = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_renders_once_then_serves_from_disk(self):
+        self.assertEqual(page_images.get_layout(self.document), {"page_count": 3, "sizes": [[300, 400]] * 3})
+        path = page_images.get_page(self.document, 2, 72)
+        self.assertEqual(page_images.get_page(self.document, 2, 72), path)
+        self.assertIsNone(page_images.get_page(self.document, 4, 72))
+
+        with open(path, "rb") as fh:
+            self.assertEqual(fh.read(3), b"\xff\xd8\xff")
+        # The layout and the page; the repeated page and layout reads were hits
+        self.assertEqual(self.prepare.call_count, 2)
+
+    def test_concurrent_misses_render_once(self):
+        release = threading.Event()
+        paths = []
+
+        def slow_prepare(document):
+            release.wait(5)
+            return self.source, lambda: None
+
+        self.prepare.side_effect = slow_prepare
+
+        def render():
+            paths.append(page_images.get_thumbnail(self.document))
+
+        joined = single_flight.get_stats()["joined"]
+        threads = [threading.Thread(target=render) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        while single_flight.get_stats()["joined"] == joined:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.prepare.call_count, 1)
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(len(set(paths)), 1)
+
+    def test_eviction_counts_layouts(self):
+        page_images.get_layout(self.document)
+        page = page_images.get_page(self.document, 1, 72)
+        layout = page_images._path(self.document.content_hash, "layout" + page_images.LAYOUT_SUFFIX)
+        # The page was used last, so the layout goes first
+        os.utime(layout, (1, 1))
+
+        with override_settings(PAGE_IMAGES={"dir": page_images.cache_dir(), "max_bytes": os.path.getsize(page)}):
+            self.assertEqual(page_images.evict(), 1)
+        self.assertFalse(os.path.exists(layout))
+        self.assertTrue(os.path.exists(page))
+
+        with override_settings(PAGE_IMAGES={"dir": page_images.cache_dir(), "max_bytes": 0}):
+            self.assertEqual(page_images.evict(), 1)
+        self.assertEqual(os.listdir(page_images.cache_dir()), [])
+
+    def test_page_views_revalidate_by_etag(self):
+        self.client.force_login(self.user)
+        url = f"/documents/{self.document.pk}/pages/2/"
+
+        response = self.client.get(url, {"dpi": 70})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        tag = response["ETag"]
+        self.assertEqual(tag, page_images.etag(self.document.content_hash, page_images.page_name(2, 72)))
+
+        renders = self.prepare.call_count
+        response = self.client.get(url, {"dpi": 72}, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.prepare.call_count, renders)
+
+        self.assertEqual(self.client.get(f"/documents/{self.document.pk}/pages/9/").status_code, 404)
+        pages = self.client.get(f"/documents/{self.document.pk}/pages/", {"dpi": 150}).json()
+        self.assertEqual(pages["page_count"], 3)
+        self.assertTrue(pages["pages"][0]["url"].endswith("/pages/1/?dpi=150"))
+
+
+class ChatHistoryViewTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.client.force_login(self.user)
+        document = Document.objects.create(owner=self.user, title="Notes", file="documents/notes.pdf", content_hash="h")
+        session = ChatSession.objects.create(document=document, user=self.user)
+        for i in range(3):
+            ChatMessage.objects.create(session=session, role="user", content=f"question {i}")
+        self.url = f"/chat/{document.pk}/history/"
+
+    def test_pages_back_through_the_history(self):
+        first = self.client.get(self.url, {"limit": 2}).json()
+        self.assertEqual([m["content"] for m in first["messages"]], ["question 1", "question 2"])
+
+        older = self.client.get(self.url, {"limit": 2, "before": first["next_cursor"]}).json()
+        self.assertEqual([m["content"] for m in older["messages"]], ["question 0"])
+        self.assertIsNone(older["next_cursor"])
+
+    def test_non_positive_limit_returns_one_message(self):
+        response = self.client.get(self.url, {"limit": -5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["messages"]), 1)
+
+    def test_malformed_cursor_is_rejected(self):
+        response = self.client.get(self.url, {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class DocumentListViewTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", email="reader@example.com", password="pw")
+        self.client.force_login(self.user)
+        for i in range(3):
+            Document.objects.create(owner=self.user, title=f"Notes {i}", file=f"documents/notes{i}.pdf")
+
+    def test_cached_first_page_follows_renames(self):
+        first = self.client.get("/documents/").json()["documents"]
+        document = Document.objects.get(title="Notes 2")
+        document.title = "Renamed"
+        document.save(update_fields=["title"])
+
+        titles = [d["title"] for d in self.client.get("/documents/").json()["documents"]]
+        self.assertEqual(len(titles), len(first))
+        self.assertIn("Renamed", titles)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.client.get("/documents/", {"limit": 2}).json()
+        rest = self.client.get("/documents/", {"limit": 2, "before": first["next_cursor"]}).json()
+
+        self.assertEqual([d["title"] for d in first["documents"] + rest["documents"]], ["Notes 2", "Notes 1", "Notes 0"])
+        self.assertIsNone(rest["next_cursor"])
+
+    def test_bad_limit_and_cursor(self):
+        self.assertEqual(len(self.client.get("/documents/", {"limit": -1}).json()["documents"]), 1)
+        self.assertEqual(self.client.get("/documents/", {"before": "%%%"}).status_code, 400)
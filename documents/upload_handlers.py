@@ -0,0 +1,42 @@
+"""Upload handlers that fingerprint files while they stream in."""
+
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class Sha256UploadMixin:
+    """
+    Compute the SHA-256 of each uploaded file chunk by chunk.
+
+    The digest is exposed as ``uploaded_file.sha256`` so the content can be
+    deduplicated without reading the file a second time.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self._sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:
+            # This handler consumed the chunk
+            self._sha256.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self._sha256.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(Sha256UploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(Sha256UploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -7,8 +7,17 @@ urlpatterns = [
     path("", views.landing_page_view, name="landing_page"),
     path('coming_soon', views.coming_soon, name='coming_soon'),
     path("upload/", views.upload_view, name="upload"),
+    path("uploads/", views.upload_session_create_view, name="upload_session_create"),
+    path("uploads/<uuid:upload_id>/", views.upload_session_view, name="upload_session"),
+    path("files/staged/<path:name>", views.staged_file_view, name="staged_file"),
     path("subscription/", views.subscription_view, name="subscription"),
 
+    path("documents/", views.document_list_view, name="document_list"),
+    path("documents/<int:document_id>/pages/", views.document_pages_view, name="document_pages"),
+    path("documents/<int:document_id>/pages/<int:page>/", views.page_image_view, name="page_image"),
+    path("documents/<int:document_id>/thumbnail/", views.thumbnail_view, name="document_thumbnail"),
     path("chat/<int:document_id>/", views.chat_view, name="chat"),
+    path("chat/<int:document_id>/history/", views.chat_history_view, name="chat_history"),
+    path("ops/metrics/", views.metrics_view, name="metrics"),
     
 ]
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""Cache of AI answers for repeated questions about the same document content.
+
+Keys combine the document content hash, the normalized question and,
+once the conversation has any history or summary, a fingerprint of it.
+Whether an answer depends on earlier turns cannot be told reliably from
+the question, so in practice answers are shared between conversations
+only for first questions.
+Entries expire after ``ANSWER_CACHE_TIMEOUT`` and the backend evicts the
+least recently used entries when full (LocMemCache culls in LRU order;
+Redis should run with ``maxmemory-policy allkeys-lru``).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import threading
+import uuid
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0}
+
+
+def _cache():
+    return caches[getattr(settings, "ANSWER_CACHE_ALIAS", "default")]
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip("?!. ")
+
+
+def context_fingerprint(history: List[dict], summary: str = "") -> str:
+    """Hash of the summary and every message in the history window."""
+    digest = hashlib.sha256(summary.encode("utf-8"))
+    for msg in history:
+        digest.update(f"\x00{msg['role']}\x00{msg['content']}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _version_key(content_hash: str) -> str:
+    return f"answer-cache:version:{content_hash}"
+
+
+def _document_version(content_hash: str) -> str:
+    # A random token, so an evicted version key can never resurrect old entries
+    return _cache().get_or_set(_version_key(content_hash), lambda: uuid.uuid4().hex[:12], timeout=None)
+
+
+def cache_key(content_hash: str, question: str, history: List[dict], summary: str = "") -> str:
+    fingerprint = context_fingerprint(history, summary) if history or summary else ""
+    digest = hashlib.sha256(
+        f"{normalize_question(question)}\x00{fingerprint}".encode("utf-8")
+    ).hexdigest()
+    return f"answer-cache:{content_hash}:{_document_version(content_hash)}:{digest}"
+
+
+def get_answer(content_hash: str, question: str, history: List[dict], summary: str = "") -> Optional[str]:
+    """Return a cached answer or None; never raises."""
+    if not content_hash:
+        return None
+    try:
+        answer = _cache().get(cache_key(content_hash, question, history, summary))
+    except Exception as e:
+        logger.error(f"Answer cache lookup failed: {str(e)}")
+        return None
+
+    _record("hits" if answer is not None else "misses")
+    return answer
+
+
+def store_answer(content_hash: str, question: str, history: List[dict], summary: str, answer: str) -> None:
+    """Cache a successful answer; never raises."""
+    if not content_hash or not answer:
+        return
+    try:
+        _cache().set(
+            cache_key(content_hash, question, history, summary),
+            answer,
+            timeout=getattr(settings, "ANSWER_CACHE_TIMEOUT", 24 * 60 * 60),
+        )
+        _record("stores")
+    except Exception as e:
+        logger.error(f"Answer cache store failed: {str(e)}")
+
+
+def invalidate_document(content_hash: str) -> None:
+    """Drop every cached answer for the content by rotating its key version."""
+    _cache().set(_version_key(content_hash), uuid.uuid4().hex[:12], timeout=None)
+
+
+def get_cache_stats() -> dict:
+    """Return process-local hit/miss counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
@@ -0,0 +1,60 @@
+"""Bridge blocking iterators (e.g. Gemini token streams) into asyncio."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Iterable
+
+_DONE = object()
+
+
+async def iterate_in_thread(
+    make_iterable: Callable[..., Iterable],
+    *args,
+    executor=None,
+    max_buffered: int = 32,
+) -> AsyncIterator:
+    """
+    Consume ``make_iterable(*args)`` on a worker thread, yielding items as they arrive.
+
+    Exceptions raised by the iterator are re-raised in the awaiting coroutine.
+    At most ``max_buffered`` items wait in between: past that, the worker
+    thread blocks until the consumer (e.g. a slow WebSocket client) catches
+    up. If the consumer stops early (e.g. the WebSocket closed), the worker
+    thread stops pulling further items.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+
+    def put(entry):
+        asyncio.run_coroutine_threadsafe(queue.put(entry), loop).result()
+
+    def produce():
+        try:
+            for item in make_iterable(*args):
+                if stop.is_set():
+                    return
+                put((item, None))
+        except BaseException as e:
+            if not stop.is_set():
+                put((_DONE, e))
+            return
+        if not stop.is_set():
+            put((_DONE, None))
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting for room, so it sees the stop flag
+        while not queue.empty():
+            queue.get_nowait()
@@ -0,0 +1,281 @@
+"""Shared on-disk LRU cache of remote document blobs.
+
+Entries are keyed by storage name and ETag. Each blob has a small JSON
+sidecar holding its validators. Blobs and sidecars are written to a temp
+file in the cache directory and moved into place with ``os.replace``, so
+several workers can share one directory safely. Recently validated entries
+are served without touching the network. Older ones are revalidated with a
+conditional GET over a pooled HTTP session.
+
+A revalidation that downloads a new version leaves the old blob in place,
+because another caller may still have it open. ``evict()`` removes such
+superseded versions, and once the directory grows past ``max_bytes`` the
+least recently used blobs as well. Blobs pinned by this process and blobs used within
+``eviction_grace`` seconds are skipped, so a path handed out to a caller
+stays readable while it is in use.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+META_SUFFIX = ".json"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+_pins = Counter()
+_pins_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "revalidated": 0, "downloads": 0, "evictions": 0, "bytes_downloaded": 0}
+
+
+def blob_cache_setting(name, default):
+    return getattr(settings, "BLOB_CACHE", {}).get(name, default)
+
+
+def cache_dir() -> str:
+    path = blob_cache_setting("dir", "") or os.path.join(tempfile.gettempdir(), "insightdocs-blobs")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _record(event: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[event] += amount
+
+
+def get_session() -> requests.Session:
+    """Process-wide HTTP session so downloads reuse pooled connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            pool_size = blob_cache_setting("pool_size", 10)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _name_key(name: str) -> str:
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+
+def _blob_path(name: str, etag: str, suffix: str) -> str:
+    etag_key = hashlib.sha256(etag.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir(), f"{_name_key(name)}-{etag_key}{suffix}")
+
+
+def _meta_path(name: str) -> str:
+    return os.path.join(cache_dir(), _name_key(name) + META_SUFFIX)
+
+
+def _read_meta(name: str) -> Optional[dict]:
+    try:
+        with open(_meta_path(name), "r", encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(meta.get("path", "")):
+        return None
+    return meta
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        _safe_unlink(tmp_path)
+        raise
+
+
+def _write_meta(name: str, meta: dict) -> None:
+    _write_atomic(_meta_path(name), json.dumps(meta).encode("utf-8"))
+
+
+def _safe_unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def pin(path: str) -> None:
+    with _pins_lock:
+        _pins[path] += 1
+
+
+def unpin(path: str) -> None:
+    with _pins_lock:
+        _pins[path] -= 1
+        if _pins[path] <= 0:
+            del _pins[path]
+
+
+def fetch(name: str, url: str, suffix: str = "") -> str:
+    """
+    Return a local path holding the current content of a stored file.
+
+    The returned path is pinned; call ``unpin(path)`` once done with it.
+    """
+    meta = _read_meta(name)
+    now = time.time()
+
+    if meta and now - meta.get("validated_at", 0) < blob_cache_setting("revalidate_after", 300):
+        _record("hits")
+        return _pinned(meta["path"])
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with get_session().get(url, headers=headers, stream=True, timeout=30) as response:
+        if meta and response.status_code == 304:
+            meta["validated_at"] = now
+            _write_meta(name, meta)
+            _record("revalidated")
+            return _pinned(meta["path"])
+
+        response.raise_for_status()
+        etag = response.headers.get("ETag", "")
+        path = _blob_path(name, etag or str(now), suffix)
+        size = _download(response, path)
+
+    _write_meta(name, {
+        "name": name,
+        "path": path,
+        "etag": etag,
+        "last_modified": response.headers.get("Last-Modified", ""),
+        "validated_at": now,
+    })
+    # A superseded version may still be open elsewhere; evict() removes it
+    # once it is unpinned and past the grace period
+    pinned = _pinned(path)
+
+    _record("downloads")
+    _record("bytes_downloaded", size)
+    logger.info(f"Cached {name} ({size} bytes)")
+
+    evict()
+    return pinned
+
+
+def _pinned(path: str) -> str:
+    pin(path)
+    _touch(path)
+    return path
+
+
+def _download(response, path: str) -> int:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    fh.write(chunk)
+                    size += len(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        _safe_unlink(tmp_path)
+        raise
+    return size
+
+
+def _current_paths(directory: str) -> set:
+    """Blob paths the sidecars point at; any other blob is a superseded version."""
+    paths = set()
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(META_SUFFIX):
+            try:
+                with open(entry.path, "r", encoding="utf-8") as fh:
+                    paths.add(json.load(fh).get("path", ""))
+            except (OSError, ValueError):
+                continue
+    return paths
+
+
+def evict() -> int:
+    """
+    Remove superseded versions, then least recently used blobs until the
+    cache fits its byte cap.
+
+    Returns:
+        int: Number of blobs removed
+    """
+    max_bytes = blob_cache_setting("max_bytes", 512 * 1024 * 1024)
+    grace = blob_cache_setting("eviction_grace", 120)
+    directory = cache_dir()
+
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.endswith((META_SUFFIX, ".part")):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    with _pins_lock:
+        pinned = set(_pins)
+    current = _current_paths(directory)
+
+    removed = 0
+    cutoff = time.time() - grace
+    # Superseded versions first, whatever the cache size
+    for mtime, size, path in sorted(entries, key=lambda e: (e[2] in current, e[0])):
+        superseded = path not in current
+        if not superseded and total <= max_bytes:
+            break
+        if path in pinned or mtime > cutoff:
+            continue
+        _safe_unlink(path)
+        if not superseded:
+            _safe_unlink(os.path.join(directory, os.path.basename(path).split("-")[0] + META_SUFFIX))
+        total -= size
+        removed += 1
+
+    if removed:
+        _record("evictions", removed)
+        logger.info(f"Evicted {removed} blobs from {directory}")
+    return removed
+
+
+def get_cache_stats() -> dict:
+    """Return process-local counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["revalidated"] + stats["downloads"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["revalidated"]) / lookups, 3) if lookups else 0.0
+    return stats
@@ -0,0 +1,189 @@
+"""Persistent page/chunk index built once per unique document content."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import List, Optional
+
+from django.db import transaction
+
+from documents.models import DocumentChunk
+
+from . import retrieval
+
+logger = logging.getLogger(__name__)
+
+# Row kept for content without any pages (images, failed extraction), so
+# it counts as indexed and its text is not extracted again
+NO_TEXT_PAGE = 0
+
+
+def page_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def index_pages(document_hash: str, pages: List[str]) -> int:
+    """
+    Persist the chunk index for the document's pages.
+
+    Only pages whose text hash changed are re-processed. Pages already
+    indexed for other content (e.g. an earlier version of the same handout)
+    are copied instead of re-chunked.
+
+    Returns:
+        int: Number of pages that were (re)written or removed
+    """
+    hashes = [page_hash(text) for text in pages]
+    existing = dict(
+        DocumentChunk.objects.filter(document_hash=document_hash, chunk_index=0)
+        .values_list("page_number", "content_hash")
+    )
+
+    changed = [
+        number for number, digest in enumerate(hashes, start=1)
+        if existing.get(number) != digest
+    ]
+    removed = [
+        number for number in existing
+        if number > len(pages) or (number == NO_TEXT_PAGE and pages)
+    ]
+    no_text = not pages and NO_TEXT_PAGE not in existing
+    if not changed and not removed and not no_text:
+        return 0
+
+    reusable = _reusable_rows(document_hash, {hashes[n - 1] for n in changed})
+
+    rows, copied = [], 0
+    for number in changed:
+        digest = hashes[number - 1]
+        if digest in reusable:
+            rows.extend(_copy_rows(reusable[digest], document_hash, number))
+            copied += 1
+        else:
+            rows.extend(_chunk_rows(pages[number - 1], document_hash, number, digest))
+
+    if no_text:
+        rows.append(DocumentChunk(
+            document_hash=document_hash,
+            page_number=NO_TEXT_PAGE,
+            chunk_index=0,
+            content_hash=page_hash(""),
+        ))
+
+    with transaction.atomic():
+        DocumentChunk.objects.filter(
+            document_hash=document_hash,
+            page_number__in=changed + removed,
+        ).delete()
+        DocumentChunk.objects.bulk_create(rows)
+
+    logger.info(
+        f"Indexed {len(changed)}/{len(pages)} pages for {document_hash[:12]} "
+        f"({copied} copied from existing pages)"
+    )
+    return len(changed) + len(removed) + no_text
+
+
+def load_index(document_hash: str) -> Optional[retrieval.DocumentIndex]:
+    """
+    Return the retrieval index from the process cache or one indexed query.
+
+    None means the content has not been indexed yet. Content without text
+    gets an empty index, which is not searchable.
+    """
+    index = retrieval.get_index(document_hash)
+    if index is not None:
+        return index
+
+    rows = list(DocumentChunk.objects.filter(document_hash=document_hash).values_list(
+        "page_number", "start_offset", "end_offset", "text", "token_count",
+    ))
+    if not rows:
+        return None
+
+    chunks, page_count = [], 0
+    for page, start, end, text, token_count in rows:
+        page_count = max(page_count, page)
+        if text:
+            chunks.append(retrieval.Chunk(page, start, end, text, token_count))
+
+    index = retrieval.DocumentIndex(chunks, page_count)
+    retrieval.put_index(document_hash, index)
+    return index
+
+
+def build_index(document_hash: str, pages: List[str]) -> retrieval.DocumentIndex:
+    """Persist the index for freshly extracted pages (possibly none) and return it."""
+    if index_pages(document_hash, pages):
+        retrieval.evict_index(document_hash)
+    return load_index(document_hash)
+
+
+def delete_index(document_hash: str) -> None:
+    DocumentChunk.objects.filter(document_hash=document_hash).delete()
+    retrieval.evict_index(document_hash)
+
+
+def _reusable_rows(document_hash, digests):
+    """Existing chunk rows of other content, grouped by page hash."""
+    if not digests:
+        return {}
+
+    rows = {}
+    source = {}
+    for row in DocumentChunk.objects.filter(content_hash__in=digests).exclude(
+        document_hash=document_hash
+    ).order_by("document_hash", "page_number", "chunk_index"):
+        # Copy every chunk of the first matching page only
+        key = (row.document_hash, row.page_number)
+        if source.setdefault(row.content_hash, key) == key:
+            rows.setdefault(row.content_hash, []).append(row)
+    return rows
+
+
+def _copy_rows(rows, document_hash, page_number):
+    return [
+        DocumentChunk(
+            document_hash=document_hash,
+            page_number=page_number,
+            chunk_index=row.chunk_index,
+            start_offset=row.start_offset,
+            end_offset=row.end_offset,
+            text=row.text,
+            token_count=row.token_count,
+            content_hash=row.content_hash,
+        )
+        for row in rows
+    ]
+
+
+def _chunk_rows(text, document_hash, page_number, digest):
+    chunks = retrieval.chunk_page(
+        page_number,
+        text,
+        retrieval.retrieval_setting("chunk_tokens", 300),
+        retrieval.retrieval_setting("overlap_tokens", 50),
+    )
+    if not chunks:
+        # Keep a placeholder so the page hash is still recorded
+        return [DocumentChunk(
+            document_hash=document_hash,
+            page_number=page_number,
+            chunk_index=0,
+            content_hash=digest,
+        )]
+
+    return [
+        DocumentChunk(
+            document_hash=document_hash,
+            page_number=page_number,
+            chunk_index=i,
+            start_offset=chunk.start,
+            end_offset=chunk.end,
+            text=chunk.text,
+            token_count=chunk.token_count,
+            content_hash=digest,
+        )
+        for i, chunk in enumerate(chunks)
+    ]
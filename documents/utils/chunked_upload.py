@@ -0,0 +1,179 @@
+"""Resumable chunked uploads staged on local disk.
+
+The client creates an UploadSession and sends the file in chunks, each
+tagged with its byte offset. Every chunk streams into a staging file and
+the SHA-256 is updated as it goes. The server acknowledges the new offset
+after each chunk. An interrupted upload asks for the acknowledged offset
+and continues from there.
+
+Hash state is kept in process memory. A chunk that lands on a worker
+without it (a restart, or another daphne process on the same host) first
+re-hashes the bytes already staged. The staging directory must therefore
+be shared by every worker that serves upload requests.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from documents.models import UploadSession
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_HASHERS = 256
+
+
+class UploadConflict(Exception):
+    """The chunk does not start at the acknowledged offset, or another chunk is in progress."""
+
+
+class UploadRejected(Exception):
+    """The chunk would exceed the declared size or the chunk size limit."""
+
+
+# upload id -> (offset, sha256 of the bytes before it)
+_hashers: OrderedDict = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def upload_setting(name, default):
+    return getattr(settings, "CHUNKED_UPLOAD", {}).get(name, default)
+
+
+def _cache():
+    return caches[getattr(settings, "COORDINATION_CACHE_ALIAS", "default")]
+
+
+def staging_dir() -> str:
+    path = upload_setting("dir", "") or os.path.join(tempfile.gettempdir(), "insightdocs-uploads")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def staging_path(session: UploadSession) -> str:
+    return os.path.join(staging_dir(), f"{session.pk}.part")
+
+
+def _hasher_for(session: UploadSession):
+    """SHA-256 state covering exactly the session's acknowledged bytes."""
+    with _hashers_lock:
+        entry = _hashers.pop(str(session.pk), None)
+    if entry and entry[0] == session.received:
+        return entry[1]
+
+    digest = hashlib.sha256()
+    remaining = session.received
+    if remaining:
+        with open(staging_path(session), "rb") as f:
+            while remaining:
+                block = f.read(min(READ_SIZE, remaining))
+                if not block:
+                    raise UploadConflict("Staged data is missing; restart the upload.")
+                digest.update(block)
+                remaining -= len(block)
+    return digest
+
+
+def _keep_hasher(session: UploadSession, digest) -> None:
+    with _hashers_lock:
+        _hashers[str(session.pk)] = (session.received, digest)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def append_chunk(session: UploadSession, offset: int, stream) -> UploadSession:
+    """
+    Write one chunk read from ``stream`` at ``offset`` and acknowledge it.
+
+    Raises:
+        UploadConflict: ``offset`` is not the acknowledged offset, or another
+            request is writing to the same upload
+        UploadRejected: The chunk is larger than allowed
+    """
+    lock_key = f"upload:{session.pk}"
+    if not _cache().add(lock_key, 1, timeout=upload_setting("lock_timeout", 120)):
+        raise UploadConflict("Another chunk of this upload is still being written.")
+
+    try:
+        session.refresh_from_db(fields=["received", "status"])
+        if session.status != "uploading" or offset != session.received:
+            raise UploadConflict(f"Expected offset {session.received}.")
+
+        digest = _hasher_for(session)
+        limit = min(upload_setting("max_chunk_size", 10 * 1024 * 1024), session.size - offset)
+        path = staging_path(session)
+        written = 0
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            # Drop anything past the offset left by an interrupted write
+            f.seek(offset)
+            f.truncate()
+            while True:
+                block = stream.read(READ_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > limit:
+                    raise UploadRejected("Chunk exceeds the allowed size.")
+                f.write(block)
+                digest.update(block)
+
+        session.received = offset + written
+        session.save(update_fields=["received", "updated_at"])
+        _keep_hasher(session, digest)
+        return session
+    finally:
+        _cache().delete(lock_key)
+
+
+def complete(session: UploadSession) -> Tuple[str, str]:
+    """(staging path, SHA-256) of a fully received upload."""
+    digest = _hasher_for(session)
+    with _hashers_lock:
+        _hashers.pop(str(session.pk), None)
+    return staging_path(session), digest.hexdigest()
+
+
+def discard(session: UploadSession) -> None:
+    """Remove the staged bytes of a finished or abandoned upload."""
+    with _hashers_lock:
+        _hashers.pop(str(session.pk), None)
+    try:
+        os.remove(staging_path(session))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove staged upload {session.pk}: {str(e)}")
+
+
+def purge_expired() -> int:
+    """Delete uploads that made no progress within ``expire_after`` seconds."""
+    cutoff = timezone.now() - timedelta(seconds=upload_setting("expire_after", 24 * 60 * 60))
+    stale = list(UploadSession.objects.filter(status="uploading", updated_at__lt=cutoff))
+    for session in stale:
+        discard(session)
+    UploadSession.objects.filter(pk__in=[s.pk for s in stale]).delete()
+    return len(stale)
+
+
+def describe(session: UploadSession) -> dict:
+    return {
+        "id": str(session.pk),
+        "filename": session.filename,
+        "size": session.size,
+        "offset": session.received,
+        "status": session.status,
+        "progress": round(session.received * 100 / session.size) if session.size else 100,
+        "chunk_size": upload_setting("chunk_size", 5 * 1024 * 1024),
+    }
@@ -0,0 +1,105 @@
+"""Choose what part of a document accompanies each question."""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from django.conf import settings
+
+from . import chunk_index, page_slices, retrieval
+from .ingestion import ensure_document_ready, load_pages
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DocumentContext:
+    """Retrieved passages, or a remote file: the whole document or a slice of its pages."""
+
+    passages: List[retrieval.Chunk] = field(default_factory=list)
+    remote_file: Optional[object] = None
+    # Original page numbers held by a sliced remote file
+    pages: List[int] = field(default_factory=list)
+
+    @property
+    def mode(self) -> str:
+        if self.passages:
+            return "retrieval"
+        return "pages" if self.pages else "whole_file"
+
+    @property
+    def page_ranges(self) -> str:
+        return page_slices.format_ranges(self.pages)
+
+
+def build_context(document, question: str, viewing_page: Optional[int] = None) -> DocumentContext:
+    """
+    Build the document context for one question.
+
+    In ``retrieval`` mode only the top-k passages within the token budget are
+    used. Whole-file mode is used when configured, when the document has too
+    little extractable text (e.g. scanned notes) or when nothing matches.
+    A PDF is then cut down to the pages the question concerns, when they
+    can be told (see page_slices).
+    """
+    if getattr(settings, "DOCUMENT_CONTEXT_MODE", "retrieval") == "retrieval":
+        passages = retrieve_passages(document, question)
+        if passages:
+            logger.info(f"Using {len(passages)} retrieved passages for document {document.id}")
+            return DocumentContext(passages=passages)
+
+    remote_file = ensure_document_ready(document)
+    if page_slices.can_slice(document):
+        index = chunk_index.load_index(document.content_hash)
+        pages = page_slices.select_pages(question, index.page_count, index, viewing_page) if index and index.page_count else []
+        if pages:
+            try:
+                sliced = page_slices.get_slice(document, pages, index.page_count)
+                logger.info(f"Using pages {page_slices.format_ranges(pages)} of document {document.id}")
+                return DocumentContext(remote_file=sliced, pages=pages)
+            except Exception as e:
+                logger.error(f"Page slice failed for document {document.id}, sending the whole file: {str(e)}")
+
+    return DocumentContext(remote_file=remote_file)
+
+
+def stored_passage_context(document, question: str) -> Optional[DocumentContext]:
+    """
+    Retrieved passages when they need no download, ingestion or upload.
+
+    Returns None when ``build_context`` is needed: the document is not
+    ready, its index is not stored, or nothing matches.
+    """
+    if getattr(settings, "DOCUMENT_CONTEXT_MODE", "retrieval") != "retrieval":
+        return None
+    if document.ingestion_status != "ready" or not document.content_hash:
+        return None
+    index = chunk_index.load_index(document.content_hash)
+    passages = _search(index, question) if index is not None else []
+    if not passages:
+        return None
+    logger.info(f"Using {len(passages)} stored passages for document {document.id}")
+    return DocumentContext(passages=passages)
+
+
+def retrieve_passages(document, question: str) -> List[retrieval.Chunk]:
+    if document.ingestion_status != "ready" or not document.content_hash:
+        ensure_document_ready(document)
+
+    index = chunk_index.load_index(document.content_hash)
+    if index is None:
+        index = chunk_index.build_index(document.content_hash, load_pages(document))
+    return _search(index, question)
+
+
+def _search(index: retrieval.DocumentIndex, question: str) -> List[retrieval.Chunk]:
+    if not index.searchable:
+        return []
+
+    return index.search(
+        question,
+        top_k=retrieval.retrieval_setting("top_k", 6),
+        token_budget=retrieval.retrieval_setting("token_budget", 2000),
+    )
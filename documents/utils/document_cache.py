@@ -0,0 +1,79 @@
+"""Per-document metadata, cached in the default cache.
+
+Every chat page, history page and WebSocket connect looks its document up
+by id. Entries are dropped by signals whenever the document is saved or
+deleted, and that includes every ingestion status change.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from documents.models import Document
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _cache():
+    return caches["default"]
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def _key(document_id) -> str:
+    return f"document:{document_id}"
+
+
+def get_document(document_id, owner_id=None) -> Optional[Document]:
+    """
+    The document, or None if it does not exist or belongs to someone else.
+    """
+    try:
+        document = _cache().get(_key(document_id))
+    except Exception as e:
+        logger.error(f"Document cache lookup failed: {str(e)}")
+        document = None
+
+    if document is not None:
+        _record("hits")
+    else:
+        _record("misses")
+        document = Document.objects.filter(pk=document_id).first()
+        if document is None:
+            return None
+        try:
+            _cache().set(
+                _key(document_id),
+                document,
+                timeout=getattr(settings, "METADATA_CACHE", {}).get("document_timeout", 15 * 60),
+            )
+        except Exception as e:
+            logger.error(f"Document cache store failed: {str(e)}")
+
+    if owner_id is not None and document.owner_id != owner_id:
+        return None
+    return document
+
+
+def invalidate(document_id) -> None:
+    _cache().delete(_key(document_id))
+    _record("invalidations")
+
+
+def get_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
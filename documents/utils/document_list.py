@@ -0,0 +1,120 @@
+"""Paginated listings of a user's documents, newest first.
+
+Pages use keyset pagination on (owner, uploaded_at, id). The first page
+is what every sidebar shows, so it is cached per user in the shared cache
+and dropped by signals whenever the user uploads or deletes a document.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import reverse
+
+from documents.models import Document
+
+from . import keyset, page_images
+
+logger = logging.getLogger(__name__)
+
+# Only what the listings render
+LIST_FIELDS = ("id", "owner_id", "title", "file", "uploaded_at", "content_hash")
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def list_setting(name, default):
+    return getattr(settings, "DOCUMENT_LIST", {}).get(name, default)
+
+
+def _cache():
+    return caches[getattr(settings, "COORDINATION_CACHE_ALIAS", "default")]
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def _first_page_key(user_id) -> str:
+    return f"document-list:{user_id}"
+
+
+def document_page(user_id, before: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    """
+    One page of the user's documents, older than the cursor.
+
+    Returns:
+        dict: ``documents`` (newest first) and ``next_cursor``, which is
+        None on the last page
+    """
+    limit = max(1, min(limit or list_setting("page_size", 20), list_setting("max_page_size", 100)))
+    documents = Document.objects.filter(keyset.before("uploaded_at", before), owner_id=user_id)
+
+    page = list(documents.only(*LIST_FIELDS).order_by("-uploaded_at", "-id")[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return {
+        "documents": page,
+        "next_cursor": keyset.encode_cursor(page[-1].uploaded_at, page[-1].id) if has_more else None,
+    }
+
+
+def first_page(user_id) -> dict:
+    """The user's newest documents, served from the cache when possible."""
+    key = _first_page_key(user_id)
+    try:
+        page = _cache().get(key)
+    except Exception as e:
+        logger.error(f"Document list cache lookup failed: {str(e)}")
+        page = None
+
+    if page is not None:
+        _record("hits")
+        return page
+
+    _record("misses")
+    page = document_page(user_id)
+    try:
+        _cache().set(key, page, timeout=list_setting("cache_timeout", 10 * 60))
+    except Exception as e:
+        logger.error(f"Document list cache store failed: {str(e)}")
+    return page
+
+
+def recent_documents(user_id, exclude_id=None, limit: Optional[int] = None) -> List[Document]:
+    """Sidebar entries from the cached first page."""
+    documents = [doc for doc in first_page(user_id)["documents"] if doc.id != exclude_id]
+    return documents[:limit] if limit else documents
+
+
+def invalidate(user_id) -> None:
+    _cache().delete(_first_page_key(user_id))
+    _record("invalidations")
+
+
+def serialize_document(document) -> dict:
+    return {
+        "id": document.id,
+        "url": reverse("chat", args=[document.id]),
+        "title": document.title,
+        "extension": document.extension,
+        "uploaded_at": document.uploaded_at.isoformat(),
+        "thumbnail_url": (
+            reverse("document_thumbnail", args=[document.id]) if page_images.can_render(document) else None
+        ),
+    }
+
+
+def get_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
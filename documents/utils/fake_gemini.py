@@ -0,0 +1,126 @@
+"""Local stand-in for the Gemini API, for benchmarks.
+
+``FakeGemini.install()`` replaces the ``google.generativeai`` calls this app
+makes (file upload and state polling, chat and one-shot generation). The
+replacements only sleep, for times drawn around configured means. A run
+therefore exercises the real executors, queues and caches, with no
+network access and no API costs:
+
+- an upload takes ``upload_delay``, then the file stays PROCESSING for
+  ``processing_delay`` seconds,
+- the first streamed chunk of an answer arrives after ``first_token_delay``,
+- the rest streams as ``chunks`` pieces, ``chunk_interval`` apart.
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+
+import google.generativeai as genai
+
+
+class FakeGemini:
+    """Simulated Gemini backend with configurable latencies."""
+
+    def __init__(self, upload_delay: float = 0.2, processing_delay: float = 2.0,
+                 first_token_delay: float = 0.8, chunks: int = 20, chunk_interval: float = 0.03,
+                 jitter: float = 0.2, seed=None):
+        self.upload_delay = upload_delay
+        self.processing_delay = processing_delay
+        self.first_token_delay = first_token_delay
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # file name -> (monotonic time it becomes ACTIVE, mime type)
+        self._files = {}
+        self.calls = {"upload_file": 0, "get_file": 0, "send_message": 0, "generate_content": 0}
+
+    def _count(self, call: str) -> None:
+        with self._lock:
+            self.calls[call] += 1
+
+    def _delay(self, mean: float) -> float:
+        with self._lock:
+            return max(0.0, mean * self._rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    # Files
+
+    def upload_file(self, path=None, mime_type=None, **kwargs):
+        self._count("upload_file")
+        time.sleep(self._delay(self.upload_delay))
+        name = f"files/fake-{uuid.uuid4().hex[:12]}"
+        ready_at = time.monotonic() + self._delay(self.processing_delay)
+        with self._lock:
+            self._files[name] = (ready_at, mime_type)
+        return self._file(name)
+
+    def get_file(self, name, **kwargs):
+        self._count("get_file")
+        return self._file(name)
+
+    def _file(self, name):
+        with self._lock:
+            ready_at, mime_type = self._files[name]
+        return SimpleNamespace(
+            name=name,
+            uri=f"https://fake-gemini.invalid/{name}",
+            mime_type=mime_type or "application/pdf",
+            state=SimpleNamespace(name="ACTIVE" if time.monotonic() >= ready_at else "PROCESSING"),
+            expiration_time=None,
+        )
+
+    # Generation
+
+    def answer_pieces(self):
+        """Stream the answer: first piece after the first-token delay, then the rest."""
+        time.sleep(self._delay(self.first_token_delay))
+        for i in range(self.chunks):
+            if i:
+                time.sleep(self._delay(self.chunk_interval))
+            yield SimpleNamespace(text=f"piece{i} ")
+
+    def model(self, model_name=None, **kwargs):
+        return _FakeModel(self)
+
+    @contextmanager
+    def install(self):
+        """Route the app's Gemini calls to this backend for the duration of the block."""
+        with mock.patch.multiple(
+            genai,
+            upload_file=self.upload_file,
+            get_file=self.get_file,
+            GenerativeModel=self.model,
+        ):
+            yield self
+
+
+class _FakeModel:
+    def __init__(self, backend: FakeGemini):
+        self._backend = backend
+
+    def start_chat(self, history=None):
+        return _FakeChat(self._backend)
+
+    def generate_content(self, prompt, **kwargs):
+        self._backend._count("generate_content")
+        return SimpleNamespace(text="".join(piece.text for piece in self._backend.answer_pieces()))
+
+
+class _FakeChat:
+    def __init__(self, backend: FakeGemini):
+        self._backend = backend
+
+    def send_message(self, message, stream=False, **kwargs):
+        self._backend._count("send_message")
+        pieces = self._backend.answer_pieces()
+        if stream:
+            return pieces
+        return SimpleNamespace(text="".join(piece.text for piece in pieces))
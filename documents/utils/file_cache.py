@@ -0,0 +1,103 @@
+"""Persistent cache of Gemini remote file handles keyed by content hash."""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from documents.models import GeminiFile
+
+logger = logging.getLogger(__name__)
+
+# Gemini keeps uploaded files for 48 hours.
+DEFAULT_FILE_TTL = datetime.timedelta(hours=48)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "uploads": 0}
+
+
+def compute_file_hash(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a local file."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _expiry_margin() -> datetime.timedelta:
+    seconds = getattr(settings, "GEMINI_FILE_EXPIRY_MARGIN", 600)
+    return datetime.timedelta(seconds=seconds)
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def is_usable(handle: GeminiFile) -> bool:
+    """A handle is reusable while ACTIVE and not about to expire."""
+    if handle.state != "ACTIVE":
+        return False
+    if handle.expires_at is None:
+        return True
+    return handle.expires_at - _expiry_margin() > timezone.now()
+
+
+def get_cached_file(content_hash: str) -> Optional[GeminiFile]:
+    """
+    Look up a reusable remote handle for the given content hash.
+
+    Missing, expired and FAILED handles count as misses.
+    """
+    handle = GeminiFile.objects.filter(content_hash=content_hash).first()
+    if handle is not None and is_usable(handle):
+        _record("hits")
+        logger.info(f"Gemini file cache hit: {handle.name}")
+        return handle
+
+    _record("misses")
+    if handle is not None:
+        logger.info(f"Gemini file cache stale ({handle.state}): {handle.name}")
+    return None
+
+
+def store_file(content_hash: str, uploaded_file) -> GeminiFile:
+    """Persist the handle of a freshly uploaded file for reuse by any worker."""
+    expires_at = getattr(uploaded_file, "expiration_time", None)
+    if not expires_at:
+        expires_at = timezone.now() + DEFAULT_FILE_TTL
+
+    handle, _ = GeminiFile.objects.update_or_create(
+        content_hash=content_hash,
+        defaults={
+            "name": uploaded_file.name,
+            "uri": uploaded_file.uri,
+            "mime_type": uploaded_file.mime_type,
+            "state": uploaded_file.state.name,
+            "expires_at": expires_at,
+        },
+    )
+    _record("uploads")
+    return handle
+
+
+def invalidate(content_hash: str) -> None:
+    """Forget the remote handle so the next request re-uploads the file."""
+    GeminiFile.objects.filter(content_hash=content_hash).delete()
+
+
+def get_cache_stats() -> dict:
+    """Return process-local hit/miss counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
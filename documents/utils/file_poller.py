@@ -0,0 +1,293 @@
+"""Shared Gemini file upload and processing-state polling.
+
+Uploads run as coroutines on one background event loop. Files that are
+still PROCESSING are polled together by a single poll loop, each on its
+own exponential backoff with jitter. Threads are only used for the
+blocking SDK calls themselves, from a small pool, so many concurrent
+uploads do not each hold a thread sleeping between polls.
+
+Callers receive a ``concurrent.futures.Future``. The chat path waits on
+it from the bounded context executor (see ``llm_executor``), so cold
+documents hold at most ``CONTEXT_MAX_CONCURRENCY`` threads per process
+and never the default executor; further chats queue without a thread.
+
+Uploads of the same key are shared. Waiters registered under an owner
+(e.g. a WebSocket channel) can be cancelled together with
+``cancel_owner``. An upload is cancelled once nobody is waiting for it
+any more.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import google.generativeai as genai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Owner that waiters created in the current context are registered under
+upload_owner: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("upload_owner", default=None)
+
+
+def upload_setting(name, default):
+    return getattr(settings, "GEMINI_UPLOAD", {}).get(name, default)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with jitter: uniform between base and base * 2**attempt (capped)."""
+    return random.uniform(base, min(cap, base * 2 ** attempt))
+
+
+@dataclass
+class _Pending:
+    """A remote file waiting to leave the PROCESSING state."""
+
+    name: str
+    future: asyncio.Future
+    deadline: float
+    next_poll: float
+    polls: int = 0
+
+
+@dataclass
+class _Upload:
+    """One shared upload and the caller futures waiting on it."""
+
+    task: Future
+    waiters: set = field(default_factory=set)
+
+
+class FilePoller:
+    """Runs uploads and the shared poll loop on a dedicated event-loop thread."""
+
+    def __init__(self, workers: int = 4):
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-files")
+        self._pending: dict = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._uploads: dict = {}
+        self._owned = defaultdict(set)
+        self._lock = threading.Lock()
+        self._stats = {"uploads": 0, "shared": 0, "polls": 0, "cancelled": 0, "timeouts": 0}
+
+        self._thread = threading.Thread(target=self._run, name="gemini-file-poller", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._loop.create_task(self._poll_loop())
+        self._loop.run_forever()
+
+    # Thread-side API
+
+    def submit(self, file_path: str, mime_type: str, key: Optional[str] = None, max_retries: int = 3) -> Future:
+        """
+        Upload the file and wait for it to become ACTIVE.
+
+        Returns:
+            Future: Resolves to the ACTIVE ``genai`` file, or None on failure
+        """
+        key = key or file_path
+        waiter = Future()
+        owner = upload_owner.get()
+
+        with self._lock:
+            upload = self._uploads.get(key)
+            started = upload is None
+            if started:
+                task = asyncio.run_coroutine_threadsafe(
+                    self._upload(file_path, mime_type, max_retries), self._loop
+                )
+                upload = self._uploads[key] = _Upload(task)
+                self._stats["uploads"] += 1
+            else:
+                self._stats["shared"] += 1
+            upload.waiters.add(waiter)
+            if owner:
+                self._owned[owner].add(waiter)
+
+        if started:
+            upload.task.add_done_callback(functools.partial(self._finish, key))
+        waiter.add_done_callback(functools.partial(self._release, key, owner))
+        return waiter
+
+    def cancel_owner(self, owner: str) -> int:
+        """Cancel every waiter registered under the owner."""
+        with self._lock:
+            waiters = self._owned.pop(owner, set())
+        cancelled = sum(1 for waiter in waiters if waiter.cancel())
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} upload waits for {owner}")
+        return cancelled
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._uploads)
+        stats["processing"] = len(self._pending)
+        return stats
+
+    def _finish(self, key, task):
+        with self._lock:
+            upload = self._uploads.pop(key, None)
+        if upload is None:
+            return
+        for waiter in upload.waiters:
+            if waiter.done():
+                continue
+            if task.cancelled():
+                waiter.cancel()
+            elif task.exception() is not None:
+                waiter.set_exception(task.exception())
+            else:
+                waiter.set_result(task.result())
+
+    def _release(self, key, owner, waiter):
+        with self._lock:
+            if owner in self._owned:
+                self._owned[owner].discard(waiter)
+                if not self._owned[owner]:
+                    del self._owned[owner]
+            if not waiter.cancelled():
+                return
+            upload = self._uploads.get(key)
+            if upload is None:
+                return
+            upload.waiters.discard(waiter)
+            abandoned = not any(not w.done() for w in upload.waiters)
+            if abandoned:
+                self._stats["cancelled"] += 1
+        if abandoned:
+            upload.task.cancel()
+
+    # Event-loop side
+
+    async def _call(self, fn, *args, **kwargs):
+        return await self._loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def _upload(self, file_path, mime_type, max_retries):
+        base = upload_setting("retry_base", 1.0)
+        cap = upload_setting("retry_max", 16.0)
+
+        for attempt in range(max_retries):
+            try:
+                logger.info(f"Upload attempt {attempt + 1}/{max_retries} for {file_path}")
+                uploaded_file = await self._call(genai.upload_file, path=file_path, mime_type=mime_type)
+                uploaded_file = await self._wait_processed(uploaded_file)
+
+                if uploaded_file.state.name == "ACTIVE":
+                    logger.info("File uploaded and processed successfully")
+                    return uploaded_file
+                logger.error(f"File upload failed. State: {uploaded_file.state}")
+            except asyncio.TimeoutError:
+                logger.error(f"File processing timeout for {file_path}")
+                return None
+            except Exception as e:
+                logger.error(f"Upload attempt {attempt + 1} failed ({type(e).__name__}): {str(e)}")
+
+            if attempt < max_retries - 1:
+                delay = backoff_delay(attempt, base, cap)
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+        logger.error("All upload attempts failed")
+        return None
+
+    async def _wait_processed(self, uploaded_file):
+        if uploaded_file.state.name != "PROCESSING":
+            return uploaded_file
+
+        now = self._loop.time()
+        pending = _Pending(
+            name=uploaded_file.name,
+            future=self._loop.create_future(),
+            deadline=now + upload_setting("timeout", 30),
+            next_poll=now + upload_setting("poll_initial", 0.5),
+        )
+        self._pending[pending.name] = pending
+        self._wakeup.set()
+        try:
+            return await pending.future
+        finally:
+            self._pending.pop(pending.name, None)
+
+    async def _poll_loop(self):
+        """Poll every due file in one pass, then sleep until the next one is due."""
+        while True:
+            self._wakeup.clear()
+            if not self._pending:
+                await self._wakeup.wait()
+                continue
+
+            now = self._loop.time()
+            due = [p for p in self._pending.values() if p.next_poll <= now]
+            if not due:
+                next_poll = min(p.next_poll for p in self._pending.values())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), next_poll - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            results = await asyncio.gather(
+                *(self._call(genai.get_file, p.name) for p in due),
+                return_exceptions=True,
+            )
+            self._stats["polls"] += len(due)
+            for pending, result in zip(due, results):
+                self._resolve(pending, result)
+
+    def _resolve(self, pending, result):
+        if pending.future.done():
+            return
+
+        now = self._loop.time()
+        if isinstance(result, Exception):
+            logger.warning(f"Polling {pending.name} failed: {str(result)}")
+        elif result.state.name != "PROCESSING":
+            pending.future.set_result(result)
+            return
+
+        if now >= pending.deadline:
+            self._stats["timeouts"] += 1
+            pending.future.set_exception(asyncio.TimeoutError())
+            return
+
+        pending.polls += 1
+        delay = backoff_delay(
+            pending.polls,
+            upload_setting("poll_initial", 0.5),
+            upload_setting("poll_max", 8.0),
+        )
+        pending.next_poll = min(now + delay, pending.deadline)
+
+
+_poller: Optional[FilePoller] = None
+_poller_lock = threading.Lock()
+
+
+def get_file_poller() -> FilePoller:
+    """Process-wide poller, started on first use."""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = FilePoller(workers=upload_setting("workers", 4))
+        return _poller
+
+
+def cancel_owner(owner: str) -> int:
+    """Cancel the owner's upload waits; a no-op if nothing was ever uploaded."""
+    if _poller is None:
+        return 0
+    return _poller.cancel_owner(owner)
@@ -1,192 +1,287 @@
 import google.generativeai as genai
-import time
 import logging
 from django.conf import settings
 
+from . import file_cache
+from .file_poller import get_file_poller, upload_setting
+from .llm_guard import LLMUnavailableError, guarded_call
+
 logger = logging.getLogger(__name__)
 
 # Configure Gemini API
 genai.configure(api_key=settings.GOOGLE_API_KEY)
 
 # Constants
-FILE_UPLOAD_TIMEOUT = 30  # seconds
 API_RESPONSE_TIMEOUT = 60  # seconds
 MAX_RETRIES = 3
 
 
-def get_gemini_response(user_message, file_path, chat_history):
+class GeminiResponseError(Exception):
+    """Raised when Gemini fails; the message is safe to show to the user."""
+
+
+def stream_gemini_response(user_message, context, chat_history, summary=""):
     """
-    Get response from Gemini with document context.
+    Stream the response from Gemini as text chunks arrive.
     
     Args:
         user_message (str): User's current message
-        file_path (str): Path to the document file
+        context (DocumentContext): Retrieved passages or the uploaded file (or pages of it)
         chat_history (list): List of previous messages in format:
                             [{"role": "user"/"assistant", "content": "..."}]
+        summary (str): Rolling summary of turns older than chat_history
     
-    Returns:
-        str: AI response text
+    Yields:
+        str: Incremental pieces of the AI response text
+    
+    Raises:
+        GeminiResponseError: If generation fails or produces no text
+        LLMUnavailableError: If Gemini is overloaded or failing (retry later)
     """
     try:
-        logger.info(f"Starting Gemini response generation for: {user_message[:50]}")
-        
-        # 1. Initialize Gemini model
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        
-        # 2. Upload file to Gemini
-        logger.info(f"Uploading file: {file_path}")
-        uploaded_file = upload_file_with_retry(file_path)
-        
-        if not uploaded_file:
-            error_msg = "Could not process the document. Please ensure it's a valid PDF, DOCX, or text file."
-            logger.error(error_msg)
-            return error_msg
-
-        logger.info(f"File uploaded successfully: {uploaded_file.name}")
-
-        # 3. Build conversation history
-        history = []
-        
-        # Add system context with uploaded file
-        system_message = {
-            "role": "user",
-            "parts": [
-                uploaded_file,
-               (
-                "You are a helpful AI assistant. "
-                "First check if the user's question can be answered from the document. "
-                "If yes — use the document and reference it directly. "
-                "If no — intelligently use external knowledge to help. "
-                "If the document has questions/exercises, solve them logically using both the document and your knowledge. "
-                "Make answers clear, structured, and accurate."
-                )
-
-            ]
-        }
-        history.append(system_message)
-        
-        # AI acknowledgment
-        history.append({
-            "role": "model",
-            "parts": ["I've read the document and I'm ready to help. What would you like to know?"]
-        })
-        
-        # 4. Add previous chat history (skip empty messages)
-        for msg in chat_history:
-            role = "user" if msg.get("role") == "user" else "model"
-            content = msg.get("content", "").strip()
-            if content and content != "[Generating response...]":
-                history.append({
-                    "role": role,
-                    "parts": [content]
-                })
-        
-        # 5. Start chat and send current message
-        logger.info(f"Starting chat session...")
-        chat = model.start_chat(history=history)
-        
-        logger.info(f"Sending user message: {user_message[:50]}")
-        response = chat.send_message(user_message)
-        
-        if not response or not response.text:
-            error_msg = "No response from AI. Please try again."
-            logger.error(error_msg)
-            return error_msg
-        
-        logger.info(f"Response received successfully: {response.text[:50]}")
-        return response.text
+        logger.info(f"Starting Gemini streaming response for: {user_message[:50]}")
+        with guarded_call() as call:
+            chat = start_document_chat(context, chat_history, summary)
 
+            logger.info(f"Sending user message: {user_message[:50]}")
+            produced = False
+            for chunk in chat.send_message(user_message, stream=True):
+                text = _chunk_text(chunk)
+                if text:
+                    call.first_token()
+                    produced = True
+                    yield text
+    except (GeneratorExit, LLMUnavailableError):
+        raise
     except Exception as e:
-        error_type = type(e).__name__
-        
-        # Handle specific known exceptions
-        if "BlockedPromptException" in error_type or "blocked" in str(e).lower():
-            error_msg = "Your message was blocked by safety filters. Please rephrase your question."
-            logger.warning(f"Blocked prompt: {str(e)}")
-            return error_msg
-        
-        elif "APIError" in error_type or "api" in error_type.lower():
-            error_msg = f"Gemini API Error: {str(e)}"
-            logger.error(error_msg)
-            return error_msg
-        
-        elif isinstance(e, TimeoutError):
-            error_msg = "Request timed out. The document might be too large. Please try again."
-            logger.error(f"Timeout: {error_msg}")
-            return error_msg
-        
-        else:
-            error_msg = f"An error occurred. Please try again."
-            logger.error(f"Unexpected error in get_gemini_response: {str(e)}", exc_info=True)
-            return error_msg
-
-
-def upload_file_with_retry(file_path, max_retries=MAX_RETRIES):
-    """
-    Upload file to Gemini with retry logic and polling.
+        raise GeminiResponseError(describe_error(e)) from e
+
+    if not produced:
+        error_msg = "No response from AI. Please try again."
+        logger.error(error_msg)
+        raise GeminiResponseError(error_msg)
+
+
+def start_document_chat(context, chat_history, summary=""):
+    """
+    Start a Gemini chat primed with the document and previous messages.
+    
+    Args:
+        context (DocumentContext): Retrieved passages or the uploaded file (or pages of it)
+        chat_history (list): Previous messages
+        summary (str): Rolling summary of turns older than chat_history
+    
+    Returns:
+        genai.ChatSession: Chat ready for the next user message
+    """
+    # 1. Initialize Gemini model
+    model = genai.GenerativeModel("gemini-2.5-flash")
+    
+    # 2. Build conversation history
+    history = []
+    
+    # Add system context with the relevant passages or the whole file
+    if context.passages:
+        logger.info(f"Using {len(context.passages)} retrieved passages")
+        document_part = format_passages(context.passages)
+    else:
+        logger.info(f"Using remote file: {context.remote_file.name}")
+        document_part = as_file_part(context.remote_file)
+
+    system_message = {
+        "role": "user",
+        "parts": [
+            document_part,
+           (
+            "You are a helpful AI assistant. "
+            "First check if the user's question can be answered from the document. "
+            "If yes — use the document and reference it directly. "
+            "If no — intelligently use external knowledge to help. "
+            "If the document has questions/exercises, solve them logically using both the document and your knowledge. "
+            "Make answers clear, structured, and accurate."
+            )
+
+        ]
+    }
+    if context.pages:
+        system_message["parts"].append(
+            f"The attached file holds only pages {context.page_ranges} of the user's document, "
+            f"in that order. Cite pages by these original numbers."
+        )
+    if summary:
+        system_message["parts"].append(f"Summary of the earlier conversation:\n{summary}")
+    history.append(system_message)
+    
+    # AI acknowledgment
+    history.append({
+        "role": "model",
+        "parts": ["I've read the document and I'm ready to help. What would you like to know?"]
+    })
+    
+    # 3. Add previous chat history (skip empty messages)
+    for msg in chat_history:
+        role = "user" if msg.get("role") == "user" else "model"
+        content = msg.get("content", "").strip()
+        if content and content != "[Generating response...]":
+            history.append({
+                "role": role,
+                "parts": [content]
+            })
+    
+    # 4. Start chat
+    logger.info(f"Starting chat session...")
+    return model.start_chat(history=history)
+
+
+def summarize_conversation(previous_summary, messages, max_words=200):
+    """
+    Fold older chat messages into a rolling conversation summary.
+    
+    Args:
+        previous_summary (str): Summary produced by the last update, if any
+        messages (list): Messages evicted from the history window since then
+        max_words (int): Target length of the new summary
+    
+    Returns:
+        str: Updated summary, or "" if the model returned nothing
+    """
+    transcript = "\n".join(
+        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+        for msg in messages
+    )
+    prompt = (
+        f"Update the running summary of a conversation about a document. "
+        f"Keep facts, decisions, open questions and anything the user may refer back to. "
+        f"Answer with the summary only, at most {max_words} words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+
+    model = genai.GenerativeModel("gemini-2.5-flash")
+    with guarded_call():
+        response = model.generate_content(prompt)
+    return _chunk_text(response).strip()
+
+
+def format_passages(passages):
+    """
+    Render retrieved chunks as a prompt part labelled with page numbers.
+    
+    Args:
+        passages (list): Chunks in reading order
+    
+    Returns:
+        str: Excerpts block for the system message
+    """
+    excerpts = "\n\n".join(
+        f"[Page {chunk.page}]\n{chunk.text}" for chunk in passages
+    )
+    return (
+        "Relevant excerpts from the user's document "
+        "(page numbers in brackets):\n\n" + excerpts
+    )
+
+
+def describe_error(e):
+    """
+    Map a Gemini exception to a user-facing message, logging the details.
+    
+    Args:
+        e (Exception): Exception raised by the Gemini client
+    
+    Returns:
+        str: Message suitable for showing in the chat
+    """
+    error_type = type(e).__name__
+    
+    # Handle specific known exceptions
+    if "BlockedPromptException" in error_type or "blocked" in str(e).lower():
+        error_msg = "Your message was blocked by safety filters. Please rephrase your question."
+        logger.warning(f"Blocked prompt: {str(e)}")
+        return error_msg
+    
+    elif "APIError" in error_type or "api" in error_type.lower():
+        error_msg = f"Gemini API Error: {str(e)}"
+        logger.error(error_msg)
+        return error_msg
+    
+    elif isinstance(e, TimeoutError):
+        error_msg = "Request timed out. The document might be too large. Please try again."
+        logger.error(f"Timeout: {error_msg}")
+        return error_msg
+    
+    else:
+        error_msg = f"An error occurred. Please try again."
+        logger.error(f"Unexpected error in Gemini response: {str(e)}", exc_info=True)
+        return error_msg
+
+
+def _chunk_text(chunk):
+    """Text of a streamed chunk; chunks without text parts raise on .text."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def get_remote_file(file_path, content_hash=None):
+    """
+    Return a reusable Gemini file handle for the document, uploading only on a miss.
+    
+    Args:
+        file_path (str): Path to the local copy of the document
+        content_hash (str): SHA-256 of the file contents, computed if omitted
+    
+    Returns:
+        GeminiFile or None: Persisted remote handle or None if upload failed
+    """
+    content_hash = content_hash or file_cache.compute_file_hash(file_path)
+    handle = file_cache.get_cached_file(content_hash)
+    if handle:
+        return handle
+
+    logger.info(f"Uploading file: {file_path}")
+    uploaded_file = upload_file_with_retry(file_path, key=content_hash)
+    if not uploaded_file:
+        return None
+
+    return file_cache.store_file(content_hash, uploaded_file)
+
+
+def as_file_part(handle):
+    """Build a prompt part referencing an already uploaded remote file."""
+    return genai.protos.FileData(mime_type=handle.mime_type, file_uri=handle.uri)
+
+
+def upload_file_with_retry(file_path, max_retries=MAX_RETRIES, key=None):
+    """
+    Upload file to Gemini and wait until it has been processed.
+    
+    The upload, retries and state polling run on the shared file poller.
+    The calling thread blocks until the file is ready, for at most the
+    ``wait_timeout`` upload setting.
     
     Args:
         file_path (str): Path to the file
         max_retries (int): Number of retry attempts
+        key (str): Identifies the content so concurrent uploads are shared
     
     Returns:
-        genai.types.File or None: Uploaded file object or None if failed
-    """
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Upload attempt {attempt + 1}/{max_retries} for {file_path}")
-            
-            # Determine MIME type
-            mime_type = get_mime_type(file_path)
-            logger.info(f"Detected MIME type: {mime_type}")
-            
-            # Upload file
-            uploaded_file = genai.upload_file(
-                path=file_path,
-                mime_type=mime_type
-            )
-            
-            logger.info(f"File uploaded, waiting for processing. State: {uploaded_file.state.name}")
-            
-            # Poll until processing is complete with timeout
-            start_time = time.time()
-            while uploaded_file.state.name == "PROCESSING":
-                elapsed = time.time() - start_time
-                if elapsed > FILE_UPLOAD_TIMEOUT:
-                    logger.error(f"File processing timeout after {elapsed:.1f}s")
-                    return None
-                
-                logger.info(f"File processing... (elapsed: {elapsed:.1f}s)")
-                time.sleep(1)
-                uploaded_file = genai.get_file(uploaded_file.name)
-            
-            # Check final state
-            if uploaded_file.state.name == "ACTIVE":
-                logger.info("File uploaded and processed successfully")
-                return uploaded_file
-            
-            elif uploaded_file.state.name == "FAILED":
-                logger.error(f"File upload failed. State: {uploaded_file.state}")
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2
-                    logger.info(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    continue
-                return None
-        
-        except Exception as e:
-            error_type = type(e).__name__
-            logger.error(f"Upload attempt {attempt + 1} failed ({error_type}): {str(e)}")
-            
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 2
-                logger.info(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-                continue
-            return None
-    
-    logger.error("All upload attempts failed")
-    return None
+        genai.types.File or None: Uploaded file object or None if failed or timed out
+    
+    Raises:
+        concurrent.futures.CancelledError: If the wait was cancelled
+    """
+    mime_type = get_mime_type(file_path)
+    logger.info(f"Detected MIME type: {mime_type}")
+    waiter = get_file_poller().submit(file_path, mime_type, key=key, max_retries=max_retries)
+    try:
+        return waiter.result(timeout=upload_setting("wait_timeout", 150))
+    except TimeoutError:
+        # Drops the upload too, unless another caller still waits for it
+        waiter.cancel()
+        logger.error(f"Gave up waiting for the upload of {file_path}")
+        return None
 
 
 def get_mime_type(file_path):
@@ -0,0 +1,133 @@
+"""Token-budgeted chat history with a rolling summary of older turns.
+
+Also pages through stored messages for display, newest first, using keyset
+pagination on (session, created_at, id).
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from documents.models import ChatMessage, ChatSession
+
+from . import keyset
+from .gemini_chat import summarize_conversation
+from .llm_guard import LLMUnavailableError
+from .notify import notify_chat
+from .retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def history_setting(name, default):
+    return getattr(settings, "CHAT_HISTORY", {}).get(name, default)
+
+
+def split_history(messages: List[dict], token_budget: int) -> Tuple[List[dict], List[dict]]:
+    """
+    Split messages into (older, window).
+
+    The window is the longest run of most recent messages whose estimated
+    size fits the token budget; everything before it is ``older``.
+    """
+    used = 0
+    cut = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[i]["content"])
+        if used > token_budget:
+            break
+        cut = i
+    return messages[:cut], messages[cut:]
+
+
+def history_window(messages: List[dict]) -> List[dict]:
+    """Most recent messages that fit the configured history token budget."""
+    return split_history(messages, history_setting("token_budget", 1500))[1]
+
+
+def needs_summary(messages: List[dict]) -> bool:
+    """True once unsummarized messages no longer fit the history budget."""
+    older, _ = split_history(messages, history_setting("token_budget", 1500))
+    return bool(older)
+
+
+def update_summary(session_id) -> None:
+    """
+    Fold messages that fell out of the history window into the session summary.
+
+    Only the newly evicted messages are sent to the model together with the
+    previous summary, so the cost of each update is bounded. Runs off the
+    request path; never raises.
+    """
+    try:
+        session = ChatSession.objects.get(pk=session_id)
+        messages = [
+            {"id": msg_id, "role": role, "content": content}
+            for msg_id, role, content in ChatMessage.objects.filter(
+                session=session, id__gt=session.summarized_through
+            ).order_by("created_at", "id").values_list("id", "role", "content")
+        ]
+        older, _ = split_history(messages, history_setting("token_budget", 1500))
+        if not older:
+            return
+
+        summary = summarize_conversation(
+            session.summary,
+            older,
+            max_words=history_setting("summary_words", 200),
+        )
+        if not summary:
+            return
+
+        # Guard against a concurrent update having moved the cursor already
+        updated = ChatSession.objects.filter(
+            pk=session.pk,
+            summarized_through=session.summarized_through,
+        ).update(summary=summary, summarized_through=older[-1]["id"])
+        if updated:
+            logger.info(f"Folded {len(older)} messages into summary for session {session.pk}")
+            # Open chats keep the history in memory; have them reload it
+            notify_chat(session.document_id, session.user_id, {"type": "conversation_changed"})
+    except LLMUnavailableError:
+        logger.info(f"Deferring summary update for session {session_id}, AI service unavailable")
+    except Exception as e:
+        logger.error(f"Summary update failed for session {session_id}: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def message_page(session, before: Optional[str] = None, limit: Optional[int] = None) -> dict:
+    """
+    One page of the session's messages, older than the cursor.
+
+    Each page is a single range scan of the (session, created_at, id)
+    index, however deep into the history it is.
+
+    Returns:
+        dict: ``messages`` (oldest first) and ``next_cursor`` for the
+        previous page, which is None when there are no older messages
+    """
+    limit = max(1, min(limit or history_setting("page_size", 30), history_setting("max_page_size", 100)))
+    messages = ChatMessage.objects.filter(keyset.before("created_at", before), session=session)
+
+    page = list(messages.order_by("-created_at", "-id")[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
+
+    return {
+        "messages": page,
+        "next_cursor": keyset.encode_cursor(page[0].created_at, page[0].id) if has_more else None,
+    }
+
+
+def serialize_message(message) -> dict:
+    return {
+        "id": message.id,
+        "role": message.role,
+        "content": message.content,
+        "timestamp": message.created_at.isoformat(),
+    }
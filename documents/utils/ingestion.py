@@ -0,0 +1,177 @@
+"""Upload-time document ingestion.
+
+Ingestion makes a freshly uploaded document chat-ready before the first
+question arrives: it fetches a local copy, fingerprints the contents,
+builds the retrieval index, renders the preview thumbnail and uploads
+the file to Gemini. It runs as a background job (see job_queue). Progress
+is pushed to the chat page over the channel layer.
+"""
+
+from __future__ import annotations
+
+import logging
+from concurrent.futures import CancelledError
+
+from django.utils import timezone
+
+from documents.models import Document
+
+from . import chunk_index, file_cache, job_queue, page_images, single_flight
+from .gemini_chat import get_remote_file
+from .notify import notify_chat
+from .storage import prepare_local_document
+from .text_extraction import extract_pages
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = ["content_hash", "ingestion_status", "ingestion_error", "ingested_at"]
+
+
+# Fresh uploads go ahead of other background work
+INGEST_PRIORITY = 10
+
+
+def start_ingestion(document_id) -> None:
+    """Queue ingestion of the document for a background worker."""
+    job_queue.enqueue("ingest_document", {"document_id": document_id}, priority=INGEST_PRIORITY)
+
+
+def ingest_document(document_id) -> None:
+    """Job handler; raises on failure so the queue retries with backoff."""
+    try:
+        document = Document.objects.get(pk=document_id)
+    except Document.DoesNotExist:
+        logger.warning(f"Ingestion skipped, document {document_id} no longer exists")
+        return
+
+    run_ingestion(document)
+
+
+def run_ingestion(document):
+    """
+    Prepare the document for chat and record the produced artifacts.
+
+    Concurrent calls for the same content, in this process or in other
+    workers, are coalesced: only the first one downloads and uploads, the
+    others receive its result.
+
+    Returns:
+        GeminiFile: Remote file handle for the document contents
+
+    Raises:
+        RuntimeError: If the document could not be processed
+    """
+    remote_file = single_flight.run_once(
+        f"prepare:{document.content_hash or document.file.name}",
+        lambda: _ingest(document),
+        reload=lambda: _reload(document),
+    )
+
+    # Another caller may have done the work for a different Document row
+    document.refresh_from_db(fields=STATUS_FIELDS)
+    if document.ingestion_status != "ready":
+        document.content_hash = remote_file.content_hash
+        _set_status(document, "ready")
+    return remote_file
+
+
+def _reload(document):
+    """Remote handle produced by another worker, if it succeeded."""
+    document.refresh_from_db(fields=STATUS_FIELDS)
+    if not document.content_hash:
+        return None
+    return file_cache.get_cached_file(document.content_hash)
+
+
+def _ingest(document):
+    # Content seen before: every artifact already exists, nothing to download
+    if document.content_hash and chunk_index.load_index(document.content_hash) is not None:
+        remote_file = file_cache.get_cached_file(document.content_hash)
+        if remote_file:
+            _set_status(document, "ready")
+            _notify(document, progress=100, message="Document is ready")
+            return remote_file
+
+    _set_status(document, "processing")
+    _notify(document, progress=10, message="Fetching document")
+
+    try:
+        local_path, cleanup = prepare_local_document(document)
+        try:
+            content_hash = document.content_hash or file_cache.compute_file_hash(local_path)
+            _notify(document, progress=25, message="Indexing document text")
+            chunk_index.build_index(content_hash, extract_pages(local_path))
+            if document.is_pdf:
+                # Thumbnail and page layout for the preview, while the file is local
+                page_images.prepare_previews(local_path, content_hash)
+            _notify(document, progress=40, message="Uploading document to the AI")
+            remote_file = get_remote_file(local_path, content_hash)
+        finally:
+            cleanup()
+
+        if not remote_file:
+            raise RuntimeError(
+                "Could not process the document. Please ensure it's a valid PDF, DOCX, or text file."
+            )
+    except CancelledError:
+        # The waiting chat went away; leave the document for the next attempt
+        _set_status(document, "pending")
+        raise
+    except Exception as e:
+        if not job_queue.is_last_attempt():
+            # The queue retries; the chat page keeps showing "Preparing"
+            _set_status(document, "pending", error=str(e))
+            raise
+        _set_status(document, "failed", error=str(e))
+        _notify(document, message=str(e))
+        raise
+
+    document.content_hash = content_hash
+    _set_status(document, "ready")
+    _notify(document, progress=100, message="Document is ready")
+    return remote_file
+
+
+def ensure_document_ready(document):
+    """
+    Return the document's remote file handle, ingesting inline if needed.
+
+    This is the chat-time fallback for documents whose upload-time ingestion
+    has not finished, failed, or whose remote handle has since expired.
+    """
+    if document.ingestion_status == "ready" and document.content_hash:
+        remote_file = file_cache.get_cached_file(document.content_hash)
+        if remote_file:
+            return remote_file
+
+    return run_ingestion(document)
+
+
+def load_pages(document):
+    """Extract per-page text from a fresh local copy of the document."""
+    local_path, cleanup = prepare_local_document(document)
+    try:
+        return extract_pages(local_path)
+    finally:
+        cleanup()
+
+
+def _set_status(document, status, error=""):
+    document.ingestion_status = status
+    document.ingestion_error = error
+    update_fields = ["ingestion_status", "ingestion_error"]
+    if status == "ready":
+        document.ingested_at = timezone.now()
+        update_fields += ["ingested_at", "content_hash"]
+    document.save(update_fields=update_fields)
+
+
+def _notify(document, progress=None, message=""):
+    if progress is not None:
+        job_queue.report_progress(progress)
+    notify_chat(document.id, document.owner_id, {
+        "type": "ingestion_progress",
+        "status": document.ingestion_status,
+        "progress": progress,
+        "message": message,
+    })
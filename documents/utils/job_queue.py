@@ -0,0 +1,315 @@
+"""Durable background job queue backed by the database.
+
+Jobs are ``documents.Job`` rows, run by ``manage.py run_worker`` processes.
+Workers claim due jobs in priority order with a conditional UPDATE, so any
+number of them can share one queue without running a job twice.
+
+A claimed job holds a lease (its visibility timeout), and the worker
+renews the lease while the job runs. If the worker dies, the lease lapses
+and another worker picks the job up. Failed attempts are retried with
+exponential backoff and jitter, up to the job's ``max_attempts``.
+
+Handlers are registered with ``@register(name)`` in an app's ``jobs``
+module and receive the job's payload as keyword arguments. A handler can
+call ``report_progress`` to save its progress on the job, and
+``is_last_attempt`` to tell a failure that will be retried from a final one.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from documents.models import Job
+
+from .file_poller import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, Callable] = {}
+
+# Job run by the current worker thread, for report_progress and is_last_attempt
+_current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar("current_job", default=None)
+
+_stats_lock = threading.Lock()
+_stats = {"claimed": 0, "succeeded": 0, "retried": 0, "failed": 0, "lost": 0}
+
+
+def queue_setting(name, default):
+    return getattr(settings, "JOB_QUEUE", {}).get(name, default)
+
+
+def _record(event: str, count: int = 1) -> None:
+    with _stats_lock:
+        _stats[event] += count
+
+
+def register(name: str):
+    """Register the decorated function as the handler for jobs called ``name``."""
+    def decorator(fn):
+        _handlers[name] = fn
+        return fn
+    return decorator
+
+
+def autodiscover() -> None:
+    """Import every installed app's ``jobs`` module so its handlers register."""
+    autodiscover_modules("jobs")
+
+
+def enqueue(name: str, payload: Optional[dict] = None, priority: int = 0, delay: float = 0,
+            max_attempts: Optional[int] = None) -> Job:
+    """
+    Queue a job for the workers.
+
+    Args:
+        name: Registered handler name
+        payload: JSON-serialisable keyword arguments for the handler
+        priority: Higher runs first
+        delay: Seconds before the job becomes due
+        max_attempts: Attempts before the job is marked failed
+    """
+    job = Job.objects.create(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or queue_setting("max_attempts", 3),
+    )
+    logger.info(f"Queued {job}")
+    return job
+
+
+def _claimable(now) -> Q:
+    # Due queued jobs, and running jobs whose worker stopped renewing the lease
+    return Q(status="queued", run_after__lte=now) | Q(status="running", locked_until__lt=now)
+
+
+def claim(worker_id: str, limit: int) -> List[Job]:
+    """Lease up to ``limit`` due jobs to the worker, highest priority first."""
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(_claimable(now))
+        .order_by("-priority", "run_after", "id")
+        .values_list("id", flat=True)[:limit * 2]
+    )
+
+    claimed = []
+    lease = now + timedelta(seconds=queue_setting("visibility_timeout", 300))
+    for job_id in candidates:
+        if len(claimed) >= limit:
+            break
+        # Only one worker's UPDATE can match while the job is still claimable
+        won = Job.objects.filter(_claimable(now), id=job_id).update(
+            status="running",
+            locked_by=worker_id,
+            locked_until=lease,
+            attempts=F("attempts") + 1,
+        )
+        if won:
+            claimed.append(job_id)
+
+    _record("claimed", len(claimed))
+    return list(Job.objects.filter(id__in=claimed).order_by("-priority", "run_after", "id"))
+
+
+def renew(worker_id: str, job_ids) -> None:
+    """Extend the leases of jobs the worker is still running."""
+    if not job_ids:
+        return
+    Job.objects.filter(id__in=job_ids, locked_by=worker_id, status="running").update(
+        locked_until=timezone.now() + timedelta(seconds=queue_setting("visibility_timeout", 300))
+    )
+
+
+def report_progress(progress: int) -> None:
+    """Record progress of the job running in this thread; a no-op outside jobs."""
+    job = _current_job.get()
+    if job is not None:
+        Job.objects.filter(pk=job.pk).update(progress=progress)
+
+
+def is_last_attempt() -> bool:
+    """False while a failure of the job running in this thread will be retried; True outside jobs."""
+    job = _current_job.get()
+    return job is None or job.attempts >= job.max_attempts
+
+
+def run_job(job: Job, worker_id: str) -> None:
+    """Run one claimed job and record its outcome; never raises."""
+    handler = _handlers.get(job.name)
+    if handler is None:
+        _finish(job, worker_id, "failed", error=f"No handler registered for {job.name!r}")
+        return
+    if job.attempts > job.max_attempts:
+        # Every attempt so far lost its lease (e.g. the worker was killed)
+        _finish(job, worker_id, "failed", error="Lease expired on every attempt")
+        return
+
+    token = _current_job.set(job)
+    close_old_connections()
+    try:
+        handler(**job.payload)
+    except (Exception, CancelledError) as e:
+        logger.error(f"{job} attempt {job.attempts} failed: {str(e)}", exc_info=True)
+        _retry_or_fail(job, worker_id, e)
+    else:
+        _finish(job, worker_id, "succeeded")
+    finally:
+        _current_job.reset(token)
+        close_old_connections()
+
+
+def _retry_or_fail(job: Job, worker_id: str, e: BaseException) -> None:
+    error = f"{type(e).__name__}: {str(e)}"
+    if job.attempts >= job.max_attempts:
+        _finish(job, worker_id, "failed", error=error)
+        return
+
+    delay = backoff_delay(job.attempts, queue_setting("retry_base", 5.0), queue_setting("retry_max", 300.0))
+    updated = Job.objects.filter(pk=job.pk, locked_by=worker_id, status="running").update(
+        status="queued",
+        run_after=timezone.now() + timedelta(seconds=delay),
+        locked_by="",
+        locked_until=None,
+        last_error=error,
+    )
+    if not updated:
+        _lost(job)
+        return
+    _record("retried")
+    logger.info(f"Retrying {job} in {delay:.0f}s")
+
+
+def _finish(job: Job, worker_id: str, status: str, error: str = "") -> None:
+    fields = {"status": status, "finished_at": timezone.now(), "locked_until": None, "last_error": error}
+    if status == "succeeded":
+        fields["progress"] = 100
+    updated = Job.objects.filter(pk=job.pk, locked_by=worker_id, status="running").update(**fields)
+    if not updated:
+        _lost(job)
+        return
+    _record(status)
+    if status == "failed":
+        logger.error(f"{job} failed permanently: {error}")
+
+
+def _lost(job: Job) -> None:
+    # The lease lapsed and another worker now owns the job; its result wins
+    _record("lost")
+    logger.warning(f"{job} lease was lost before it finished")
+
+
+def purge_finished() -> int:
+    """Delete succeeded jobs older than ``keep_finished`` seconds."""
+    cutoff = timezone.now() - timedelta(seconds=queue_setting("keep_finished", 7 * 24 * 60 * 60))
+    deleted, _ = Job.objects.filter(status="succeeded", finished_at__lt=cutoff).delete()
+    return deleted
+
+
+class Worker:
+    """Claims jobs and runs them on a fixed-size thread pool until stopped."""
+
+    def __init__(self, concurrency: int, poll_interval: float = 1.0, worker_id: Optional[str] = None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job")
+        self._active: dict = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # Leases are renewed until every running job has finished, not just until stop()
+        self._drained = threading.Event()
+
+    def run(self, once: bool = False) -> None:
+        """Process jobs until ``stop()``; with ``once``, until the queue is drained."""
+        autodiscover()
+        logger.info(f"Worker {self.worker_id} started ({self.concurrency} threads, handlers: {sorted(_handlers)})")
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+
+        last_purge = 0.0
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                with self._lock:
+                    free = self.concurrency - len(self._active)
+                jobs = claim(self.worker_id, free) if free > 0 else []
+                for job in jobs:
+                    self._start(job)
+
+                with self._lock:
+                    idle = not self._active
+                if once and not jobs and idle:
+                    break
+                if not jobs:
+                    self._wakeup.wait(self.poll_interval)
+
+                if time.monotonic() - last_purge > queue_setting("purge_interval", 60 * 60):
+                    last_purge = time.monotonic()
+                    purge_finished()
+        finally:
+            self._stopping.set()
+            self._pool.shutdown(wait=True)
+            self._drained.set()
+            heartbeat.join()
+            close_old_connections()
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self) -> None:
+        """Stop claiming; jobs already running are allowed to finish."""
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _start(self, job: Job) -> None:
+        with self._lock:
+            self._active[job.pk] = job
+        future = self._pool.submit(run_job, job, self.worker_id)
+        future.add_done_callback(lambda _, job_id=job.pk: self._done(job_id))
+
+    def _done(self, job_id) -> None:
+        with self._lock:
+            self._active.pop(job_id, None)
+        self._wakeup.set()
+
+    def _heartbeat(self) -> None:
+        interval = queue_setting("visibility_timeout", 300) / 3
+        while not self._drained.wait(interval):
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                renew(self.worker_id, job_ids)
+            except Exception as e:
+                logger.error(f"Renewing job leases failed: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+def get_stats() -> dict:
+    """This process's worker counters plus queue depth and lag from the database."""
+    with _stats_lock:
+        stats = dict(_stats)
+    now = timezone.now()
+    stats["jobs"] = dict(Job.objects.values_list("status").annotate(count=Count("id")).order_by())
+    oldest_due = (
+        Job.objects.filter(status="queued", run_after__lte=now)
+        .order_by("run_after")
+        .values_list("run_after", flat=True)
+        .first()
+    )
+    stats["lag_seconds"] = round((now - oldest_due).total_seconds(), 1) if oldest_due else 0.0
+    return stats
@@ -0,0 +1,33 @@
+"""Opaque cursors for keyset pagination on (timestamp, id)."""
+
+from __future__ import annotations
+
+import base64
+from typing import Optional
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(timestamp, pk) -> str:
+    raw = f"{timestamp.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Optional[tuple]:
+    """Return (timestamp, id) for a cursor, or None if it is malformed."""
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        timestamp = parse_datetime(timestamp)
+        return (timestamp, int(pk)) if timestamp else None
+    except (ValueError, UnicodeError):
+        return None
+
+
+def before(field: str, cursor: Optional[str]) -> Q:
+    """Filter for rows that sort before the cursor in (field, id) descending order."""
+    position = decode_cursor(cursor) if cursor else None
+    if position is None:
+        return Q()
+    timestamp, pk = position
+    return Q(**{f"{field}__lt": timestamp}) | Q(**{field: timestamp, "id__lt": pk})
@@ -0,0 +1,114 @@
+"""Dedicated, bounded thread pools for blocking LLM calls.
+
+Gemini calls used to run through ``database_sync_to_async``, which is
+thread-sensitive and therefore serialises every AI request in a daphne
+process behind every other request and all ORM work. LLM calls now get
+their own pool with a configurable concurrency limit and queue depth.
+
+Building chat context for a cold document (download, ingestion, Gemini
+upload) gets a second pool, so those long waits cannot fill the default
+executor that every ``asyncio.to_thread`` call shares.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class LLMQueueFullError(RuntimeError):
+    """Raised when too many LLM calls are already waiting for a worker."""
+
+
+class LLMExecutor(Executor):
+    """ThreadPoolExecutor wrapper that tracks queue depth and concurrency."""
+
+    def __init__(self, max_workers: int, max_queue: int = 0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._peak_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._lock:
+            if self.max_queue and self._queued >= self.max_queue:
+                self._rejected += 1
+                raise LLMQueueFullError("The AI service is busy. Please try again in a moment.")
+            self._queued += 1
+            self._submitted += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+        enqueued_at = time.monotonic()
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._total_wait += time.monotonic() - enqueued_at
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        return self._pool.submit(run)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def metrics(self) -> dict:
+        """Snapshot of queue depth and throughput counters."""
+        with self._lock:
+            started = self._submitted - self._queued
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": self._queued,
+                "peak_queued": self._peak_queued,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_queue_wait_ms": round(self._total_wait / started * 1000, 1) if started else 0.0,
+            }
+
+
+_executor = None
+_context_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_llm_executor() -> LLMExecutor:
+    """Return the per-process LLM executor, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = LLMExecutor(
+                    max_workers=getattr(settings, "LLM_MAX_CONCURRENCY", 8),
+                    max_queue=getattr(settings, "LLM_MAX_QUEUE", 64),
+                )
+    return _executor
+
+
+def get_context_executor() -> LLMExecutor:
+    """Return the per-process executor for context building that may upload files."""
+    global _context_executor
+    if _context_executor is None:
+        with _executor_lock:
+            if _context_executor is None:
+                _context_executor = LLMExecutor(
+                    max_workers=getattr(settings, "CONTEXT_MAX_CONCURRENCY", 8),
+                    max_queue=getattr(settings, "CONTEXT_MAX_QUEUE", 64),
+                )
+    return _context_executor
@@ -0,0 +1,291 @@
+"""Adaptive concurrency limit and circuit breaker for Gemini calls.
+
+All state lives in the coordination cache, so every daphne worker shares
+one view of the backend's health:
+
+* The concurrency limit follows AIMD. Each call that succeeds within the
+  target latency raises the limit by about one per "round" of calls. A
+  failure or a slow call cuts it multiplicatively, at most once per
+  ``decrease_interval``.
+* In-flight calls are counted in per-epoch counters. A lease leaked by a
+  crashed worker therefore stops counting after two epochs.
+* The breaker opens once the recent error rate crosses a threshold. While
+  open, calls fail fast with a retry-after hint. When the open period ends,
+  a single probe call is let through. It either closes the breaker or
+  reopens it for twice as long.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from google.api_core import exceptions as api_exceptions
+
+logger = logging.getLogger(__name__)
+
+# Errors that say the backend is struggling, as opposed to a bad request
+BACKEND_FAILURES = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.BadGateway,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+_stats_lock = threading.Lock()
+_stats = {"admitted": 0, "shed": 0, "short_circuited": 0, "successes": 0, "failures": 0, "slow": 0}
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised instead of calling Gemini while it is overloaded or failing."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def guard_setting(name, default):
+    return getattr(settings, "LLM_GUARD", {}).get(name, default)
+
+
+def _cache():
+    return caches[getattr(settings, "COORDINATION_CACHE_ALIAS", "default")]
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def is_backend_failure(e: BaseException) -> bool:
+    return isinstance(e, BACKEND_FAILURES)
+
+
+# Concurrency limit
+
+def current_limit() -> float:
+    limit = _cache().get("llm-guard:limit")
+    return limit if limit is not None else float(guard_setting("initial_limit", 8))
+
+
+def _set_limit(limit: float) -> None:
+    limit = min(max(limit, guard_setting("min_limit", 1)), guard_setting("max_limit", 32))
+    _cache().set("llm-guard:limit", limit, timeout=None)
+
+
+def _increase() -> None:
+    limit = current_limit()
+    _set_limit(limit + guard_setting("increase", 1.0) / limit)
+
+
+def _decrease(reason: str) -> None:
+    # Concurrent failures from one incident only count once
+    if not _cache().add("llm-guard:decreased", 1, timeout=guard_setting("decrease_interval", 5)):
+        return
+    limit = current_limit()
+    _set_limit(limit * guard_setting("decrease_factor", 0.7))
+    logger.warning(f"LLM concurrency limit {limit:.1f} -> {current_limit():.1f} ({reason})")
+
+
+def _epoch_key(epoch: int) -> str:
+    return f"llm-guard:inflight:{epoch}"
+
+
+def _acquire_slot() -> Optional[str]:
+    """Count one more in-flight call; returns the counter key, or None if at the limit."""
+    lease_seconds = guard_setting("lease_seconds", 120)
+    epoch = int(time.time() // lease_seconds)
+    key = _epoch_key(epoch)
+
+    cache = _cache()
+    cache.add(key, 0, timeout=lease_seconds * 3)
+    in_flight = cache.incr(key) + (cache.get(_epoch_key(epoch - 1)) or 0)
+    if in_flight > current_limit():
+        _release_slot(key)
+        return None
+    return key
+
+
+def _release_slot(key: str) -> None:
+    try:
+        _cache().decr(key)
+    except ValueError:
+        # The epoch counter already expired
+        pass
+
+
+# Circuit breaker
+
+def _bucket(now: float) -> int:
+    return int(now // guard_setting("bucket_seconds", 10))
+
+
+def _record_outcome(failed: bool) -> None:
+    cache = _cache()
+    key = f"llm-guard:outcome:{_bucket(time.time())}:{'err' if failed else 'ok'}"
+    cache.add(key, 0, timeout=guard_setting("window_seconds", 60) * 2)
+    cache.incr(key)
+
+
+def _window_keys() -> list:
+    now = time.time()
+    buckets = range(_bucket(now - guard_setting("window_seconds", 60)) + 1, _bucket(now) + 1)
+    return [f"llm-guard:outcome:{b}:{kind}" for b in buckets for kind in ("ok", "err")]
+
+
+def error_rate() -> tuple:
+    """(error rate, number of calls) over the breaker window."""
+    counts = _cache().get_many(_window_keys())
+    errors = sum(v for k, v in counts.items() if k.endswith(":err"))
+    total = sum(counts.values())
+    return (errors / total if total else 0.0), total
+
+
+def _open_breaker(seconds: float) -> None:
+    cache = _cache()
+    cache.set("llm-guard:tripped", seconds, timeout=None)
+    cache.set("llm-guard:open-until", time.time() + seconds, timeout=seconds)
+    cache.delete("llm-guard:probe")
+    logger.error(f"LLM circuit breaker opened for {seconds}s")
+
+
+def _close_breaker() -> None:
+    cache = _cache()
+    # Start from a clean window so old failures cannot re-trip it at once
+    cache.delete_many(["llm-guard:tripped", "llm-guard:open-until", "llm-guard:probe"] + _window_keys())
+    logger.info("LLM circuit breaker closed")
+
+
+def breaker_state() -> str:
+    cache = _cache()
+    if not cache.get("llm-guard:tripped"):
+        return "closed"
+    return "open" if cache.get("llm-guard:open-until") else "half_open"
+
+
+def _check_breaker() -> bool:
+    """Raise while the breaker is open; returns True if this call is the half-open probe."""
+    cache = _cache()
+    if not cache.get("llm-guard:tripped"):
+        return False
+
+    open_until = cache.get("llm-guard:open-until")
+    if open_until is None and cache.add("llm-guard:probe", 1, timeout=guard_setting("lease_seconds", 120)):
+        return True
+
+    _record("short_circuited")
+    retry_after = (open_until - time.time()) if open_until else guard_setting("open_seconds", 15)
+    raise LLMUnavailableError(
+        "The AI service is having trouble right now. Please try again shortly.",
+        retry_after=retry_after,
+    )
+
+
+class GuardedCall:
+    """Handle for one admitted call; streams mark when their first token arrived."""
+
+    def __init__(self, probe: bool):
+        self.probe = probe
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        return (self.first_token_at or time.monotonic()) - self.started
+
+
+@contextmanager
+def guarded_call() -> Iterator[GuardedCall]:
+    """
+    Admit one Gemini call, or fail fast with LLMUnavailableError.
+
+    The call's outcome and latency feed back into the shared limit and
+    breaker. Errors that are not backend failures (e.g. blocked prompts)
+    count as neither success nor failure.
+    """
+    probe = _check_breaker()
+    slot = _acquire_slot()
+    if slot is None:
+        if probe:
+            _cache().delete("llm-guard:probe")
+        _record("shed")
+        raise LLMUnavailableError(
+            "The AI service is busy. Please try again in a moment.",
+            retry_after=guard_setting("overload_retry_after", 2),
+        )
+
+    _record("admitted")
+    call = GuardedCall(probe)
+    try:
+        yield call
+    except BaseException as e:
+        if is_backend_failure(e):
+            _on_failure(call, e)
+        elif call.probe:
+            _cache().delete("llm-guard:probe")
+        raise
+    else:
+        _on_success(call)
+    finally:
+        _release_slot(slot)
+
+
+def _on_success(call: GuardedCall) -> None:
+    _record("successes")
+    _record_outcome(failed=False)
+    if call.probe:
+        _close_breaker()
+
+    if call.latency > guard_setting("target_latency", 8.0):
+        _record("slow")
+        _decrease(f"latency {call.latency:.1f}s")
+    else:
+        _increase()
+
+
+def _on_failure(call: GuardedCall, e: BaseException) -> None:
+    _record("failures")
+    _record_outcome(failed=True)
+    _decrease(type(e).__name__)
+
+    if call.probe:
+        # Still failing: stay open for twice as long
+        previous = _cache().get("llm-guard:tripped") or guard_setting("open_seconds", 15)
+        _open_breaker(min(previous * 2, guard_setting("max_open_seconds", 120)))
+        return
+
+    rate, total = error_rate()
+    if total >= guard_setting("min_calls", 10) and rate >= guard_setting("error_threshold", 0.5):
+        seconds = guard_setting("open_seconds", 15)
+        # Only the first worker to notice trips the breaker
+        if _cache().add("llm-guard:tripped", seconds, timeout=None):
+            _open_breaker(seconds)
+
+
+def get_stats() -> dict:
+    """Process-local counters plus the shared limit and breaker state."""
+    with _stats_lock:
+        stats = dict(_stats)
+    rate, total = error_rate()
+    stats.update({
+        "limit": round(current_limit(), 2),
+        "breaker": breaker_state(),
+        "error_rate": round(rate, 3),
+        "window_calls": total,
+    })
+    return stats
@@ -0,0 +1,35 @@
+"""Helpers for pushing server-side events to open chat pages."""
+
+from __future__ import annotations
+
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+def chat_group_name(document_id, user_id) -> str:
+    """Channel layer group joined by every chat socket of a user/document pair."""
+    return f"chat_{document_id}_{user_id}"
+
+
+def notify_chat(document_id, user_id, event: dict) -> None:
+    """
+    Send an event to the chat group from synchronous code.
+
+    The event's ``type`` selects the consumer handler. Delivery is best-effort:
+    failures are logged and never raised to the caller.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    try:
+        async_to_sync(channel_layer.group_send)(
+            chat_group_name(document_id, user_id),
+            event,
+        )
+    except Exception as e:
+        logger.error(f"Error sending {event.get('type')} event: {str(e)}")
@@ -0,0 +1,269 @@
+"""Server-rendered page images for the document preview.
+
+The browser no longer has to download the whole PDF to show one page.
+PyMuPDF renders a first-page thumbnail during ingestion. Full pages are
+rendered at one of the allowed resolutions the first time they are
+requested. Renders go to an on-disk cache keyed by content hash, image
+name, resolution and JPEG quality. A key always maps to the same bytes,
+so responses carry a strong ETag and browsers may keep them indefinitely.
+
+Each content also gets a JSON layout sidecar (page count and page sizes).
+The preview uses it to reserve space for every page before any page is
+rendered. Like the blob cache, files are written with ``os.replace``, and
+the least recently used files are evicted past ``max_bytes``. Sidecars
+count toward the cap as well; every page request reads its content's
+layout, so a layout goes only after that content's pages.
+
+Concurrent misses for the same render are coalesced (see single_flight),
+so each one is downloaded and rendered once.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from . import single_flight
+from .storage import prepare_local_document
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_SUFFIX = ".json"
+
+_last_eviction = 0.0
+_eviction_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "renders": 0, "evictions": 0, "bytes_rendered": 0}
+
+
+def image_setting(name, default):
+    return getattr(settings, "PAGE_IMAGES", {}).get(name, default)
+
+
+def cache_dir() -> str:
+    path = image_setting("dir", "") or os.path.join(tempfile.gettempdir(), "insightdocs-pages")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _record(event: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[event] += amount
+
+
+def can_render(document) -> bool:
+    return document.is_pdf and bool(document.content_hash)
+
+
+def choose_dpi(requested) -> int:
+    """Nearest allowed resolution, so arbitrary values cannot fill the cache."""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return image_setting("default_dpi", 110)
+    return min(image_setting("dpis", [72, 110, 150]), key=lambda dpi: abs(dpi - requested))
+
+
+def _quality() -> int:
+    return image_setting("jpeg_quality", 80)
+
+
+def thumbnail_name() -> str:
+    return f"thumb-{image_setting('thumbnail_width', 240)}-q{_quality()}.jpg"
+
+
+def page_name(page: int, dpi: int) -> str:
+    return f"p{page}-{dpi}-q{_quality()}.jpg"
+
+
+def etag(content_hash: str, name: str) -> str:
+    """Strong validator: the same content, page, size and quality always render the same bytes."""
+    return f'"{content_hash[:32]}-{name}"'
+
+
+def _path(content_hash: str, name: str) -> str:
+    return os.path.join(cache_dir(), f"{content_hash}-{name}")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _jpeg(pixmap) -> bytes:
+    return pixmap.tobytes("jpeg", jpg_quality=_quality())
+
+
+def _render_layout(pdf) -> dict:
+    return {
+        "page_count": pdf.page_count,
+        "sizes": [[round(page.rect.width, 1), round(page.rect.height, 1)] for page in pdf],
+    }
+
+
+def _render_thumbnail(pdf) -> bytes:
+    import fitz
+
+    page = pdf[0]
+    zoom = image_setting("thumbnail_width", 240) / page.rect.width
+    return _jpeg(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False))
+
+
+def _render_page(pdf, page: int, dpi: int) -> bytes:
+    return _jpeg(pdf[page - 1].get_pixmap(dpi=dpi, alpha=False))
+
+
+def _cached(document, name: str, render: Callable) -> str:
+    """Path of the cached render, rendering it from the document on a miss."""
+    path = _path(document.content_hash, name)
+    if os.path.exists(path):
+        _record("hits")
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    return single_flight.run_once(
+        f"page-image:{document.content_hash}:{name}",
+        lambda: _render_to(document, path, render),
+        reload=lambda: path if os.path.exists(path) else None,
+    )
+
+
+def _render_to(document, path: str, render: Callable) -> str:
+    import fitz
+
+    # Rendered by a caller that finished just before this one got the lock
+    if os.path.exists(path):
+        return path
+
+    local_path, cleanup = prepare_local_document(document)
+    try:
+        with fitz.open(local_path) as pdf:
+            data = render(pdf)
+    finally:
+        cleanup()
+
+    _write_atomic(path, data)
+    _record("renders")
+    _record("bytes_rendered", len(data))
+    _maybe_evict()
+    return path
+
+
+def get_layout(document) -> dict:
+    """``{"page_count": n, "sizes": [[width, height], ...]}`` in PDF points."""
+    path = _cached(
+        document,
+        "layout" + LAYOUT_SUFFIX,
+        lambda pdf: json.dumps(_render_layout(pdf)).encode("utf-8"),
+    )
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def get_thumbnail(document) -> str:
+    return _cached(document, thumbnail_name(), _render_thumbnail)
+
+
+def get_page(document, page: int, dpi: int) -> Optional[str]:
+    """Path of the rendered page, or None if the document has no such page."""
+    if not 1 <= page <= get_layout(document)["page_count"]:
+        return None
+    return _cached(document, page_name(page, dpi), lambda pdf: _render_page(pdf, page, dpi))
+
+
+def prepare_previews(local_path: str, content_hash: str) -> None:
+    """
+    Render the layout and thumbnail from a local copy during ingestion.
+
+    Failures are logged, not raised: previews are rendered again on demand.
+    """
+    import fitz
+
+    try:
+        with fitz.open(local_path) as pdf:
+            if not pdf.page_count:
+                return
+            layout = json.dumps(_render_layout(pdf)).encode("utf-8")
+            thumbnail = _render_thumbnail(pdf)
+        _write_atomic(_path(content_hash, "layout" + LAYOUT_SUFFIX), layout)
+        _write_atomic(_path(content_hash, thumbnail_name()), thumbnail)
+        _record("renders", 2)
+        _record("bytes_rendered", len(layout) + len(thumbnail))
+    except Exception as e:
+        logger.error(f"Preview rendering failed for {content_hash[:12]}: {str(e)}")
+
+
+def _maybe_evict() -> None:
+    global _last_eviction
+    with _eviction_lock:
+        if time.monotonic() - _last_eviction < image_setting("eviction_interval", 60):
+            return
+        _last_eviction = time.monotonic()
+    evict()
+
+
+def evict() -> int:
+    """
+    Remove least recently used files until the cache fits its byte cap.
+
+    Layout sidecars are counted and evicted like renders.
+
+    Returns:
+        int: Number of files removed
+    """
+    max_bytes = image_setting("max_bytes", 256 * 1024 * 1024)
+    directory = cache_dir()
+
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file() or entry.name.endswith(".part"):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+
+    if removed:
+        _record("evictions", removed)
+        logger.info(f"Evicted {removed} page images and layouts from {directory}")
+    return removed
+
+
+def get_cache_stats() -> dict:
+    """Return process-local counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["renders"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
@@ -0,0 +1,195 @@
+"""Attach only the relevant pages of a PDF when the whole file is needed.
+
+Scanned documents, and questions that retrieval cannot match, fall back to
+sending the file itself, and the model then reads every page. In these
+cases a page set is picked instead, from three signals:
+
+1. pages the question names ("page 12", "pp. 3-5"),
+2. the page the user is viewing, plus the pages around it,
+3. pages whose indexed text best matches the question.
+
+Those pages are cut into a small PDF with PyMuPDF. The slice is uploaded
+once, and its handle is stored in the Gemini file cache under a key
+derived from (content hash, page set).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import file_cache, retrieval, single_flight
+from .gemini_chat import get_remote_file
+from .storage import prepare_local_document
+
+logger = logging.getLogger(__name__)
+
+PAGE_REF_RE = re.compile(
+    r"\b(?:pages?|pgs?\.?|pp?\.)\s*"
+    r"(\d{1,4}(?:\s*(?:,|and|&|-|–|to|through)\s*\d{1,4})*)",
+    re.IGNORECASE,
+)
+PAGE_RANGE_RE = re.compile(r"(\d+)(?:\s*(?:-|–|to|through)\s*(\d+))?")
+
+_stats_lock = threading.Lock()
+_stats = {"slices_used": 0, "slices_built": 0, "pages_sent": 0, "pages_total": 0}
+
+
+def slice_setting(name, default):
+    return getattr(settings, "PAGE_SLICES", {}).get(name, default)
+
+
+def _record(event: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[event] += amount
+
+
+def can_slice(document) -> bool:
+    return slice_setting("enabled", True) and (document.file.name or "").lower().endswith(".pdf")
+
+
+def page_references(question: str) -> List[int]:
+    """Pages named in the question, in the order they appear."""
+    pages: List[int] = []
+    for match in PAGE_REF_RE.finditer(question):
+        for start, end in PAGE_RANGE_RE.findall(match.group(1)):
+            first = int(start)
+            last = int(end) if end else first
+            if last < first:
+                first, last = last, first
+            # Bounded; the page budget trims the result anyway
+            pages.extend(range(first, min(last, first + 100) + 1))
+    return pages
+
+
+def matching_pages(index: Optional[retrieval.DocumentIndex], question: str, limit: int) -> List[int]:
+    """Pages whose indexed text best matches the question, best first."""
+    if index is None or index.bm25 is None:
+        return []
+    best = {}
+    for chunk, score in zip(index.chunks, index.bm25.scores(question)):
+        if score > 0 and score > best.get(chunk.page, 0):
+            best[chunk.page] = score
+    return sorted(best, key=best.get, reverse=True)[:limit]
+
+
+def select_pages(question: str, page_count: int, index=None, viewing_page: Optional[int] = None) -> List[int]:
+    """
+    Pages to attach for the question, in reading order.
+
+    Returns an empty list when there is no signal, or when the selection
+    would cover so much of the document that a slice is not worth building.
+    """
+    max_pages = slice_setting("max_pages", 8)
+    neighbours = slice_setting("neighbour_pages", 1)
+    selected: List[int] = []
+
+    def add(page):
+        if 1 <= page <= page_count and page not in selected and len(selected) < max_pages:
+            selected.append(page)
+
+    for page in page_references(question):
+        add(page)
+
+    anchors = [viewing_page] if viewing_page else []
+    if not selected:
+        anchors += matching_pages(index, question, slice_setting("matched_pages", 3))
+    for page in anchors:
+        add(page)
+    # Surrounding pages only fill whatever budget the anchors left
+    for page in anchors:
+        for offset in range(1, neighbours + 1):
+            add(page - offset)
+            add(page + offset)
+
+    if not selected or len(selected) > page_count * slice_setting("max_fraction", 0.5):
+        return []
+    return sorted(selected)
+
+
+def _runs(pages: List[int]) -> Iterator[Tuple[int, int]]:
+    """Consecutive runs of sorted page numbers as (first, last)."""
+    first = last = pages[0]
+    for page in pages[1:]:
+        if page != last + 1:
+            yield first, last
+            first = page
+        last = page
+    yield first, last
+
+
+def format_ranges(pages: List[int]) -> str:
+    """``[1, 2, 3, 7]`` -> ``"1-3, 7"``."""
+    if not pages:
+        return ""
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in _runs(pages))
+
+
+def slice_key(content_hash: str, pages: List[int]) -> str:
+    """Gemini file cache key of the slice: same content and pages, same key."""
+    return hashlib.sha256(f"{content_hash}:pages:{format_ranges(pages)}".encode("utf-8")).hexdigest()
+
+
+def write_slice(source_path: str, pages: List[int], target_path: str) -> None:
+    """Save the given 1-based pages of a PDF as a new PDF."""
+    import fitz
+
+    with fitz.open(source_path) as source, fitz.open() as pdf:
+        for first, last in _runs(pages):
+            pdf.insert_pdf(source, from_page=first - 1, to_page=last - 1)
+        pdf.save(target_path, garbage=3, deflate=True)
+
+
+def get_slice(document, pages: List[int], page_count: int):
+    """
+    Remote handle of a PDF holding only ``pages`` of the document.
+
+    Concurrent requests for the same slice are coalesced, so each one is
+    cut and uploaded once.
+    """
+    key = slice_key(document.content_hash, pages)
+    handle = file_cache.get_cached_file(key) or single_flight.run_once(
+        f"slice:{key}",
+        lambda: _build_slice(document, pages, key),
+        reload=lambda: file_cache.get_cached_file(key),
+    )
+    _record("slices_used")
+    _record("pages_sent", len(pages))
+    _record("pages_total", page_count)
+    return handle
+
+
+def _build_slice(document, pages: List[int], key: str):
+    local_path, cleanup = prepare_local_document(document)
+    fd, slice_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        write_slice(local_path, pages, slice_path)
+        logger.info(
+            f"Cut pages {format_ranges(pages)} of document {document.id} "
+            f"({os.path.getsize(slice_path)} bytes)"
+        )
+        handle = get_remote_file(slice_path, key)
+    finally:
+        cleanup()
+        os.remove(slice_path)
+
+    if not handle:
+        raise RuntimeError(f"Could not upload pages {format_ranges(pages)} of document {document.id}")
+    _record("slices_built")
+    return handle
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["pages_total"]
+    stats["page_ratio"] = round(stats["pages_sent"] / total, 3) if total else 0.0
+    return stats
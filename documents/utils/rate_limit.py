@@ -1,10 +1,56 @@
-"""Utility helpers for lightweight request rate limiting."""
+"""Utility helpers for lightweight request rate limiting.
+
+Limits are sliding windows. Each check-and-record is one atomic step: a
+Lua script when the coordination cache is (or is backed by) Redis, shared
+by all workers, and an in-process lock around a timestamp log otherwise.
+Several limits can be checked together; a hit is recorded only if none of
+them is exceeded.
+"""
 
 from __future__ import annotations
 
+import math
+import threading
+import time
+import uuid
+from collections import deque
 from dataclasses import dataclass
-
-from django.core.cache import cache
+from typing import Iterable, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+# KEYS: counters; ARGV: member, then (limit, window) per key.
+# Returns "0" when the hit was recorded, else seconds until it would fit.
+SLIDING_WINDOW_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local retry = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local window = tonumber(ARGV[i * 2 + 1])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        local wait = window
+        if oldest[2] then
+            wait = tonumber(oldest[2]) + window - now
+        end
+        retry = math.max(retry, wait)
+    end
+end
+if retry > 0 then
+    return tostring(retry)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[1])
+    redis.call('PEXPIRE', key, math.ceil(tonumber(ARGV[i * 2 + 1]) * 1000))
+end
+return '0'
+"""
+
+Rule = Tuple[str, int, int]
 
 
 @dataclass(frozen=True)
@@ -15,6 +61,95 @@ class RateLimitResult:
     retry_after: int
 
 
+class LocalSlidingWindow:
+    """Per-process sliding-window log guarded by a lock."""
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._calls = 0
+
+    def hit(self, rules: Iterable[Rule]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.SWEEP_EVERY == 0:
+                self._sweep(now)
+
+            retry = 0.0
+            for key, limit, window in rules:
+                hits = self._hits.setdefault(key, (window, deque()))[1]
+                while hits and hits[0] <= now - window:
+                    hits.popleft()
+                if len(hits) >= limit:
+                    retry = max(retry, (hits[0] + window - now) if hits else window)
+            if retry > 0:
+                return retry
+
+            for key, _, _ in rules:
+                self._hits[key][1].append(now)
+            return 0.0
+
+    def _sweep(self, now):
+        """Forget callers whose newest hit has left its window."""
+        idle = [key for key, (window, hits) in self._hits.items() if not hits or hits[-1] <= now - window]
+        for key in idle:
+            del self._hits[key]
+
+
+class RedisSlidingWindow:
+    """Sliding-window log in Redis sorted sets, updated by one script call."""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._script = None
+
+    def hit(self, rules: Iterable[Rule]) -> float:
+        client = self._cache._cache.get_client(write=True)
+        if self._script is None:
+            self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+        keys, args = [], [uuid.uuid4().hex]
+        for key, limit, window in rules:
+            keys.append(self._cache.make_and_validate_key(key))
+            args += [limit, window]
+        return float(self._script(keys=keys, args=args, client=client))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Redis-backed limiter when the coordination cache is Redis, else local."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            cache = caches[getattr(settings, "COORDINATION_CACHE_ALIAS", "default")]
+            # Counters change on every hit; a tiered cache's L1 must not serve them
+            cache = getattr(cache, "shared", cache)
+            if isinstance(cache, RedisCache):
+                _limiter = RedisSlidingWindow(cache)
+            else:
+                _limiter = LocalSlidingWindow()
+        return _limiter
+
+
+def hit(rules: Iterable[Rule]) -> RateLimitResult:
+    """Record one hit against every (key, limit, window) rule, unless one is exceeded."""
+    rules = [(f"rate-limit:{key}", limit, window) for key, limit, window in rules]
+    retry = get_limiter().hit(rules)
+    return RateLimitResult(retry > 0, math.ceil(retry) if retry > 0 else 0)
+
+
+def rate_limit_rule(scope: str, default_limit: int, default_window: int) -> Tuple[int, int]:
+    """(limit, window) for a scope from ``settings.RATE_LIMITS``."""
+    config = getattr(settings, "RATE_LIMITS", {}).get(scope, {})
+    return config.get("limit", default_limit), config.get("window", default_window)
+
+
 def _client_identifier(request) -> str:
     """Return a stable identifier for the caller (user id or IP)."""
     if request.user.is_authenticated:
@@ -37,42 +172,17 @@ def check_rate_limit(
     """
     Check if the caller has exceeded the configured limit for the scope.
 
-    The first call within the window will create the counter; subsequent calls
-    increment it until the limit is reached.
+    Allowed calls are recorded in the same atomic step as the check.
     """
     identifier = _client_identifier(request)
-    cache_key = f"rate-limit:{scope}:{identifier}"
-
-    current = cache.get(cache_key, 0)
-    if current >= limit:
-        retry_after = _cache_ttl(cache_key, fallback=window)
-        return RateLimitResult(True, retry_after)
-
-    _increment_counter(cache_key, window)
-    remaining_ttl = _cache_ttl(cache_key, fallback=window)
-    return RateLimitResult(False, remaining_ttl)
-
-
-def _increment_counter(cache_key: str, window: int) -> None:
-    """Increment the cached counter, initializing if required."""
-    added = cache.add(cache_key, 1, timeout=window)
-    if added:
-        return
-
-    try:
-        cache.incr(cache_key)
-    except ValueError:
-        cache.set(cache_key, 1, timeout=window)
-
-
-def _cache_ttl(cache_key: str, fallback: int) -> int:
-    """Best-effort TTL lookup with sensible fallback if unsupported."""
-    ttl = fallback
-    if hasattr(cache, "ttl"):
-        try:
-            val = cache.ttl(cache_key)
-            if isinstance(val, int) and val >= 0:
-                ttl = val
-        except NotImplementedError:
-            ttl = fallback
-    return max(int(ttl), 1)
\ No newline at end of file
+    return hit([(f"{scope}:{identifier}", limit, window)])
+
+
+def check_chat_rate_limit(user_id, document_id) -> RateLimitResult:
+    """Throttle chat messages per user (all documents) and per document."""
+    user_limit, user_window = rate_limit_rule("chat_user", 30, 60)
+    document_limit, document_window = rate_limit_rule("chat_document", 15, 60)
+    return hit([
+        (f"chat_user:{user_id}", user_limit, user_window),
+        (f"chat_document:{document_id}", document_limit, document_window),
+    ])
@@ -0,0 +1,192 @@
+"""Chunk-level lexical retrieval over extracted document text.
+
+Pages are split into overlapping chunks that remember their page and
+character offsets (persisted by ``chunk_index``). Chunks are ranked
+against the question with BM25, computed over NumPy posting arrays, and
+only the best passages that fit the token budget are sent to the model.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from django.conf import settings
+
+WORD_RE = re.compile(r"\S+")
+TERM_RE = re.compile(r"\w+")
+
+# Words too common to carry any ranking signal
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its of on or "
+    "so that the their then there these this to was what when where which who why "
+    "will with you your".split()
+)
+
+# Rough English average, good enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+TOKENS_PER_WORD = 1.3
+
+
+def retrieval_setting(name, default):
+    return getattr(settings, "RETRIEVAL", {}).get(name, default)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TERM_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """A passage of one page; ``start``/``end`` are character offsets in that page."""
+
+    page: int
+    start: int
+    end: int
+    text: str
+    token_count: int
+
+
+def chunk_page(page: int, text: str, chunk_tokens: int, overlap_tokens: int) -> List[Chunk]:
+    """Split one page into overlapping word windows."""
+    words = list(WORD_RE.finditer(text))
+    if not words:
+        return []
+
+    window = max(1, int(chunk_tokens / TOKENS_PER_WORD))
+    overlap = min(window - 1, int(overlap_tokens / TOKENS_PER_WORD))
+    step = window - overlap
+
+    chunks = []
+    for i in range(0, len(words), step):
+        span = words[i:i + window]
+        start, end = span[0].start(), span[-1].end()
+        chunk_text = text[start:end]
+        chunks.append(Chunk(page, start, end, chunk_text, estimate_tokens(chunk_text)))
+        if i + window >= len(words):
+            break
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a term-sorted posting list stored in NumPy arrays."""
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.size = len(texts)
+        self.vocab = {}
+        term_ids, doc_ids, freqs = [], [], []
+        doc_len = np.zeros(self.size, dtype=np.float32)
+
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc_id)
+                freqs.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        self._docs = np.asarray(doc_ids, dtype=np.int32)[order]
+        self._tf = np.asarray(freqs, dtype=np.float32)[order]
+
+        df = np.bincount(term_ids, minlength=len(self.vocab))
+        self._indptr = np.concatenate(([0], np.cumsum(df)))
+        self._idf = np.log1p((self.size - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        avg_len = float(doc_len.mean()) if self.size and doc_len.any() else 1.0
+        self._k1 = k1
+        self._norm = k1 * (1 - b + b * doc_len / avg_len)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query."""
+        ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        if not ids:
+            return np.zeros(self.size, dtype=np.float32)
+
+        starts, ends = self._indptr[ids], self._indptr[np.asarray(ids) + 1]
+        postings = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+        idf = np.repeat(self._idf[ids], ends - starts)
+        tf = self._tf[postings]
+        docs = self._docs[postings]
+
+        contrib = idf * tf * (self._k1 + 1) / (tf + self._norm[docs])
+        return np.bincount(docs, weights=contrib, minlength=self.size)
+
+
+class DocumentIndex:
+    """Chunks of one document plus the BM25 index used to rank them."""
+
+    def __init__(self, chunks: List[Chunk], page_count: int):
+        self.chunks = chunks
+        self.page_count = page_count
+        self.bm25 = BM25Index([c.text for c in chunks]) if chunks else None
+        self.text_chars = sum(c.end - c.start for c in chunks)
+
+    @property
+    def searchable(self) -> bool:
+        """False for documents with too little text, e.g. scanned PDFs."""
+        if not self.chunks or not self.page_count:
+            return False
+        min_chars = retrieval_setting("min_chars_per_page", 100)
+        return self.text_chars / self.page_count >= min_chars
+
+    def search(self, question: str, top_k: int, token_budget: int) -> List[Chunk]:
+        """
+        Best matching chunks that fit the token budget, in reading order.
+
+        Chunks overlapping an already selected passage are skipped.
+        """
+        if self.bm25 is None:
+            return []
+
+        scores = self.bm25.scores(question)
+        selected, used = [], 0
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0 or len(selected) >= top_k:
+                break
+            chunk = self.chunks[i]
+            if used + chunk.token_count > token_budget:
+                continue
+            if any(s.page == chunk.page and s.start < chunk.end and chunk.start < s.end for s in selected):
+                continue
+            selected.append(chunk)
+            used += chunk.token_count
+
+        return sorted(selected, key=lambda c: (c.page, c.start))
+
+
+_index_cache: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_index(content_hash: str) -> Optional[DocumentIndex]:
+    """Return the in-process index for the content hash, if built."""
+    with _index_lock:
+        index = _index_cache.get(content_hash)
+        if index is not None:
+            _index_cache.move_to_end(content_hash)
+        return index
+
+
+def put_index(content_hash: str, index: DocumentIndex) -> None:
+    """Keep a built index in the bounded in-process LRU."""
+    max_size = retrieval_setting("index_cache_size", 32)
+    with _index_lock:
+        _index_cache[content_hash] = index
+        _index_cache.move_to_end(content_hash)
+        while len(_index_cache) > max_size:
+            _index_cache.popitem(last=False)
+
+
+def evict_index(content_hash: str) -> None:
+    with _index_lock:
+        _index_cache.pop(content_hash, None)
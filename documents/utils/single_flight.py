@@ -0,0 +1,126 @@
+"""Coalesce concurrent executions of the same expensive work.
+
+Within a process, callers for a key share the first caller's future.
+Across daphne workers, the first caller holds a lock in the coordination
+cache. Other workers wait for that lock to be released, then ``reload``
+the artifact the leader produced instead of producing it again.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future
+from typing import Callable, Optional, TypeVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WAIT_INITIAL = 0.1
+WAIT_MAX = 1.0
+
+_flights: dict = {}
+_flights_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"leaders": 0, "joined": 0, "waited_remote": 0, "reloaded": 0}
+
+
+def single_flight_setting(name, default):
+    return getattr(settings, "SINGLE_FLIGHT", {}).get(name, default)
+
+
+def _cache():
+    return caches[getattr(settings, "COORDINATION_CACHE_ALIAS", "default")]
+
+
+def _record(event: str) -> None:
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def run_once(key: str, work: Callable[[], T], reload: Callable[[], Optional[T]]) -> T:
+    """
+    Run ``work()`` for the key unless another caller is already running it.
+
+    Args:
+        key: Identifies the work, e.g. ``prepare:<content hash>``
+        work: Produces the artifact
+        reload: Returns the artifact produced by another worker, or None if
+            it is not available (the other worker failed or gave up)
+
+    Returns:
+        The artifact, from this caller or from a concurrent one
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Future()
+
+    if not leader:
+        _record("joined")
+        try:
+            return flight.result()
+        except CancelledError:
+            # The leader's caller went away; this caller still needs the result
+            return run_once(key, work, reload)
+
+    _record("leaders")
+    try:
+        result = _run_locked(key, work, reload)
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    else:
+        flight.set_result(result)
+        return result
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+
+
+def _run_locked(key, work, reload):
+    lock_key = f"single-flight:{key}"
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + single_flight_setting("wait_timeout", 90)
+
+    while True:
+        if _cache().add(lock_key, token, timeout=single_flight_setting("lock_timeout", 120)):
+            try:
+                return work()
+            finally:
+                if _cache().get(lock_key) == token:
+                    _cache().delete(lock_key)
+
+        _record("waited_remote")
+        logger.info(f"Waiting for another worker to finish {key}")
+        if not _wait_for_release(lock_key, deadline):
+            logger.warning(f"Timed out waiting on {key}; doing the work here")
+            return work()
+
+        result = reload()
+        if result is not None:
+            _record("reloaded")
+            return result
+
+
+def _wait_for_release(lock_key, deadline) -> bool:
+    delay = WAIT_INITIAL
+    while _cache().get(lock_key) is not None:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, WAIT_MAX)
+    return True
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
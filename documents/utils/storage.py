@@ -1,17 +1,9 @@
 import os
-import tempfile
 from typing import Callable, Optional, Tuple
 
-import requests
+from documents.models import Document
 
-
-def _safe_remove(path: str) -> None:
-    try:
-        if path and os.path.exists(path):
-            os.remove(path)
-    except OSError:
-        # Ignore cleanup errors – temp files will eventually be removed by OS
-        pass
+from . import blob_cache
 
 
 def _get_local_field_path(field_file) -> Optional[str]:
@@ -37,19 +29,37 @@ def prepare_local_document(document) -> Tuple[str, Callable[[], None]]:
     if not file_url:
         raise RuntimeError("Document file is not accessible via URL.")
 
+    # Served from the shared disk cache; the blob stays cached after cleanup
     suffix = os.path.splitext(document.file.name or "")[1] or ".tmp"
-    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
-    try:
-        with os.fdopen(fd, "wb") as tmp_file, requests.get(
-            file_url, stream=True, timeout=30
-        ) as response:
-            response.raise_for_status()
-            for chunk in response.iter_content(1024 * 1024):
-                if chunk:
-                    tmp_file.write(chunk)
-    except Exception:
-        _safe_remove(tmp_path)
-        raise
-
-    return tmp_path, lambda: _safe_remove(tmp_path)
+    cached_path = blob_cache.fetch(document.file.name, file_url, suffix=suffix)
+    return cached_path, lambda: blob_cache.unpin(cached_path)
+
+
+def reuse_stored_content(document) -> bool:
+    """
+    Point a new Document at an already stored file with identical content.
+
+    Matching is by ``content_hash``. When a blob is reused the upload is not
+    sent to storage again, and every artifact keyed by the content hash
+    (Gemini handle, chunk index, cached answers) is shared.
+
+    Returns:
+        bool: True if an existing blob was reused
+    """
+    if not document.content_hash:
+        return False
+
+    existing = (
+        Document.objects.filter(content_hash=document.content_hash)
+        .exclude(file="")
+        .order_by("uploaded_at")
+        .first()
+    )
+    if existing is None:
+        return False
 
+    document.file = existing.file.name
+    if existing.ingestion_status == "ready":
+        document.ingestion_status = "ready"
+        document.ingested_at = existing.ingested_at
+    return True
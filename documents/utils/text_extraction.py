@@ -0,0 +1,68 @@
+"""Local per-page text extraction for uploaded documents."""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# DOCX and plain text have no physical pages; group paragraphs into
+# pseudo-pages of roughly this many characters so citations stay useful.
+PSEUDO_PAGE_CHARS = 3000
+
+
+def extract_pages(file_path: str) -> List[str]:
+    """
+    Extract text from a document, one string per page.
+
+    Returns an empty list for formats without extractable text (e.g. images).
+    Scanned PDFs return pages with little or no text.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == ".pdf":
+            return _extract_pdf(file_path)
+        if ext == ".docx":
+            return _extract_docx(file_path)
+        if ext == ".txt":
+            return _extract_txt(file_path)
+    except Exception as e:
+        logger.error(f"Text extraction failed for {file_path}: {str(e)}")
+    return []
+
+
+def _extract_pdf(file_path: str) -> List[str]:
+    import fitz
+
+    with fitz.open(file_path) as pdf:
+        return [page.get_text() for page in pdf]
+
+
+def _extract_docx(file_path: str) -> List[str]:
+    import docx
+
+    paragraphs = [p.text for p in docx.Document(file_path).paragraphs]
+    return _group_paragraphs(paragraphs)
+
+
+def _extract_txt(file_path: str) -> List[str]:
+    with open(file_path, encoding="utf-8", errors="replace") as fh:
+        return _group_paragraphs(fh.read().split("\n\n"))
+
+
+def _group_paragraphs(paragraphs: List[str]) -> List[str]:
+    pages, current, size = [], [], 0
+    for paragraph in paragraphs:
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and size + len(paragraph) > PSEUDO_PAGE_CHARS:
+            pages.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph)
+    if current:
+        pages.append("\n\n".join(current))
+    return pages
@@ -0,0 +1,312 @@
+"""Two-tier cache backend: a small in-process LRU in front of a shared cache.
+
+Reads are served from the worker's own L1 when possible. Otherwise they
+fall back to the shared L2 (Redis) and fill L1 on the way. L1 entries live
+for at most ``L1_TIMEOUT`` seconds, which bounds how stale a worker can be.
+
+Every write goes to L2 first. The key is then dropped from this worker's
+L1 and published on a Redis channel so the other workers drop it too. A
+worker that is not subscribed cannot see invalidations, so it bypasses L1
+until it is. It also clears L1 whenever it (re)subscribes.
+
+Counters and locks (``add``, ``incr``) always go to L2. Backend-specific
+operations such as scripts should use ``shared``.
+
+Configure it like RedisCache, plus optional L1 settings::
+
+    "BACKEND": "documents.utils.tiered_cache.TieredCache",
+    "LOCATION": "redis://...",
+    "OPTIONS": {"L1_MAX_ENTRIES": 1000, "L1_TIMEOUT": 5},
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.redis import RedisCache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Published instead of a key list when the whole cache was cleared
+CLEAR_ALL = "*"
+
+RESUBSCRIBE_INITIAL = 1.0
+RESUBSCRIBE_MAX = 30.0
+
+
+class _Tier:
+    """L1 entries, stats and invalidation listener shared by every instance of one cache."""
+
+    def __init__(self, shared: BaseCache, max_entries: int, timeout: float, channel: str):
+        self.shared = shared
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so a read racing one does not fill L1
+        self._generation = 0
+        self.stats = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "invalidations_sent": 0,
+            "invalidations_received": 0,
+            "resets": 0,
+        }
+
+        self.listening = not isinstance(shared, RedisCache)
+        if not self.listening:
+            threading.Thread(target=self._listen, name="tiered-cache-invalidation", daemon=True).start()
+
+    def record(self, event: str, count: int = 1) -> None:
+        with self._lock:
+            self.stats[event] += count
+
+    # L1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= now:
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, generation: int) -> None:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.timeout, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def drop(self, keys) -> None:
+        with self._lock:
+            self._generation += 1
+            if CLEAR_ALL in keys:
+                self._entries.clear()
+                return
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    # Invalidation
+
+    def publish(self, keys) -> None:
+        """Drop the keys here, then tell the other workers to drop them."""
+        self.drop(keys)
+        if not isinstance(self.shared, RedisCache):
+            return
+        try:
+            client = self.shared._cache.get_client(write=True)
+            client.publish(self.channel, json.dumps({"origin": self.origin, "keys": list(keys)}))
+            self.record("invalidations_sent")
+        except Exception as e:
+            logger.error(f"Cache invalidation publish failed: {str(e)}")
+
+    def _listen(self):
+        delay = RESUBSCRIBE_INITIAL
+        while True:
+            try:
+                pubsub = self.shared._cache.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published before this point was missed
+                self.drop([CLEAR_ALL])
+                self.listening = True
+                logger.info(f"Listening for cache invalidations on {self.channel}")
+                delay = RESUBSCRIBE_INITIAL
+                for message in pubsub.listen():
+                    self._on_message(message["data"])
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener lost ({str(e)}); retrying in {delay:.0f}s")
+
+            self.listening = False
+            self.drop([CLEAR_ALL])
+            self.record("resets")
+            time.sleep(delay)
+            delay = min(delay * 2, RESUBSCRIBE_MAX)
+
+    def _on_message(self, data) -> None:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning(f"Ignoring malformed cache invalidation on {self.channel}")
+            return
+        if message.get("origin") == self.origin:
+            return
+        self.drop(message.get("keys", []))
+        self.record("invalidations_received")
+
+
+_tiers: dict = {}
+_tiers_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """Django cache backend with a per-process LRU (L1) over a shared cache (L2)."""
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        l1_max_entries = int(options.pop("L1_MAX_ENTRIES", 1000))
+        l1_timeout = float(options.pop("L1_TIMEOUT", 5))
+        channel = options.pop("INVALIDATION_CHANNEL", None)
+        backend = options.pop("SHARED_BACKEND", "django.core.cache.backends.redis.RedisCache")
+
+        super().__init__(params)
+        channel = channel or f"cache-invalidation:{self.key_prefix or 'default'}"
+
+        # Django builds a backend instance per thread; they all share one L1
+        # and one L2 (and so one connection pool) per process.
+        tier_key = (backend, str(location), self.key_prefix, channel)
+        with _tiers_lock:
+            tier = _tiers.get(tier_key)
+            if tier is None:
+                shared = import_string(backend)(location, {**params, "OPTIONS": options})
+                tier = _tiers[tier_key] = _Tier(shared, l1_max_entries, l1_timeout, channel)
+        self._tier = tier
+
+    @property
+    def shared(self) -> BaseCache:
+        """The L2 backend, for operations that must not touch L1."""
+        return self._tier.shared
+
+    def get(self, key, default=None, version=None):
+        tier = self._tier
+        l1_key = self.make_and_validate_key(key, version=version)
+        use_l1 = tier.listening
+        if use_l1:
+            value = tier.get(l1_key)
+            if value is not _MISSING:
+                tier.record("l1_hits")
+                return value
+
+        generation = tier.generation()
+        value = tier.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            tier.record("misses")
+            return default
+
+        tier.record("l2_hits")
+        if use_l1:
+            tier.put(l1_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None):
+        tier = self._tier
+        use_l1 = tier.listening
+        found, remote = {}, []
+        for key in keys:
+            value = tier.get(self.make_and_validate_key(key, version=version)) if use_l1 else _MISSING
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        tier.record("l1_hits", len(found))
+        if not remote:
+            return found
+
+        generation = tier.generation()
+        fetched = tier.shared.get_many(remote, version=version)
+        tier.record("l2_hits", len(fetched))
+        tier.record("misses", len(remote) - len(fetched))
+        if use_l1:
+            for key, value in fetched.items():
+                tier.put(self.make_and_validate_key(key, version=version), value, generation)
+        found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self._tier.listening and self._tier.get(self.make_and_validate_key(key, version=version)) is not _MISSING:
+            return True
+        return self._tier.shared.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._tier.shared.set(key, value, timeout=self._shared_timeout(timeout), version=version)
+        self._invalidate([key], version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._tier.shared.add(key, value, timeout=self._shared_timeout(timeout), version=version)
+        if added:
+            self._invalidate([key], version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._tier.shared.touch(key, timeout=self._shared_timeout(timeout), version=version)
+
+    def delete(self, key, version=None):
+        deleted = self._tier.shared.delete(key, version=version)
+        self._invalidate([key], version)
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = self._tier.shared.incr(key, delta, version=version)
+        self._invalidate([key], version)
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        value = self._tier.shared.decr(key, delta, version=version)
+        self._invalidate([key], version)
+        return value
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._tier.shared.set_many(data, timeout=self._shared_timeout(timeout), version=version)
+        self._invalidate(list(data), version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._tier.shared.delete_many(keys, version=version)
+        self._invalidate(keys, version)
+
+    def clear(self):
+        self._tier.shared.clear()
+        self._tier.publish([CLEAR_ALL])
+
+    def _shared_timeout(self, timeout):
+        # Resolve our own default so L2's TIMEOUT setting cannot diverge from ours
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _invalidate(self, keys, version) -> None:
+        self._tier.publish([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def get_stats(self) -> dict:
+        """Lookups served by each tier, per process."""
+        tier = self._tier
+        with tier._lock:
+            stats = dict(tier.stats)
+        lookups = stats["l1_hits"] + stats["l2_hits"] + stats["misses"]
+        reached_l2 = stats["l2_hits"] + stats["misses"]
+        stats.update({
+            "l1_entries": tier.size(),
+            "l1_listening": tier.listening,
+            "l1_hit_ratio": round(stats["l1_hits"] / lookups, 3) if lookups else 0.0,
+            "l2_hit_ratio": round(stats["l2_hits"] / reached_l2, 3) if reached_l2 else 0.0,
+            "hit_ratio": round((stats["l1_hits"] + stats["l2_hits"]) / lookups, 3) if lookups else 0.0,
+        })
+        return stats
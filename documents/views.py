@@ -1,14 +1,34 @@
 # views.py
+import json
 import logging
+import os
 
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_http_methods, require_POST
 
-from .forms import DocumentUploadForm
-from .models import Document, ChatSession, ChatMessage
+from accounts import emailer
+
+from . import storage_backends
+from .forms import DocumentUploadForm, validate_upload
+from .models import ChatSession, Document, FileReplica, UploadSession
+from .utils import answer_cache, blob_cache, chunked_upload, document_cache, document_list, file_cache, job_queue, keyset, llm_guard, page_images, page_slices, single_flight
+from .utils.file_poller import get_file_poller
+from .utils.history import message_page, serialize_message
+from .utils.ingestion import start_ingestion
+from .utils.llm_executor import get_context_executor, get_llm_executor
 from .utils.rate_limit import check_rate_limit
+from .utils.storage import reuse_stored_content
 
 logger = logging.getLogger(__name__)
 
@@ -26,17 +46,7 @@ def upload_view(request):
     form = DocumentUploadForm(request.POST or None, request.FILES or None)
 
     if request.method == "POST":
-        upload_rate_limit = getattr(settings, "RATE_LIMITS", {}).get(
-            "upload",
-            {"limit": 5, "window": 60},
-        )
-        limit_result = check_rate_limit(
-            request,
-            scope="upload",
-            limit=upload_rate_limit.get("limit", 5),
-            window=upload_rate_limit.get("window", 60),
-        )
-
+        limit_result = _check_upload_rate_limit(request)
         if limit_result.limited:
             messages.error(
                 request,
@@ -47,25 +57,173 @@ def upload_view(request):
 
         if form.is_valid():
             document = form.save(commit=False)
-            document.owner = request.user
-            document.original_name = document.file.name
-            document.file.file.content_type = "application/pdf"
-            if not document.title:
-                document.title = document.original_name
-            document.save()
-            
-            # Create a chat session
-            ChatSession.objects.create(document=document, user=request.user)
-            
+            document = _save_document(
+                document,
+                request.user,
+                content_hash=getattr(form.cleaned_data["file"], "sha256", ""),
+            )
             return redirect("chat", document_id=document.id)
         else:
             messages.error(request, "Something went wrong while uploading your file.")
 
-    documents = Document.objects.filter(owner=request.user).order_by('-uploaded_at')
-    context = {"form": form, "recent_documents": documents}
+    page = document_list.first_page(request.user.id)
+    context = {
+        "form": form,
+        "recent_documents": page["documents"],
+        "documents_cursor": page["next_cursor"],
+    }
     return render(request, "upload.html", context)
 
 
+def _check_upload_rate_limit(request):
+    upload_rate_limit = getattr(settings, "RATE_LIMITS", {}).get(
+        "upload",
+        {"limit": 5, "window": 60},
+    )
+    return check_rate_limit(
+        request,
+        scope="upload",
+        limit=upload_rate_limit.get("limit", 5),
+        window=upload_rate_limit.get("window", 60),
+    )
+
+
+@transaction.atomic
+def _save_document(document, user, content_hash=""):
+    """
+    Store a new upload, open its chat session and queue ingestion.
+    Atomic, so background jobs queued on commit find the Document row.
+    """
+    document.owner = user
+    document.original_name = document.file.name
+    if not document.title:
+        document.title = document.original_name
+
+    # Identical content is stored once; only new content is uploaded
+    document.content_hash = content_hash
+    if not reuse_stored_content(document):
+        document.file.file.content_type = "application/pdf"
+    document.save()
+
+    # Create a chat session
+    ChatSession.objects.create(document=document, user=user)
+
+    # Prepare the document for chat while the user lands on the chat page
+    if document.ingestion_status != "ready":
+        transaction.on_commit(lambda: start_ingestion(document.id))
+    return document
+
+
+@login_required(login_url='login')
+@require_POST
+def upload_session_create_view(request):
+    """
+    Start a resumable chunked upload.
+    Expects JSON with ``filename``, ``size`` and optionally ``title``; the
+    file is then sent in chunks to the returned session.
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+        filename = os.path.basename(str(data["filename"]))
+        size = int(data["size"])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "filename and size are required."}, status=400)
+
+    limit_result = _check_upload_rate_limit(request)
+    if limit_result.limited:
+        return JsonResponse(
+            {"error": "You have reached the upload rate limit.", "retry_after": limit_result.retry_after},
+            status=429,
+        )
+
+    try:
+        if size <= 0:
+            raise ValidationError("The submitted file is empty.")
+        validate_upload(filename, size)
+    except ValidationError as e:
+        return JsonResponse({"error": e.messages[0]}, status=400)
+
+    chunked_upload.purge_expired()
+    session = UploadSession.objects.create(
+        owner=request.user,
+        filename=filename[:255],
+        title=str(data.get("title") or "")[:255],
+        size=size,
+    )
+    return JsonResponse(_describe_upload(session), status=201)
+
+
+@login_required(login_url='login')
+@require_http_methods(["GET", "PUT"])
+def upload_session_view(request, upload_id):
+    """
+    GET reports the acknowledged offset an interrupted upload resumes from.
+    PUT appends the raw request body as the chunk starting at the
+    ``Upload-Offset`` header; the last chunk turns the upload into a document.
+    """
+    session = get_object_or_404(UploadSession, pk=upload_id, owner=request.user)
+    if request.method == "GET" or session.status == "complete":
+        return JsonResponse(_describe_upload(session))
+
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        return JsonResponse({"error": "Upload-Offset header is required."}, status=400)
+
+    try:
+        session = chunked_upload.append_chunk(session, offset, request)
+    except chunked_upload.UploadConflict as e:
+        return JsonResponse({**_describe_upload(session), "error": str(e)}, status=409)
+    except chunked_upload.UploadRejected as e:
+        return JsonResponse({**_describe_upload(session), "error": str(e)}, status=413)
+
+    if session.received == session.size:
+        _finish_upload(session)
+    return JsonResponse(_describe_upload(session))
+
+
+def _finish_upload(session):
+    path, content_hash = chunked_upload.complete(session)
+    with transaction.atomic():
+        # A retried final chunk must not create a second document
+        if not UploadSession.objects.filter(pk=session.pk, status="uploading").update(status="complete"):
+            session.refresh_from_db()
+            return
+        with open(path, "rb") as staged:
+            document = Document(title=session.title, file=File(staged, name=session.filename))
+            _save_document(document, session.owner, content_hash=content_hash)
+        session.status = "complete"
+        session.document = document
+        session.save(update_fields=["status", "document", "updated_at"])
+    chunked_upload.discard(session)
+
+
+def _describe_upload(session):
+    data = chunked_upload.describe(session)
+    if session.document_id:
+        data["redirect"] = reverse("chat", args=[session.document_id])
+    return data
+
+
+@login_required(login_url='login')
+def staged_file_view(request, name):
+    """Serve an upload to its owner until it has been copied to remote storage."""
+    staged = storage_backends.STAGED_PREFIX + name
+    storage = storage_backends.document_storage()
+
+    if not Document.objects.filter(file=staged, owner=request.user).exists():
+        # Already replicated; the documents now point at the remote copy
+        replica = FileReplica.objects.filter(name=staged, state="replicated").first()
+        if replica and Document.objects.filter(file=replica.remote_name, owner=request.user).exists():
+            return redirect(storage.remote.url(replica.remote_name))
+        raise Http404("No such file.")
+
+    try:
+        return FileResponse(storage.staging.open(name), filename=os.path.basename(name))
+    except FileNotFoundError:
+        raise Http404("No such file.")
+
+
 @login_required(login_url='login')
 def subscription_view(request):
     """Subscription / billing page view."""
@@ -79,7 +237,9 @@ def chat_view(request, document_id):
     All real-time communication is handled via WebSocket in consumers.py
     """
     # Verify user has permission to access this document
-    document = get_object_or_404(Document, id=document_id, owner=request.user)
+    document = document_cache.get_document(document_id, owner_id=request.user.id)
+    if document is None:
+        raise Http404("No Document matches the given query.")
 
     # Ensure session exists
     session, created = ChatSession.objects.get_or_create(
@@ -87,18 +247,177 @@ def chat_view(request, document_id):
         user=request.user
     )
 
-    # Get chat history for initial page load
-    chat_history_qs = ChatMessage.objects.filter(session=session).order_by('created_at')
+    # Only the newest messages; older pages load on scroll
+    history = message_page(session)
     
     # Get recent documents for sidebar
-    recent_docs = Document.objects.filter(owner=request.user).exclude(id=document.id).order_by('-uploaded_at')[:5]
+    recent_docs = document_list.recent_documents(request.user.id, exclude_id=document.id, limit=5)
 
     return render(request, "chat.html", {
         "document": document,
-        "chat_history": chat_history_qs,
+        "chat_history": history["messages"],
+        "history_cursor": history["next_cursor"],
         "recent_documents": recent_docs,
     })
+
+
+@login_required(login_url='login')
+def chat_history_view(request, document_id):
+    """
+    Older chat messages as JSON, for scrolling back through long sessions.
+    Pass ``before`` (the cursor from the previous page) and optionally ``limit``.
+    """
+    document = document_cache.get_document(document_id, owner_id=request.user.id)
+    if document is None:
+        raise Http404("No Document matches the given query.")
+    session = get_object_or_404(ChatSession, document=document, user=request.user)
+
+    before = request.GET.get("before")
+    if before is not None and keyset.decode_cursor(before) is None:
+        return JsonResponse({"error": "Invalid history cursor."}, status=400)
+    try:
+        limit = int(request.GET.get("limit", 0)) or None
+    except ValueError:
+        limit = None
+
+    page = message_page(session, before=before, limit=limit)
+    return JsonResponse({
+        "messages": [serialize_message(msg) for msg in page["messages"]],
+        "next_cursor": page["next_cursor"],
+    })
     
 
+def _page_image_response(request, document, name, render):
+    """A cached page render, revalidated by ETag and kept by the browser."""
+    tag = page_images.etag(document.content_hash, name)
+    response = get_conditional_response(request, etag=tag)
+    if response is None:
+        try:
+            path = render()
+        except Exception as e:
+            logger.error(f"Could not render {name} of document {document.id}: {str(e)}")
+            raise Http404("No preview for this document.")
+        if path is None:
+            raise Http404("No such page.")
+        response = FileResponse(open(path, "rb"), content_type="image/jpeg")
+    response["ETag"] = tag
+    response["Cache-Control"] = f"private, max-age={page_images.image_setting('max_age', 365 * 24 * 60 * 60)}, immutable"
+    return response
+
+
+def _previewable_document(request, document_id):
+    document = document_cache.get_document(document_id, owner_id=request.user.id)
+    if document is None or not page_images.can_render(document):
+        raise Http404("No preview for this document.")
+    return document
+
+
+@login_required(login_url='login')
+def document_pages_view(request, document_id):
+    """
+    Page layout of a PDF for the lazily loaded preview: size and image URL
+    of every page. Pass ``dpi`` to choose the resolution of the images.
+    """
+    document = _previewable_document(request, document_id)
+    try:
+        layout = page_images.get_layout(document)
+    except Exception as e:
+        logger.error(f"Could not read page layout of document {document.id}: {str(e)}")
+        raise Http404("No preview for this document.")
+
+    dpi = page_images.choose_dpi(request.GET.get("dpi"))
+    return JsonResponse({
+        "page_count": layout["page_count"],
+        "pages": [
+            {
+                "number": number,
+                "width": width,
+                "height": height,
+                "url": f"{reverse('page_image', args=[document.id, number])}?dpi={dpi}",
+            }
+            for number, (width, height) in enumerate(layout["sizes"], start=1)
+        ],
+    })
+
+
+@login_required(login_url='login')
+def page_image_view(request, document_id, page):
+    """One page rendered at the requested (nearest allowed) resolution."""
+    document = _previewable_document(request, document_id)
+    dpi = page_images.choose_dpi(request.GET.get("dpi"))
+    return _page_image_response(
+        request,
+        document,
+        page_images.page_name(page, dpi),
+        lambda: page_images.get_page(document, page, dpi),
+    )
+
+
+@login_required(login_url='login')
+def thumbnail_view(request, document_id):
+    """First-page thumbnail, rendered during ingestion."""
+    document = _previewable_document(request, document_id)
+    return _page_image_response(
+        request,
+        document,
+        page_images.thumbnail_name(),
+        lambda: page_images.get_thumbnail(document),
+    )
+
+
+@login_required(login_url='login')
+def document_list_view(request):
+    """
+    The user's documents as JSON, newest first.
+    Pass ``before`` (the cursor from the previous page) and optionally ``limit``.
+    """
+    before = request.GET.get("before")
+    if before is not None and keyset.decode_cursor(before) is None:
+        return JsonResponse({"error": "Invalid list cursor."}, status=400)
+    try:
+        limit = int(request.GET.get("limit", 0)) or None
+    except ValueError:
+        limit = None
+
+    if before or limit:
+        page = document_list.document_page(request.user.id, before=before, limit=limit)
+    else:
+        page = document_list.first_page(request.user.id)
+
+    return JsonResponse({
+        "documents": [document_list.serialize_document(doc) for doc in page["documents"]],
+        "next_cursor": page["next_cursor"],
+    })
+
+
+def _tier_stats(cache):
+    """Per-tier hit ratios when the cache is tiered."""
+    get_stats = getattr(cache, "get_stats", None)
+    return get_stats() if get_stats else {"backend": type(cache).__name__}
+
+
+@staff_member_required
+def metrics_view(request):
+    """Expose process-local performance counters for operators."""
+    return JsonResponse({
+        "gemini_file_cache": file_cache.get_cache_stats(),
+        "blob_cache": blob_cache.get_cache_stats(),
+        "answer_cache": answer_cache.get_cache_stats(),
+        "llm_executor": get_llm_executor().metrics(),
+        "context_executor": get_context_executor().metrics(),
+        "llm_guard": llm_guard.get_stats(),
+        "file_uploads": get_file_poller().metrics(),
+        "single_flight": single_flight.get_stats(),
+        "document_list_cache": document_list.get_cache_stats(),
+        "document_cache": document_cache.get_cache_stats(),
+        "shared_cache": _tier_stats(caches["default"]),
+        "job_queue": job_queue.get_stats(),
+        "replication": storage_backends.get_stats(),
+        "email": emailer.get_stats(),
+        "page_images": page_images.get_cache_stats(),
+        "page_slices": page_slices.get_stats(),
+    })
+
+
 def coming_soon(request):
     return render(request, 'coming-soon.html')
\ No newline at end of file
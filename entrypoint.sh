@@ -22,5 +22,11 @@ else:
     print("Superuser already exists!")
 END
 
+# Background jobs (document ingestion); set RUN_JOB_WORKER=false when a
+# separate worker process is deployed
+if [ "${RUN_JOB_WORKER:-true}" = "true" ]; then
+    python manage.py run_worker &
+fi
+
 # Start your application
 exec daphne InsightDocs_AI.asgi:application --bind 0.0.0.0:$PORT
\ No newline at end of file